@@ -0,0 +1,67 @@
+"""Prompt tokens billed at the full rate with and without instruction prefix caching.
+
+Runs single-call generation over synthetic transcripts against a
+FakeProvider, once outside and once inside a prefix_cache_session, and
+reports the request trace totals (llm_tracing): prompt tokens, the part
+served from the context cache, and the cost at the given per-1M prices. The
+run uses a throwaway DB and trace file in a temp directory. Run from the
+repository root:
+
+    python benchmarks/bench_context_cache.py --calls 500
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.db_manage import initialize_database
+from utils import llm_tracing
+from utils.context_cache import prefix_cache_session
+from utils.llm_providers import FakeProvider
+from utils.qa_utils import generate_qa_for_calls, TokenBucketLimiter
+from bench_prompt_packing import build_calls
+
+def run(model, calls, use_session):
+    limiter = TokenBucketLimiter(100000, 1000000000)
+    if use_session:
+        with prefix_cache_session():
+            results = list(generate_qa_for_calls(calls, model, max_workers=8, limiter=limiter))
+    else:
+        results = list(generate_qa_for_calls(calls, model, max_workers=8, limiter=limiter))
+    records = [r for r in llm_tracing.read_records() if r["model"] == model.model_name]
+    return {
+        "covered": sum(1 for _, qa_pairs, error in results if qa_pairs and not error),
+        "requests": len(records),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+        "cached_tokens": sum(r["cached_tokens"] for r in records),
+        "cost_usd": sum(r["cost_usd"] or 0.0 for r in records),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--input-price", default="0.10", help="USD per 1M prompt tokens")
+    parser.add_argument("--output-price", default="0.40", help="USD per 1M response tokens")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_context_cache_"))
+    os.makedirs("DB", exist_ok=True)
+    initialize_database()
+    os.environ["LLM_MODEL_PRICES"] = json.dumps({"fake": [args.input_price, args.output_price]})
+
+    calls = build_calls(args.calls)
+    scale = 1000 / len(calls)
+    print(f"{'mode':<16} {'covered':>8} {'requests':>9} {'prompt tok/1k':>14} {'cached tok/1k':>14} "
+          f"{'full-rate tok/1k':>17} {'cost/1k':>9}")
+    # Model names differ per mode so the second run is not served from the response cache
+    for mode, model_name, use_session in [("no cache", "fake-nocache", False), ("prefix cache", "fake-cache", True)]:
+        stats = run(FakeProvider(model_name), calls, use_session)
+        full_rate = stats["prompt_tokens"] - stats["cached_tokens"]
+        print(f"{mode:<16} {stats['covered']:>8} {stats['requests']:>9} {stats['prompt_tokens'] * scale:>14.0f} "
+              f"{stats['cached_tokens'] * scale:>14.0f} {full_rate * scale:>17.0f} ${stats['cost_usd'] * scale:>8.4f}")
+
+if __name__ == "__main__":
+    main()
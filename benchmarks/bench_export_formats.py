@@ -0,0 +1,100 @@
+"""Size and speed comparison of the call export/import formats.
+
+Builds a synthetic transcript-heavy calls table in an in-memory SQLite DB,
+exports it in every supported format and reads it back (full and
+column-projected). Run from the repository root:
+
+    python benchmarks/bench_export_formats.py --rows 20000
+"""
+import argparse
+import io
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from utils.data_formats import CALL_EXPORT_COLUMNS, write_parquet, write_arrow, read_columns
+
+WORDS = ("esa letter landlord housing pet dog cat therapist state law price refund "
+         "email phone appointment renewal travel airline document approval").split()
+
+class NamedBytesIO(io.BytesIO):
+    """BytesIO with a name, mimicking Streamlit's UploadedFile."""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+def build_db(rows, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE calls (call_id TEXT PRIMARY KEY, transcript TEXT, timestamp TEXT)")
+    def transcript():
+        turns = []
+        for i in range(rng.randint(10, 60)):
+            role = "Agent" if i % 2 == 0 else "User"
+            turns.append(f"{role}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))))
+        return "\n".join(turns)
+    conn.executemany("INSERT INTO calls VALUES (?, ?, ?)",
+                     ((f"call_{i:08d}", transcript(), "2025-01-01 00:00:00") for i in range(rows)))
+    return conn
+
+def cursor_batches(conn, batch_size=1000):
+    cursor = conn.execute("SELECT call_id, transcript, timestamp FROM calls")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+def write_legacy(conn, export_format):
+    names = [name for name, _ in CALL_EXPORT_COLUMNS]
+    df = pd.DataFrame([dict(zip(names, row)) for row in conn.execute("SELECT call_id, transcript, timestamp FROM calls")])
+    if export_format == "CSV":
+        return df.to_csv(index=False).encode("utf-8")
+    if export_format == "JSONL":
+        return df.to_json(orient="records", lines=True).encode("utf-8")
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--skip-excel", action="store_true", help="Excel is very slow on large inputs")
+    args = parser.parse_args()
+
+    conn = build_db(args.rows)
+    formats = [("CSV", "csv"), ("JSONL", "jsonl"), ("Excel", "xlsx"), ("Parquet", "parquet"), ("Arrow", "arrow")]
+    if args.skip_excel:
+        formats = [f for f in formats if f[0] != "Excel"]
+
+    print(f"{'format':<8} {'size MB':>9} {'write s':>9} {'read all s':>11} {'read id s':>10}")
+    for export_format, extension in formats:
+        if export_format == "Parquet":
+            data, write_s = timed(lambda: write_parquet(cursor_batches(conn), CALL_EXPORT_COLUMNS))
+        elif export_format == "Arrow":
+            data, write_s = timed(lambda: write_arrow(cursor_batches(conn), CALL_EXPORT_COLUMNS))
+        else:
+            data, write_s = timed(lambda: write_legacy(conn, export_format))
+
+        if export_format == "JSONL":
+            _, read_all_s = timed(lambda: pd.read_json(io.BytesIO(data), lines=True))
+            read_id_s = read_all_s  # JSONL has no column projection
+        else:
+            names = [name for name, _ in CALL_EXPORT_COLUMNS]
+            _, read_all_s = timed(lambda: read_columns(NamedBytesIO(data, f"x.{extension}"), names))
+            _, read_id_s = timed(lambda: read_columns(NamedBytesIO(data, f"x.{extension}"), ["Call ID"]))
+
+        print(f"{export_format:<8} {len(data) / 1e6:>9.2f} {write_s:>9.3f} {read_all_s:>11.3f} {read_id_s:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Near-duplicate collapse and lookup on a synthetic project of QA pairs.
+
+Fills a throwaway DB with random questions plus reworded copies of some of
+them (one word swapped, one added), then times computing the MinHash
+signatures, finding the near-duplicate clusters and single-question lookups
+through the LSH index, and reports how many of the planted copies were found.
+Run from the repository root:
+
+    python benchmarks/bench_near_duplicates.py --pairs 300000 --threshold 0.6
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import db
+from utils.db import AppDatabase, get_db_connection
+from utils.near_duplicates import (sync_minhash_signatures, find_near_duplicate_clusters, get_near_duplicate_index,
+                                   find_near_duplicate)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=300000, help="Distinct questions before the reworded copies")
+    parser.add_argument("--copies", type=float, default=0.2, help="Share of questions that get a reworded copy")
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_near_duplicates_"), "bench.db")
+    AppDatabase.initialize(force_recreate=True)
+    AppDatabase.signup("bench", "x")
+    AppDatabase.create_project(1, "bench")
+
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    questions, copies = [], {}
+    for _ in range(args.pairs):
+        words = rng.choices(vocabulary, k=rng.randint(6, 12))
+        questions.append(" ".join(words) + "?")
+        if rng.random() < args.copies:
+            reworded = list(words)
+            reworded[rng.randrange(len(reworded))] = rng.choice(vocabulary)
+            copies[len(questions) - 1] = len(questions)
+            questions.append(" ".join(reworded + ["please"]))
+    conn = get_db_connection()
+    conn.executemany("INSERT INTO qa_pairs (project_id, question, answer) VALUES (1, ?, 'answer')",
+                     [(question,) for question in questions])
+    conn.commit()
+    conn.close()
+    print(f"{len(questions):,} QA pairs, {len(copies):,} reworded copies")
+
+    started = time.perf_counter()
+    sync_minhash_signatures(1)
+    print(f"signatures:      {time.perf_counter() - started:7.2f} s")
+
+    started = time.perf_counter()
+    clusters = find_near_duplicate_clusters(1, args.threshold)
+    print(f"clusters:        {time.perf_counter() - started:7.2f} s  ({len(clusters):,} groups, "
+          f"{sum(len(cluster) - 1 for cluster in clusters):,} pairs to delete)")
+    # Row ids follow insertion order, so question i has id i + 1
+    grouped = {qa["id"]: number for number, cluster in enumerate(clusters) for qa in cluster}
+    found = sum(1 for original, copy in copies.items()
+                if grouped.get(original + 1) is not None and grouped.get(original + 1) == grouped.get(copy + 1))
+    print(f"planted copies found: {found:,} of {len(copies):,} (some fall below the threshold by construction)")
+
+    started = time.perf_counter()
+    get_near_duplicate_index(1, args.threshold)
+    print(f"index load:      {time.perf_counter() - started:7.2f} s")
+    started = time.perf_counter()
+    for question in questions[:args.lookups]:
+        find_near_duplicate(1, question + " thanks", args.threshold)
+    print(f"lookup:          {(time.perf_counter() - started) / args.lookups * 1000:7.2f} ms per question")
+
+if __name__ == "__main__":
+    main()
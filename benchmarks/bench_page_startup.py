@@ -0,0 +1,88 @@
+"""Cold and warm script-run latency of the app pages.
+
+Each page is run with Streamlit's AppTest in a fresh Python process: the
+first run pays for importing the page's modules and building its clients
+(cold), the following reruns show what every user interaction costs (warm).
+Also reports how long importing the page's utils modules takes on its own.
+The run uses a throwaway DB with one user and project in a temp directory and
+dummy API keys, so no request leaves the machine. Run from the repository
+root:
+
+    python benchmarks/bench_page_startup.py --reruns 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = {
+    "1_Call_Management": ["utils.db", "utils.file_types", "utils.export_cache"],
+    "2_QA_Management": ["utils.db", "utils.qa_utils", "utils.file_types", "utils.export_cache",
+                        "utils.finetune_export", "utils.generation_jobs", "utils.llm_providers",
+                        "utils.doc_chunker"],
+}
+
+# Runs in the child process; prints one JSON line with the timings in milliseconds
+CHILD = r"""
+import importlib, json, os, sys, time
+sys.path.insert(0, os.environ["BENCH_ROOT"])
+page, modules, reruns = sys.argv[1], sys.argv[2].split(","), int(sys.argv[3])
+import streamlit
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+if modules != [""]:
+    for module in modules:
+        importlib.import_module(module)
+import_ms = (time.perf_counter() - started) * 1000
+at = AppTest.from_file(os.path.join(os.environ["BENCH_ROOT"], "pages", page + ".py"), default_timeout=120)
+at.session_state["user_id"] = 1
+at.session_state["username"] = "bench"
+at.session_state["project_id"] = 1
+at.session_state["project_name"] = "bench"
+started = time.perf_counter()
+at.run()
+first_ms = (time.perf_counter() - started) * 1000
+warm = []
+for _ in range(reruns):
+    started = time.perf_counter()
+    at.run()
+    warm.append((time.perf_counter() - started) * 1000)
+warm.sort()
+errors = [str(e.value) for e in at.exception]
+print(json.dumps({"import_ms": import_ms, "first_ms": first_ms, "warm_ms": warm[len(warm) // 2] if warm else None,
+                  "errors": errors}))
+"""
+
+def run_page(page, modules, reruns, env, measure_imports):
+    output = subprocess.run([sys.executable, "-c", CHILD, page, ",".join(modules if measure_imports else []),
+                             str(reruns)], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reruns", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_page_startup_")
+    env = dict(os.environ, BENCH_ROOT=ROOT, PYTHONPATH=ROOT, RETELL_API_KEY="bench", GEMINI_API_KEY="bench",
+               LLM_PROVIDER="gemini")
+    setup = ("from utils.db_manage import initialize_database; from utils.db import AppDatabase; "
+             "initialize_database(); AppDatabase.signup('bench', 'x'); AppDatabase.create_project(1, 'bench')")
+    os.makedirs(os.path.join(workdir, "DB"))
+    subprocess.run([sys.executable, "-c", setup], cwd=workdir, env=env, capture_output=True, check=True)
+    os.chdir(workdir)
+
+    print(f"{'page':<20} {'utils import ms':>16} {'cold run ms':>12} {'warm rerun ms':>14}")
+    for page, modules in PAGES.items():
+        imports = run_page(page, modules, 0, env, measure_imports=True)
+        runs = run_page(page, modules, args.reruns, env, measure_imports=False)
+        print(f"{page:<20} {imports['import_ms']:>16.0f} {runs['first_ms']:>12.0f} {runs['warm_ms']:>14.0f}")
+        if runs["errors"]:
+            print(f"  page raised: {runs['errors'][0]}")
+
+if __name__ == "__main__":
+    main()
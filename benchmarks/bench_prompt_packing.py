@@ -0,0 +1,107 @@
+"""Request count and prompt tokens for bulk call generation, with and without packing.
+
+Runs generate_qa_for_calls against a fake model over synthetic short
+transcripts and reports requests and estimated prompt/response tokens per
+1,000 calls. A fraction of packed answers can be made to drop calls to
+exercise the per-call fallback. The run uses a throwaway DB (for the
+response cache) in a temp directory. Run from the repository root:
+
+    python benchmarks/bench_prompt_packing.py --calls 1000 --drop-rate 0.05
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.db_manage import initialize_database
+from utils.qa_utils import generate_qa_for_calls, estimate_tokens, DEFAULT_PACK_TOKEN_BUDGET
+
+WORDS = ("esa letter landlord housing pet dog cat therapist state law price refund "
+         "email phone appointment renewal travel airline document approval").split()
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Answers 6 pairs per transcript in the prompt, optionally dropping calls from packed answers."""
+
+    def __init__(self, drop_rate, seed=0):
+        self.model_name = f"fake-{seed}"
+        self.drop_rate = drop_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        call_ids = re.findall(r'<transcript call_id="([^"]+)">', prompt)
+        with self._lock:
+            if len(call_ids) > 1:
+                call_ids = [c for c in call_ids if self.rng.random() >= self.drop_rate]
+        pairs = []
+        for call_id in call_ids or [None]:
+            for i in range(6):
+                qa = {"question": f"so um how does the esa letter thing work {i}",
+                      "answer": "You can reach us at hello@wellnesswag.com and we'll walk you through it."}
+                if call_id is not None:
+                    qa["call_id"] = call_id
+                pairs.append(qa)
+        text = json.dumps(pairs)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += estimate_tokens(prompt)
+            self.response_tokens += estimate_tokens(text)
+        return FakeResponse(text)
+
+def build_calls(count, seed=0):
+    rng = random.Random(seed)
+    calls = []
+    for i in range(count):
+        turns = []
+        for t in range(rng.randint(4, 16)):
+            role = "Agent" if t % 2 == 0 else "User"
+            turns.append(f"{role}: " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))))
+        calls.append((f"call_{i:06d}", "\n".join(turns)))
+    return calls
+
+def run(calls, pack_token_budget, drop_rate, seed):
+    model = FakeModel(drop_rate, seed)
+    covered = set()
+    for call_id, qa_pairs, error in generate_qa_for_calls(calls, model, max_workers=8,
+                                                          pack_token_budget=pack_token_budget):
+        if qa_pairs and not error:
+            covered.add(call_id)
+    return model, len(covered)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--budget", type=int, default=DEFAULT_PACK_TOKEN_BUDGET)
+    parser.add_argument("--drop-rate", type=float, default=0.05,
+                        help="Fraction of calls a packed answer leaves out")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_RPM", "100000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+    os.chdir(tempfile.mkdtemp(prefix="bench_packing_"))
+    os.makedirs("DB", exist_ok=True)
+    initialize_database()
+
+    calls = build_calls(args.calls)
+    scale = 1000 / len(calls)
+    print(f"{'mode':<10} {'covered':>8} {'requests/1k':>12} {'prompt tok/1k':>14} {'response tok/1k':>16}")
+    for seed, (mode, budget) in enumerate([("single", None), ("packed", args.budget)]):
+        model, covered = run(calls, budget, args.drop_rate, seed)
+        print(f"{mode:<10} {covered:>8} {model.requests * scale:>12.0f} {model.prompt_tokens * scale:>14.0f} "
+              f"{model.response_tokens * scale:>16.0f}")
+
+if __name__ == "__main__":
+    main()
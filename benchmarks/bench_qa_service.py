@@ -0,0 +1,160 @@
+"""Load test for qa_service.py: latency percentiles and throughput per lookup mode.
+
+Without --url, builds a throwaway DB with --pairs random QA pairs in a temp
+directory and starts the service on it (in a subprocess, preloaded).
+Each lookup mode is then hit by --concurrency client threads, each reusing
+one keep-alive connection. Queries are drawn from a pool of --distinct
+questions, so the pool size sets how often the LRU cache answers. Run from
+the repository root:
+
+    python benchmarks/bench_qa_service.py --pairs 100000 --requests 20000 --concurrency 16
+    python benchmarks/bench_qa_service.py --url http://127.0.0.1:8502 --project-id 1
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ("esa letter landlord housing pet dog cat therapist state law price refund email phone "
+         "appointment renewal travel airline document approval cost long take much does".split())
+
+def build_database(workdir, pairs, rng):
+    from utils import db
+    from utils.db import AppDatabase, get_db_connection
+    os.makedirs(os.path.join(workdir, "DB"))
+    db.DB_PATH = os.path.join(workdir, "DB", "retell.db")
+    AppDatabase.initialize(force_recreate=True)
+    AppDatabase.signup("bench", "x")
+    AppDatabase.create_project(1, "bench")
+    vocabulary = WORDS + [f"term{i}" for i in range(3000)]
+    questions = [" ".join(rng.choices(vocabulary, k=rng.randint(5, 10))) + "?" for _ in range(pairs)]
+    conn = get_db_connection()
+    conn.executemany("INSERT INTO qa_pairs (project_id, question, answer) VALUES (1, ?, ?)",
+                     [(question, f"Answer to: {question}") for question in questions])
+    conn.commit()
+    conn.close()
+    return questions
+
+def start_service(workdir):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "qa_service.py"), "--port", str(port),
+                                "--preload", "1"], cwd=workdir, env=dict(os.environ, PYTHONPATH=ROOT),
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    # The service prints its address once the index is built and it is listening
+    for line in process.stdout:
+        if line.startswith("Serving"):
+            break
+    return process, f"http://127.0.0.1:{port}"
+
+def get_json(conn, path):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise RuntimeError(f"{path}: HTTP {response.status} {body[:200]!r}")
+    return json.loads(body)
+
+def run_mode(url, project_id, mode, queries, total_requests, concurrency):
+    host = urlparse(url)
+    latencies, errors = [], []
+    next_request = iter(range(total_requests))
+    lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection(host.hostname, host.port, timeout=30)
+        rng = random.Random(threading.get_ident())
+        mine = []
+        while True:
+            with lock:
+                if next(next_request, None) is None:
+                    break
+            query = rng.choice(queries)
+            started = time.perf_counter()
+            try:
+                get_json(conn, f"/lookup?project_id={project_id}&mode={mode}&q={quote(query)}")
+            except Exception as e:
+                errors.append(str(e))
+                conn.close()
+                conn = http.client.HTTPConnection(host.hostname, host.port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "qps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else float("nan"),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else float("nan"),
+        "errors": len(errors),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Test a running service instead of starting one")
+    parser.add_argument("--project-id", type=int, default=1)
+    parser.add_argument("--pairs", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per lookup mode")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--distinct", type=int, default=5000, help="Size of the query pool")
+    parser.add_argument("--modes", nargs="+", default=["exact", "keyword", "fts", "auto"])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    process = None
+    if args.url:
+        url = args.url
+        host = urlparse(url)
+        conn = http.client.HTTPConnection(host.hostname, host.port, timeout=30)
+        sample = get_json(conn, f"/lookup?project_id={args.project_id}&mode=keyword&q={quote(' '.join(WORDS))}&limit=50")
+        conn.close()
+        questions = [result["question"] for result in sample["results"]] or WORDS
+    else:
+        workdir = tempfile.mkdtemp(prefix="bench_qa_service_")
+        questions = build_database(workdir, args.pairs, rng)
+        process, url = start_service(workdir)
+        print(f"{args.pairs:,} QA pairs served from {url}")
+    try:
+        # Half the pool are stored questions (exact hits), half reworded ones
+        pool = [rng.choice(questions) for _ in range(args.distinct // 2)]
+        pool += [" ".join(rng.sample(question.rstrip("?").split(), k=max(1, len(question.split()) - 1)))
+                 for question in rng.choices(questions, k=args.distinct - len(pool))]
+        print(f"{'mode':<8} {'requests':>9} {'QPS':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for mode in args.modes:
+            result = run_mode(url, args.project_id, mode, pool, args.requests, args.concurrency)
+            print(f"{mode:<8} {result['requests']:>9} {result['qps']:>8.0f} {result['p50_ms']:>8.2f} "
+                  f"{result['p99_ms']:>8.2f} {result['errors']:>7}")
+        host = urlparse(url)
+        conn = http.client.HTTPConnection(host.hostname, host.port, timeout=30)
+        stats = get_json(conn, "/stats")
+        conn.close()
+        print(f"cache hits: {stats.get('cache_hits', 0):,} of {stats.get('lookups', 0):,} lookups")
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+if __name__ == "__main__":
+    main()
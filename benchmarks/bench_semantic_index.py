@@ -0,0 +1,67 @@
+"""Build, load, query and incremental-update times of the semantic index.
+
+Fills a throwaway DB with random questions, builds the project's index from
+scratch, reopens it from its memory-mapped files, and times single and
+batched top-k queries plus the refresh after one insert and one delete. Run
+from the repository root:
+
+    python benchmarks/bench_semantic_index.py --pairs 300000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import db, semantic_index
+from utils.db import AppDatabase, get_db_connection
+from utils.semantic_index import SemanticIndex
+
+def timed(label, fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    print(f"{label:<28} {(time.perf_counter() - started) / repeat * 1000:9.1f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_semantic_index_")
+    db.DB_PATH = os.path.join(workdir, "bench.db")
+    semantic_index.INDEX_DIR = os.path.join(workdir, "semantic_index")
+    AppDatabase.initialize(force_recreate=True)
+    AppDatabase.signup("bench", "x")
+    AppDatabase.create_project(1, "bench")
+
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    questions = [" ".join(rng.choices(vocabulary, k=rng.randint(6, 12))) + "?" for _ in range(args.pairs)]
+    conn = get_db_connection()
+    conn.executemany("INSERT INTO qa_pairs (project_id, question, answer) VALUES (1, ?, 'answer')",
+                     [(question,) for question in questions])
+    conn.commit()
+    conn.close()
+    print(f"{args.pairs:,} QA pairs")
+
+    timed("build", lambda: SemanticIndex(1).refresh())
+    index = timed("reopen", lambda: SemanticIndex(1))
+    index.refresh()
+    sample = questions[:args.queries]
+    timed("query (1 question)", lambda: index.search(sample[:1], 5), repeat=args.queries)
+    timed(f"query ({args.queries} at once)", lambda: index.search(sample, 5))
+    qa_id = AppDatabase.store_qa_pair(1, "a freshly added question", "answer")
+    timed("refresh after an insert", index.refresh)
+    AppDatabase.remove_qa_pair(1, qa_id)
+    timed("refresh after a delete", index.refresh)
+    size = sum(os.path.getsize(os.path.join(index.directory, name)) for name in os.listdir(index.directory))
+    print(f"index files: {size / 1024 / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Document normalization throughput, step-by-step legacy version vs text_normalize.
+
+Builds synthetic markdown/transcript documents of the given size (headers,
+speaker lines, blank lines and punctuation), one plain ASCII and one with
+emoji and dashes, checks that both implementations give identical output,
+and reports MB/s for each document and for a batch of transcripts. Run from
+the repository root:
+
+    python benchmarks/bench_text_normalize.py --mb 8
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.text_normalize import normalize_documents
+
+WORDS = ("esa letter landlord housing pet dog cat therapist state law price refund "
+         "email phone appointment renewal travel airline document approval").split()
+ASCII_PUNCTUATION = [".", ",", "?", "!", " (ok)", " #1", " $95", ";", ":", " -"]
+UNICODE_PUNCTUATION = ASCII_PUNCTUATION + [" —", " 🙂", " café"]
+
+def legacy_preprocess_text(text):
+    """The original implementation, kept here as the reference output."""
+    text = text.lower()
+    text = re.sub(r'\n{2,}', '\n', text)
+    text = re.sub(r'[^\w\s\.,;:?!\'"-]', ' ', text)
+    text = re.sub(r'\s{2,}', ' ', text)
+    lines = text.split('\n')
+    formatted_lines = []
+    for line in lines:
+        line = line.strip()
+        if re.match(r'^[a-z0-9\s]+:$', line):
+            formatted_lines.append(f"## {line}")
+        elif line.endswith(':') and ':' in line and len(line.split(':')[0].strip().split()) <= 5:
+            formatted_lines.append(f"### {line}")
+        else:
+            formatted_lines.append(line)
+    return '\n'.join(formatted_lines).strip()
+
+def build_document(size_bytes, rng, punctuation=ASCII_PUNCTUATION):
+    lines, size = [], 0
+    while size < size_bytes:
+        kind = rng.random()
+        if kind < 0.05:
+            line = f"# {' '.join(rng.choices(WORDS, k=3)).title()}"
+        elif kind < 0.1:
+            line = f"{' '.join(rng.choices(WORDS, k=rng.randint(1, 7)))}:"
+        elif kind < 0.2:
+            line = ""
+        else:
+            words = [w + (rng.choice(punctuation) if rng.random() < 0.15 else "")
+                     for w in rng.choices(WORDS, k=rng.randint(5, 30))]
+            line = f"{rng.choice(['Agent', 'Customer'])}:  {' '.join(words)}"
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=8, help="Size of each single document")
+    parser.add_argument("--transcripts", type=int, default=5000, help="Transcripts in the batch run")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    size = int(args.mb * 1024 * 1024)
+    runs = [("ascii document", [build_document(size, rng)]),
+            ("unicode document", [build_document(size, rng, UNICODE_PUNCTUATION)]),
+            (f"{args.transcripts} transcripts", [build_document(2000, rng) for _ in range(args.transcripts)])]
+
+    print(f"{'run':<20} {'MB':>6} {'legacy MB/s':>12} {'fused MB/s':>11} {'speedup':>8}")
+    for name, texts in runs:
+        mb = sum(len(text) for text in texts) / 1024 / 1024
+        legacy, legacy_seconds = timed(lambda ts: [legacy_preprocess_text(t) for t in ts], texts)
+        fused, fused_seconds = timed(normalize_documents, texts)
+        assert legacy == fused, f"{name}: normalize_documents differs from the legacy output"
+        print(f"{name:<20} {mb:>6.1f} {mb / legacy_seconds:>12.1f} {mb / fused_seconds:>11.1f} "
+              f"{legacy_seconds / fused_seconds:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
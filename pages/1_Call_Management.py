@@ -3,17 +3,21 @@ from utils.db import AppDatabase
 from dotenv import load_dotenv
 import os
 import json
-from retell import Retell
-import pandas as pd
+from utils.file_types import IMPORT_FILE_TYPES, EXPORT_FORMATS, EXPORT_FILE_TYPES
+from utils.export_cache import get_or_build_export
 
 load_dotenv()
 
-# Initialize Retell SDK client
+# Retell SDK client, built once per process on first use (importing the SDK takes ~2s)
 retell_api_key = os.getenv("RETELL_API_KEY")
 if not retell_api_key:
     st.error("RETELL_API_KEY not found in environment variables. Please set it in your .env file.")
     st.stop()
-retell_client = Retell(api_key=retell_api_key)
+
+@st.cache_resource
+def get_retell_client(api_key):
+    from retell import Retell
+    return Retell(api_key=api_key)
 
 st.title("Call Management")
 
@@ -51,7 +55,7 @@ with tab1:
                     st.warning(f"Call ID '{call_id_input}' already exists in this project. View it in 'View Stored Calls' tab.")
                 else:
                     try:
-                        call_response = retell_client.call.retrieve(call_id=call_id_input)
+                        call_response = get_retell_client(retell_api_key).call.retrieve(call_id=call_id_input)
                         transcript = getattr(call_response, "transcript", "No transcript available")
                         st.session_state.fetched_call = {"call_id": call_id_input, "transcript": transcript}
                         st.success(f"Transcript fetched for Call ID '{call_id_input}'!")
@@ -67,7 +71,7 @@ with tab1:
                 "in_voicemail": [False]
             }
             try:
-                calls = retell_client.call.list(filter_criteria=filter_criteria, limit=limit)
+                calls = get_retell_client(retell_api_key).call.list(filter_criteria=filter_criteria, limit=limit)
                 if not calls:
                     st.warning("No successful calls found in Retell.")
                 else:
@@ -139,14 +143,17 @@ with tab1:
 # Tab 2: View and Manage Stored Calls
 with tab2:
     st.header("Stored Calls")
-    stored_calls = AppDatabase.get_project_calls(project_id)
     
-    if not stored_calls:
-        st.write("No calls stored in this project yet.")
-    else:
-        st.write(f"Total stored calls: {len(stored_calls)}")
-        call_id_to_view = st.selectbox("Select a Call ID to View", [call["call_id"] for call in stored_calls],
-                                      key="view_call_select")
+    # Switching, removing or refetching a call only reruns this viewer, which lists call IDs
+    # and loads the one transcript on screen; the other tabs catch up on the next full rerun
+    @st.fragment
+    def stored_call_viewer():
+        call_ids = AppDatabase.get_call_ids(project_id)
+        if not call_ids:
+            st.write("No calls stored in this project yet.")
+            return
+        st.write(f"Total stored calls: {len(call_ids)}")
+        call_id_to_view = st.selectbox("Select a Call ID to View", call_ids, key="view_call_select")
         if call_id_to_view:
             call = AppDatabase.get_call(project_id, call_id_to_view)
             if call:
@@ -170,126 +177,145 @@ with tab2:
                         success = AppDatabase.remove_call(project_id, call["call_id"])
                         if success:
                             st.success(f"Call '{call['call_id']}' removed successfully!")
-                            st.rerun()
+                            st.rerun(scope="fragment")
                         else:
                             st.error(f"Failed to remove Call '{call['call_id']}'.")
                 with col2:
                     if st.button("Update with New Fetch", key=f"update_{call['call_id']}"):
                         try:
-                            call_response = retell_client.call.retrieve(call_id=call["call_id"])
+                            call_response = get_retell_client(retell_api_key).call.retrieve(call_id=call["call_id"])
                             new_transcript = getattr(call_response, "transcript", "No transcript available")
                             success = AppDatabase.store_call(project_id, call["call_id"], new_transcript)
                             if success:
                                 st.success(f"Call '{call['call_id']}' updated successfully with new transcript!")
-                                st.rerun()
+                                st.rerun(scope="fragment")
                             else:
                                 st.error(f"Failed to update Call '{call['call_id']}'.")
                         except Exception as e:
                             st.error(f"Failed to fetch new transcript for Call '{call['call_id']}': {str(e)}")
+    
+    stored_call_viewer()
 
 # Tab 3: Import Calls from File
 with tab3:
     st.header("Import Calls from File")
-    uploaded_file = st.file_uploader("Upload CSV or Excel file", type=["csv", "xlsx"])
     
-    if uploaded_file is not None:
-        try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+    # Interrupted or failed imports can be resumed from their last committed batch
+    unfinished_jobs = AppDatabase.get_unfinished_import_jobs(project_id, "calls")
+    if unfinished_jobs:
+        from utils.import_jobs import run_import_job, describe_import_job
+        st.subheader("Unfinished Imports")
+        for job in unfinished_jobs:
+            with st.expander(f"Job #{job['job_id']}: {job['file_name']} ({job['status']})"):
+                st.write(describe_import_job(job))
+                if job["last_error"]:
+                    st.error(f"Last error: {job['last_error']}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("Resume Import", key=f"resume_call_job_{job['job_id']}"):
+                        progress_bar = st.progress(0)
+                        total = job["total_rows"] or 1
+                        job = run_import_job(job["job_id"],
+                                             progress_callback=lambda j: progress_bar.progress(min(1.0, j["next_row"] / total)))
+                        if job["status"] == "completed":
+                            st.success(f"Import completed: {describe_import_job(job)}")
+                            st.rerun()
+                        else:
+                            st.error(f"Import stopped: {job['last_error']}")
+                with col2:
+                    if st.button("Discard Job", key=f"discard_call_job_{job['job_id']}"):
+                        AppDatabase.update_import_job_status(job["job_id"], "cancelled")
+                        st.rerun()
+    
+    # Mapping columns and ticking rows in the preview only reruns the preview; a finished
+    # import reruns the page so the other tabs show the new calls
+    @st.fragment
+    def call_import_preview():
+        uploaded_file = st.file_uploader("Upload CSV, Excel, Parquet or Arrow file", type=IMPORT_FILE_TYPES)
+    
+        if uploaded_file is not None:
+            # pandas and pyarrow are only loaded once a file is uploaded
+            from utils.data_formats import list_columns, read_columns
+            try:
+                # Only read the header here; rows are loaded after the columns are mapped
+                columns = list_columns(uploaded_file)
             
-            st.success("File uploaded successfully!")
+                st.success("File uploaded successfully!")
             
-            # Column mapping
-            st.subheader("Map Columns")
-            st.info("Please select the columns from your file that contain the Call ID and Transcript data. Make sure to map them correctly to ensure proper data import.")
-            columns = df.columns.tolist()
-            call_id_col = st.selectbox("Select Call ID Column", columns)
-            transcript_col = st.selectbox("Select Transcript Column", columns)
+                # Column mapping
+                st.subheader("Map Columns")
+                st.info("Please select the columns from your file that contain the Call ID and Transcript data. Make sure to map them correctly to ensure proper data import.")
+                call_id_col = st.selectbox("Select Call ID Column", columns)
+                transcript_col = st.selectbox("Select Transcript Column", columns)
             
-            # Preview data
-            st.subheader("Preview Data")
-            st.info("Review the data below. You can verify the complete transcript for each call before importing. Use the checkboxes to select which calls to import.")
-            preview_df = df[[call_id_col, transcript_col]].copy()
-            preview_df.columns = ["Call ID", "Transcript"]
+                # Preview data
+                st.subheader("Preview Data")
+                st.info("Review the data below. You can verify the complete transcript for each call before importing. Use the checkboxes to select which calls to import.")
+                df = read_columns(uploaded_file, [call_id_col, transcript_col])
+                preview_df = df[[call_id_col, transcript_col]].copy()
+                preview_df.columns = ["Call ID", "Transcript"]
             
-            # Add selection column and display with full transcript visibility
-            preview_df.insert(0, "Import", True)
-            edited_df = st.data_editor(
-                preview_df,
-                hide_index=True,
-                column_config={
-                    "Import": st.column_config.CheckboxColumn("Select for Import"),
-                    "Call ID": st.column_config.TextColumn("Call ID", width="medium"),
-                    "Transcript": st.column_config.TextColumn(
-                        "Transcript",
-                        width="large",
-                        help="Full transcript text - scroll to read more"
-                    )
-                },
-                use_container_width=True
-            )
+                # Add selection column and display with full transcript visibility
+                preview_df.insert(0, "Import", True)
+                edited_df = st.data_editor(
+                    preview_df,
+                    hide_index=True,
+                    column_config={
+                        "Import": st.column_config.CheckboxColumn("Select for Import"),
+                        "Call ID": st.column_config.TextColumn("Call ID", width="medium"),
+                        "Transcript": st.column_config.TextColumn(
+                            "Transcript",
+                            width="large",
+                            help="Full transcript text - scroll to read more"
+                        )
+                    },
+                    use_container_width=True
+                )
             
-            # Import selected calls
-            if st.button("Import Selected Calls"):
-                selected_rows = edited_df[edited_df["Import"]]
-                if len(selected_rows) == 0:
-                    st.error("Please select at least one call to import.")
-                else:
-                    # Check for existing calls
-                    existing_calls = []
-                    for _, row in selected_rows.iterrows():
-                        call_id = str(row["Call ID"])
-                        if AppDatabase.get_call(project_id, call_id):
-                            existing_calls.append(call_id)
-                    
-                    if existing_calls:
-                        st.warning(f"Found {len(existing_calls)} existing call(s). What would you like to do?")
-                        action = st.radio(
-                            "Choose action for existing calls:",
-                            ["Skip existing calls", "Override existing calls"],
-                            key="duplicate_action"
+                duplicate_action = st.radio(
+                    "Choose action for existing calls:",
+                    ["Skip existing calls", "Override existing calls"],
+                    key="duplicate_action"
+                )
+            
+                # Import selected calls as a resumable job
+                if st.button("Import Selected Calls"):
+                    excluded_rows = edited_df.index[~edited_df["Import"]].tolist()
+                    if len(excluded_rows) == len(edited_df):
+                        st.error("Please select at least one call to import.")
+                    else:
+                        from utils.import_jobs import create_import_job, get_edited_rows, run_import_job
+                        # The job reads rows from the stored file; cells fixed in the preview go with it
+                        edited_rows = get_edited_rows(preview_df, edited_df,
+                                                      {"call_id": "Call ID", "transcript": "Transcript"})
+                        job_id = create_import_job(
+                            project_id, "calls", uploaded_file,
+                            {"call_id": call_id_col, "transcript": transcript_col},
+                            duplicate_action, excluded_rows, total_rows=len(df), edited_rows=edited_rows
                         )
+                        progress_bar = st.progress(0)
+                        job = run_import_job(job_id,
+                                             progress_callback=lambda j: progress_bar.progress(min(1.0, j["next_row"] / max(1, len(df)))))
                     
-                    imported_count = 0
-                    skipped_count = 0
-                    updated_count = 0
-                    
-                    for _, row in selected_rows.iterrows():
-                        call_id = str(row["Call ID"])
-                        transcript = str(row["Transcript"])
-                        
-                        # Check if call exists
-                        existing_call = AppDatabase.get_call(project_id, call_id)
-                        if existing_call:
-                            if action == "Skip existing calls":
-                                skipped_count += 1
-                                continue
-                            else:  # Override
-                                success = AppDatabase.store_call(project_id, call_id, transcript)
-                                if success:
-                                    updated_count += 1
-                        else:
-                            success = AppDatabase.store_call(project_id, call_id, transcript)
-                            if success:
-                                imported_count += 1
-                    
-                    # Show import results
-                    if imported_count > 0:
-                        st.success(f"Successfully imported {imported_count} new calls!")
-                    if updated_count > 0:
-                        st.success(f"Successfully updated {updated_count} existing calls!")
-                    if skipped_count > 0:
-                        st.info(f"Skipped {skipped_count} existing calls.")
-                    
-                    if imported_count > 0 or updated_count > 0:
-                        # Clear the file uploader
-                        st.session_state["file_uploader_key"] = None
-                        st.rerun()
+                        # Show import results
+                        if job["imported_count"] > 0:
+                            st.success(f"Successfully imported {job['imported_count']} new calls!")
+                        if job["updated_count"] > 0:
+                            st.success(f"Successfully updated {job['updated_count']} existing calls!")
+                        if job["skipped_count"] > 0:
+                            st.info(f"Skipped {job['skipped_count']} existing calls.")
+                        if job["status"] != "completed":
+                            st.error(f"Import stopped at row {job['next_row']}: {job['last_error']}. "
+                                     "Resume it from 'Unfinished Imports' above.")
+                        elif job["imported_count"] > 0 or job["updated_count"] > 0:
+                            # Clear the file uploader
+                            st.session_state["file_uploader_key"] = None
+                            st.rerun()
                     
-        except Exception as e:
-            st.error(f"Error processing file: {str(e)}")
+            except Exception as e:
+                st.error(f"Error processing file: {str(e)}")
+    
+    call_import_preview()
 
 # Tab 4: Export Calls
 with tab4:
@@ -303,118 +329,45 @@ with tab4:
         
         # Export options
         export_option = st.radio("Export Options", ["Export Single Call", "Export Selected Calls", "Export All Calls"])
-        export_format = st.selectbox("Export Format", ["CSV", "Excel", "JSONL"])
+        export_format = st.selectbox("Export Format", EXPORT_FORMATS)
         
         if export_option == "Export Single Call":
             call_id_to_export = st.selectbox("Select a Call ID to Export", 
                                            [call["call_id"] for call in stored_calls],
                                            key="export_single_call")
-            if st.button("Export Call"):
-                if call_id_to_export:
-                    call = AppDatabase.get_call(project_id, call_id_to_export)
-                    if call:
-                        df = pd.DataFrame([{
-                            "Call ID": call["call_id"],
-                            "Transcript": call["transcript"],
-                            "Timestamp": call["timestamp"]
-                        }])
-                        
-                        if export_format == "CSV":
-                            st.download_button(
-                                label="Download CSV",
-                                data=df.to_csv(index=False),
-                                file_name=f"call_{call_id_to_export}.csv",
-                                mime="text/csv"
-                            )
-                        elif export_format == "Excel":
-                            buffer = io.BytesIO()
-                            df.to_excel(buffer, index=False)
-                            st.download_button(
-                                label="Download Excel",
-                                data=buffer.getvalue(),
-                                file_name=f"call_{call_id_to_export}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
-                        else:  # JSONL
-                            jsonl_str = df.to_json(orient="records", lines=True)
-                            st.download_button(
-                                label="Download JSONL",
-                                data=jsonl_str,
-                                file_name=f"call_{call_id_to_export}.jsonl",
-                                mime="application/jsonl"
-                            )
-                            
+            export_call_ids = [call_id_to_export] if call_id_to_export else []
+            file_stem = f"call_{call_id_to_export}"
+            export_clicked = st.button("Export Call") and bool(export_call_ids)
         elif export_option == "Export Selected Calls":
-            selected_calls = st.multiselect("Select Calls to Export",
+            export_call_ids = st.multiselect("Select Calls to Export",
                                           [call["call_id"] for call in stored_calls],
                                           key="export_selected_calls")
-            if st.button("Export Selected Calls") and selected_calls:
-                export_data = []
-                for call_id in selected_calls:
-                    call = AppDatabase.get_call(project_id, call_id)
-                    if call:
-                        export_data.append({
-                            "Call ID": call["call_id"],
-                            "Transcript": call["transcript"],
-                            "Timestamp": call["timestamp"]
-                        })
-                
-                df = pd.DataFrame(export_data)
-                if export_format == "CSV":
-                    st.download_button(
-                        label="Download CSV",
-                        data=df.to_csv(index=False),
-                        file_name="selected_calls.csv",
-                        mime="text/csv"
-                    )
-                elif export_format == "Excel":
-                    buffer = io.BytesIO()
-                    df.to_excel(buffer, index=False)
-                    st.download_button(
-                        label="Download Excel",
-                        data=buffer.getvalue(),
-                        file_name="selected_calls.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-                else:  # JSONL
-                    jsonl_str = df.to_json(orient="records", lines=True)
-                    st.download_button(
-                        label="Download JSONL",
-                        data=jsonl_str,
-                        file_name="selected_calls.jsonl",
-                        mime="application/jsonl"
-                    )
-                    
+            file_stem = "selected_calls"
+            export_clicked = st.button("Export Selected Calls") and bool(export_call_ids)
         else:  # Export All Calls
-            if st.button("Export All Calls"):
-                export_data = [{
-                    "Call ID": call["call_id"],
-                    "Transcript": call["transcript"],
-                    "Timestamp": call["timestamp"]
-                } for call in stored_calls]
-                
-                df = pd.DataFrame(export_data)
-                if export_format == "CSV":
-                    st.download_button(
-                        label="Download CSV",
-                        data=df.to_csv(index=False),
-                        file_name="all_calls.csv",
-                        mime="text/csv"
-                    )
-                elif export_format == "Excel":
-                    buffer = io.BytesIO()
-                    df.to_excel(buffer, index=False)
-                    st.download_button(
-                        label="Download Excel",
-                        data=buffer.getvalue(),
-                        file_name="all_calls.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-                else:  # JSONL
-                    jsonl_str = df.to_json(orient="records", lines=True)
-                    st.download_button(
-                        label="Download JSONL",
-                        data=jsonl_str,
-                        file_name="all_calls.jsonl",
-                        mime="application/jsonl"
-                    )
\ No newline at end of file
+            export_call_ids = None
+            file_stem = "all_calls"
+            export_clicked = st.button("Export All Calls")
+        
+        if export_clicked:
+            def build_call_export():
+                from utils.data_formats import CALL_EXPORT_COLUMNS, serialize_export, batched
+                if export_call_ids is None:
+                    # Stream straight from the DB cursor
+                    batches = AppDatabase.iter_project_calls(project_id)
+                else:
+                    calls = [AppDatabase.get_call(project_id, call_id) for call_id in export_call_ids]
+                    batches = batched([(call["call_id"], call["transcript"], call["timestamp"])
+                                       for call in calls if call])
+                return serialize_export(export_format, batches, CALL_EXPORT_COLUMNS)
+            
+            # Unchanged projects are served from the export cache
+            data = get_or_build_export(project_id, {"option": export_option, "call_ids": export_call_ids},
+                                       export_format, build_call_export)
+            extension, mime = EXPORT_FILE_TYPES[export_format]
+            st.download_button(
+                label=f"Download {export_format}",
+                data=data,
+                file_name=f"{file_stem}.{extension}",
+                mime=mime
+            )
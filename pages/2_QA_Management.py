@@ -1,28 +1,39 @@
 import streamlit as st
 from utils.db import AppDatabase
-from utils.file_utils import save_uploaded_file
-from utils.qa_utils import preprocess_text, generate_qa_from_transcript, extract_md_sections, generate_qa_from_md_section, check_duplicate_qa
+from utils.file_utils import store_uploaded_file
+from utils.qa_utils import (preprocess_text, generate_qa_from_transcript, check_duplicate_qa, find_similar_qa,
+                            generate_qa_for_chunks, generate_qa_for_md_sections,
+                            get_generation_settings, retry_dead_letters, DEFAULT_PACK_TOKEN_BUDGET,
+                            CALL_GENERATION_VERSION, plan_document_generation, record_document_generation,
+                            record_saved_document_pairs, document_chunk_hash)
+from utils.file_types import IMPORT_FILE_TYPES, EXPORT_FORMATS, EXPORT_FILE_TYPES
+from utils.export_cache import get_or_build_export
+from utils.finetune_export import DEFAULT_SYSTEM_PROMPT, build_finetune_dataset, zip_dataset
+from utils import llm_cache
+from utils.qa_parsing import get_parse_stats
+from utils import llm_tracing
+from utils.generation_jobs import (ACTIVE_STATUSES, queue_generation_job, ensure_worker, cancel_generation_job,
+                                   describe_generation_job)
+from utils.llm_providers import build_model_from_env, missing_credentials
+from utils.context_cache import prefix_cache_session
+from utils.doc_chunker import DEFAULT_CHUNK_TOKENS, PREVIEW_SAMPLE_BYTES, iter_text_lines, read_text_sample, chunk_document
+from utils.near_duplicates import (DEFAULT_NEAR_DUPLICATE_THRESHOLD, get_near_duplicate_threshold,
+                                   find_near_duplicate_clusters, collapse_near_duplicates)
+from utils.semantic_index import find_similar_questions
 from dotenv import load_dotenv
 import os
-import pandas as pd
-import google.generativeai as genai
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import io
-import json
-import re
 import time
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini API client
-gemini_api_key = os.getenv("GEMINI_API_KEY")
-if not gemini_api_key:
-    st.error("GEMINI_API_KEY not found in environment variables. Please set it in your .env file.")
+# Initialize the LLM provider(s) (LLM_PROVIDER, LLM_FALLBACK_PROVIDERS; Gemini by default)
+missing_keys = missing_credentials()
+if missing_keys:
+    st.error(f"{', '.join(missing_keys)} not found in environment variables. Please set it in your .env file.")
     st.stop()
 
-genai.configure(api_key=gemini_api_key)
-gemini_model = genai.GenerativeModel('gemini-2.0-pro-exp-02-05')  # gemini-1.5-flash
+llm_model = build_model_from_env()
 
 st.title("QA Management")
 
@@ -40,180 +51,58 @@ if "user_id" not in st.session_state or "project_id" not in st.session_state:
 username = st.session_state.username
 project_id = st.session_state.project_id
 project_name = st.session_state.project_name
+llm_tracing.set_project(project_id)
 st.write(f"Working on Project: {project_name} (ID: {project_id})")
 
 # Sidebar navigation
 st.sidebar.write(f"Current Project: {project_name} (ID: {project_id})")
 
-# Helper function to preprocess text documents
-def preprocess_text(text):
-    """Preprocess text to standardize formatting and remove inconsistencies"""
-    # Convert to lowercase
-    text = text.lower()
-    
-    # Replace multiple newlines with a single one
-    text = re.sub(r'\n{2,}', '\n', text)
-    
-    # Remove special characters except necessary punctuation
-    text = re.sub(r'[^\w\s\.,;:?!\'"-]', ' ', text)
-    
-    # Replace multiple spaces with a single space
-    text = re.sub(r'\s{2,}', ' ', text)
-    
-    # Fix header formatting for markdown
-    lines = text.split('\n')
-    formatted_lines = []
-    
-    for line in lines:
-        line = line.strip()
-        
-        # Fix headers
-        if re.match(r'^[a-z0-9\s]+:$', line):
-            formatted_lines.append(f"## {line}")
-        # Fix sub-headers
-        elif line.endswith(':') and ':' in line and len(line.split(':')[0].strip().split()) <= 5:
-            formatted_lines.append(f"### {line}")
-        else:
-            formatted_lines.append(line)
-    
-    # Join lines back together
-    text = '\n'.join(formatted_lines)
-    
-    return text
-
-# Helper function to generate QA pairs from transcript
-def generate_qa_from_transcript(transcript, call_id):
-    prompt = f"""
-    Below is a transcript from a customer service call about ESA (Emotional Support Animal) letters from Wellness Wag.
-    Generate 5-8 question-answer pairs that simulate a NATURAL conversation between a customer and a Wellness Wag support agent.
-
-    WHAT I NEED:
-    - Create question-answer pairs that sound like they come from REAL HUMAN CONVERSATIONS
-    - Questions should be in NATURAL, CASUAL language - not perfect or formal
-    - Focus on how REAL CUSTOMERS actually speak (with hesitations, simple language, etc.)
-    - The answers should be helpful but conversational, like a real support agent would speak
-
-    IMPORTANT REQUIREMENTS FOR QUESTIONS:
-    1. Make questions sound NATURAL and CONVERSATIONAL - use contractions, simple language
-    2. Include natural speech patterns like "Um," "So," "Hey," "I was wondering," etc.
-    3. Keep questions SHORT and SIMPLE as real customers would ask
-    4. Avoid formal language or perfectly structured sentences in questions
-    5. Questions should only contain information the customer would actually know
-    6. Make questions sound like they're spoken, not written
+# Helper function to show QA pairs while generation is still running
+def generate_with_live_preview(generate_fn, items, describe_item):
+    """Run generate_fn(items, ordered=False, on_partial=...) and show pairs as they stream in.
 
-    IMPORTANT REQUIREMENTS FOR ANSWERS:
-    1. Answers should be HELPFUL and COMPLETE but still sound conversational
-    2. Include Wellness Wag's contact info (email: hello@wellnesswag.com, phone: (415) 570-7864) when relevant
-    3. Focus ONLY on topics discussed in this specific transcript
-    4. Include exact prices, timeframes, and processes mentioned in the transcript
-    5. Make the answers thorough but still sound like a real person speaking
-    6. If a question asks for info not in the conversation, direct them to contact Wellness Wag
-
-    Transcript:
-    {transcript}
-
-    Format your response as a JSON array of objects, each with 'question' and 'answer' fields.
-    If you cannot generate relevant questions from this transcript, return an empty array [].
+    describe_item(i) names item i in error messages and the preview. Returns
+    the (item, qa_pairs, error) results in input order once every item is done.
     """
+    progress_bar = st.progress(0)
+    preview = st.empty()
+    positions = {}
+    for i, item in enumerate(items):
+        positions.setdefault(id(item), []).append(i)
+    partial, final = {}, {}
+    last_render = [0.0]
     
-    try:
-        response = gemini_model.generate_content(prompt)
-        response_text = response.text.replace('```json', '').replace('```', '').strip()
-        qa_pairs = json.loads(response_text)
-        
-        for qa in qa_pairs:
-            if not qa['question'].endswith('?'):
-                qa['question'] += '?'
-            if qa['answer'] and not qa['answer'].endswith(('.', '!', '?')):
-                qa['answer'] += '.'
-            qa['call_id'] = call_id
-        
-        return qa_pairs
-    except Exception as e:
-        st.error(f"Error generating QA from transcript: {str(e)}")
-        return []
-
-# Helper function to extract sections from markdown
-def extract_md_sections(content):
-    section_pattern = r'(^|\n)#{1,3}\s+(.*?)(?=\n)'
-    section_matches = re.finditer(section_pattern, content)
-    sections = []
-    last_pos = 0
-    
-    for match in section_matches:
-        section_title = match.group(2).strip()
-        start_pos = match.start()
-        if sections and last_pos < start_pos:
-            sections[-1]['end_pos'] = start_pos
-            sections[-1]['content'] = content[sections[-1]['start_pos']:sections[-1]['end_pos']]
-        sections.append({'title': section_title, 'start_pos': start_pos, 'end_pos': len(content)})
-        last_pos = start_pos
-    
-    if sections:
-        sections[-1]['content'] = content[sections[-1]['start_pos']:sections[-1]['end_pos']]
-    
-    return sections
-
-# Helper function to generate QA from markdown section
-def generate_qa_from_md_section(section):
-    prompt = f"""
-    Below is content from a section titled "{section['title']}" about ESA (Emotional Support Animal) letters from Wellness Wag. 
-    Generate 5-8 meaningful question-answer pairs that could be used to train a customer support chatbot.
-
-    Focus on:
-    1. Create a separate question for EACH specific piece of information in the content
-    2. If there are multiple states mentioned, create a separate question for EACH state
-    3. If there are specific laws or requirements mentioned, create questions about those specific details
-    4. Use simple, direct language that customers would actually use
-    5. Make sure answers are comprehensive and include all relevant details
-
-    Important guidelines:
-    - Include specific information like prices, timeframes, and requirements when mentioned
-    - Include Wellness Wag's contact info (email: hello@wellnesswag.com, phone: (415) 570-7864) when relevant
-    - Make the questions sound like real customer inquiries
-    - Ensure answers are accurate based on the provided content
-
-    Section Content:
-    {section['content']}
-
-    Format your response as a JSON array of objects, each with 'question' and 'answer' fields.
-    """
-    
-    try:
-        response = gemini_model.generate_content(prompt)
-        response_text = response.text.replace('```json', '').replace('```', '').strip()
-        qa_pairs = json.loads(response_text)
-        
-        for qa in qa_pairs:
-            if not qa['question'].endswith('?'):
-                qa['question'] += '?'
-            if qa['answer'] and not qa['answer'].endswith(('.', '!', '?')):
-                qa['answer'] += '.'
-            qa['section'] = section['title']
-        
-        return qa_pairs
-    except Exception as e:
-        st.error(f"Error generating QA from section '{section['title']}': {str(e)}")
-        return []
-
-# Helper function to check for duplicate QA pairs
-def check_duplicate_qa(project_id, question, existing_qa_pairs=None):
-    if existing_qa_pairs is None:
-        existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
-    
-    # Define the normalization function
-    def normalize_text(text):
-        return re.sub(r'[^\w\s]', '', text.lower().strip())
+    def render(force=False):
+        # Redraw at most twice a second; every redraw replaces the whole table
+        if not force and time.time() - last_render[0] < 0.5:
+            return
+        last_render[0] = time.time()
+        rows = [(i, qa) for i in sorted(final) for qa in final[i][1]]
+        rows += [(i, qa) for i in sorted(partial) for qa in partial[i]]
+        if rows:
+            preview.dataframe([{
+                "Question": qa["question"],
+                "Answer": qa["answer"],
+                "Source": describe_item(i),
+                "Status": "done" if i in final else "generating"
+            } for i, qa in rows], hide_index=True, use_container_width=True)
     
-    # Normalize the input question
-    normalized_question = normalize_text(question)
+    def on_partial(item, qa):
+        partial.setdefault(positions[id(item)][0], []).append(qa)
+        render()
     
-    # Check for duplicates using the correct function name
-    for qa in existing_qa_pairs:
-        if normalize_text(qa['question']) == normalized_question:
-            return qa
+    for done, (item, qa_pairs, error) in enumerate(generate_fn(items, ordered=False, on_partial=on_partial), 1):
+        i = positions[id(item)].pop(0)
+        partial.pop(i, None)
+        final[i] = (item, qa_pairs, error)
+        if error:
+            st.error(f"Error generating QA from {describe_item(i)}: {str(error)}")
+        progress_bar.progress(done / len(items))
+        render(force=True)
     
-    return None
+    progress_bar.empty()
+    preview.empty()
+    return [final[i] for i in sorted(final)]
 
 # Tabs
 tab1, tab2, tab3, tab4 = st.tabs(["Generate QA", "Import QA Pairs", "View QA Pairs", "Export QA"])
@@ -222,6 +111,115 @@ tab1, tab2, tab3, tab4 = st.tabs(["Generate QA", "Import QA Pairs", "View QA Pai
 with tab1:
     st.header("Generate QA Pairs")
     
+    with st.expander("Generation settings"):
+        max_workers = st.number_input(
+            "Concurrent requests", min_value=1, max_value=64,
+            value=get_generation_settings()["max_workers"],
+            help="Requests also respect the GEMINI_RPM / GEMINI_TPM rate limits shared by all users of this server"
+        )
+        pack_transcripts = st.checkbox(
+            "Pack short transcripts into shared requests", value=True,
+            help="Bulk call generation sends several transcripts per request, which cuts request count and "
+                 "repeated instruction tokens. Calls missing from a packed answer are retried on their own."
+        )
+        pack_token_budget = st.number_input(
+            "Transcript tokens per packed request", min_value=500, max_value=30000,
+            value=DEFAULT_PACK_TOKEN_BUDGET, step=500
+        ) if pack_transcripts else None
+        window_tokens = st.number_input(
+            "Split transcripts longer than (tokens)", min_value=1000, max_value=30000,
+            value=get_generation_settings()["window_tokens"], step=500,
+            help="Long calls are split into overlapping windows on utterance boundaries. The windows are "
+                 "generated in parallel and their QA pairs merged without duplicates."
+        )
+        cache_stats = llm_cache.get_cache_stats()
+        st.caption(f"Response cache: {cache_stats['entries']} entries "
+                   f"({cache_stats['size_bytes'] / (1024 * 1024):.1f} MB), "
+                   f"{cache_stats['hits']} hits / {cache_stats['misses']} misses this session "
+                   f"({cache_stats['hit_rate']:.0%} hit rate)")
+        if st.button("Clear response cache"):
+            removed = llm_cache.clear_cache()
+            st.success(f"Removed {removed} cached responses")
+        for model_name, counts in get_parse_stats().items():
+            st.caption(f"{model_name}: {counts['total']} responses, {counts['salvaged']} partially salvaged, "
+                       f"{counts['failed']} unusable ({counts['failure_rate']:.1%} not parsed cleanly)")
+    
+    with st.expander("Generation usage"):
+        usage = llm_tracing.summarize_usage(project_id)
+        if not usage["requests"]:
+            st.info("No model requests recorded for this project yet.")
+        else:
+            col1, col2, col3, col4, col5 = st.columns(5)
+            col1.metric("Requests", usage["requests"])
+            col2.metric("p50 latency", f"{usage['p50_latency_s']:.1f}s" if usage["p50_latency_s"] is not None else "-")
+            col3.metric("p95 latency", f"{usage['p95_latency_s']:.1f}s" if usage["p95_latency_s"] is not None else "-")
+            col4.metric("Tokens / pair", f"{usage['tokens_per_pair']:.0f}" if usage["tokens_per_pair"] else "-")
+            col5.metric("Cost (USD)", f"${usage['cost_usd']:.4f}" if usage["unpriced_requests"] < usage["requests"]
+                        else "unknown")
+            st.caption(f"{usage['total_tokens']:,} tokens for {usage['pairs']:,} QA pairs; "
+                       f"{usage['cached_tokens']:,} prompt tokens served from context caches "
+                       f"({usage['cached_share']:.0%} of prompt tokens); "
+                       f"{usage['errors']} failed requests, {usage['retried']} retries")
+            if usage["unpriced_requests"]:
+                st.caption(f"{usage['unpriced_requests']} requests used models without a known price and are "
+                           "not included in the cost; set LLM_MODEL_PRICES, e.g. "
+                           "'{\"model-name\": [input, output]}' in USD per 1M tokens, to price them.")
+            st.dataframe([{
+                "Model": model,
+                "Requests": stats["requests"],
+                "Tokens": stats["tokens"],
+                "Cost (USD)": round(stats["cost_usd"], 4) if stats["cost_usd"] is not None else None,
+            } for model, stats in usage["by_model"].items()], hide_index=True, use_container_width=True)
+    
+    # Items that kept failing after retries are kept so they can be retried on their own
+    dead_letters = AppDatabase.get_dead_letters(project_id)
+    if dead_letters:
+        with st.expander(f"Failed generation items ({len(dead_letters)})"):
+            st.dataframe([{
+                "Type": letter["item_type"],
+                "Item": letter["item_key"],
+                "Error": letter["error_kind"],
+                "Attempts": letter["attempts"],
+                "Message": letter["error_message"],
+            } for letter in dead_letters], hide_index=True, use_container_width=True)
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Retry failed items and save results"):
+                    existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
+                    saved_count = 0
+                    skipped_count = 0
+                    similar_count = 0
+                    failed_count = 0
+                    progress_bar = st.progress(0)
+                    with prefix_cache_session():
+                        retried = retry_dead_letters(project_id, llm_model, max_workers=max_workers,
+                                                     pack_token_budget=pack_token_budget, window_tokens=window_tokens)
+                        for i, (letter, qa_pairs, error) in enumerate(retried):
+                            if error:
+                                failed_count += 1
+                            for qa in qa_pairs:
+                                if check_duplicate_qa(project_id, qa['question'], existing_qa_pairs):
+                                    skipped_count += 1
+                                    continue
+                                # Resembling questions are saved too, but counted so they can be reviewed
+                                if find_similar_qa(project_id, qa['question']):
+                                    similar_count += 1
+                                if AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'],
+                                                             qa.get('call_id')):
+                                    saved_count += 1
+                            progress_bar.progress(min(1.0, (i + 1) / len(dead_letters)))
+                    progress_bar.empty()
+                    st.success(f"Saved {saved_count} new QA pairs, skipped {skipped_count} duplicates; "
+                               f"{failed_count} items failed again")
+                    if similar_count:
+                        st.warning(f"{similar_count} saved pairs resemble existing questions; check them under "
+                                   "View QA Pairs > Near-duplicate questions.")
+                    st.rerun()
+            with col2:
+                if st.button("Discard failed items"):
+                    AppDatabase.remove_dead_letters(project_id, [letter["id"] for letter in dead_letters])
+                    st.rerun()
+    
     # Options for QA generation
     gen_options = st.radio("Generate QA from:", [
         "Manual Entry", 
@@ -238,6 +236,7 @@ with tab1:
             question = st.text_input("Question", key="manual_question")
             answer = st.text_area("Answer", key="manual_answer")
             call_id = st.text_input("Associated Call ID (optional)", key="manual_call_id")
+            confirm_similar = st.checkbox("Save even if a similar question exists", key="manual_confirm_similar")
             submit_button = st.form_submit_button(label="Save QA Pair")
             
         # Process form submission outside the form
@@ -266,8 +265,9 @@ with tab1:
                 
                 # Check for duplicates
                 duplicate = check_duplicate_qa(project_id, question)
+                similar = None if duplicate else find_similar_qa(project_id, question)
                 if duplicate:
-                    st.warning(f"A similar question already exists: '{duplicate['question']}'")
+                    st.warning(f"This question already exists: '{duplicate['question']}'")
                     duplicate_action = st.radio(
                         "What would you like to do?",
                         ["Skip (don't save)", "Override existing", "Save as new entry"],
@@ -301,6 +301,11 @@ with tab1:
                     else: 
                         st.info("QA pair not saved (skipped due to duplicate).")
                 
+                elif similar and not confirm_similar:
+                    st.warning(f"A similar question already exists ({similar['similarity']:.0%} similar): "
+                               f"'{similar['question']}'. It may still ask something different; tick 'Save even "
+                               "if a similar question exists' and save again to keep both.")
+                
                 else:
                     st.write("DEBUG: No duplicate found, saving new QA pair")
                     store_success = AppDatabase.store_qa_pair(project_id, question, answer, call_id)
@@ -334,7 +339,8 @@ with tab1:
                     with st.spinner("Generating QA pairs..."):
                         call = AppDatabase.get_call(project_id, call_id)
                         if call and call["transcript"]:
-                            qa_pairs = generate_qa_from_transcript(call["transcript"], call_id)
+                            qa_pairs = generate_qa_from_transcript(call["transcript"], call_id, llm_model,
+                                                                   window_tokens=window_tokens)
                             
                             if not qa_pairs:
                                 st.warning(f"No QA pairs could be generated from call {call_id}.")
@@ -357,7 +363,7 @@ with tab1:
                                         st.write(f"**Answer:** {qa['answer']}")
                                         
                                         if duplicate:
-                                            st.warning(f"Similar question exists: '{duplicate['question']}'")
+                                            st.warning(f"Question already exists: '{duplicate['question']}'")
                                             action = st.radio(
                                                 "Action for this pair:",
                                                 ["Skip", "Override existing", "Save as new"],
@@ -366,7 +372,13 @@ with tab1:
                                             qa['action'] = action
                                             qa['duplicate_id'] = duplicate['id']
                                         else:
-                                            include = st.checkbox("Include this pair", value=True, key=f"include_{i}")
+                                            # Resembling questions may ask something different, so they are
+                                            # only flagged and left for the user to include
+                                            similar = find_similar_qa(project_id, qa['question'])
+                                            if similar:
+                                                st.warning(f"Resembles an existing question ({similar['similarity']:.0%} "
+                                                           f"similar): '{similar['question']}'")
+                                            include = st.checkbox("Include this pair", value=not similar, key=f"include_{i}")
                                             qa['action'] = "Save as new" if include else "Skip"
                                         
                                         if qa['action'] != "Skip":
@@ -400,123 +412,41 @@ with tab1:
                                 else:
                                     st.warning("No QA pairs selected for saving.")
             
-            elif call_options == "Process multiple calls":
+            else:
+                # Calls already generated with the current prompt version and model, whose
+                # transcript has not changed since, can be left out of bulk runs
+                state_counts = AppDatabase.get_generation_state_counts(project_id, CALL_GENERATION_VERSION,
+                                                                       llm_model.model_name)
+                st.caption(f"{state_counts['up_to_date']} calls up to date, {state_counts['new_calls']} never "
+                           f"generated, {state_counts['changed']} changed or generated with another prompt/model, "
+                           f"{state_counts['failed']} failed")
+                only_unprocessed = st.checkbox("Only unprocessed or changed calls", value=True,
+                                               help="Without a selection, the most recent calls are processed first")
+            
+            if call_options == "Process multiple calls":
                 num_calls = st.slider("Number of calls to process", min_value=1, max_value=min(50, len(calls)), value=5)
                 selected_calls = st.multiselect("Select specific calls (optional)", 
                                              [call["call_id"] for call in calls],
                                              max_selections=num_calls)
                 
                 if st.button("Generate QA from Selected Calls"):
-                    if not selected_calls:
-                        selected_calls = [call["call_id"] for call in calls[:num_calls]]
+                    if only_unprocessed:
+                        candidates = AppDatabase.get_calls_needing_generation(
+                            project_id, CALL_GENERATION_VERSION, llm_model.model_name, limit=num_calls,
+                            call_ids=selected_calls or None)
+                        selected_calls = [call["call_id"] for call in candidates]
+                    elif not selected_calls:
+                        recent_calls = sorted(calls, key=lambda call: call["timestamp"] or "", reverse=True)
+                        selected_calls = [call["call_id"] for call in recent_calls[:num_calls]]
                     
-                    with st.spinner(f"Generating QA pairs from {len(selected_calls)} calls..."):
-                        all_qa_pairs = []
-                        progress_bar = st.progress(0)
-                        
-                        for i, call_id in enumerate(selected_calls):
-                            call = AppDatabase.get_call(project_id, call_id)
-                            if call and call["transcript"]:
-                                qa_pairs = generate_qa_from_transcript(call["transcript"], call_id, gemini_model)
-                                if qa_pairs:
-                                    all_qa_pairs.extend(qa_pairs)
-                            
-                            progress_bar.progress((i + 1) / len(selected_calls))
-                            time.sleep(0.5)  # To avoid rate limiting
-                        
-                        progress_bar.empty()
-                        
-                        if not all_qa_pairs:
-                            st.warning("No QA pairs could be generated from the selected calls.")
-                        else:
-                            st.success(f"Generated {len(all_qa_pairs)} QA pairs in total!")
-                            
-                            # Preview in expandable sections
-                            st.subheader("Review Generated QA Pairs")
-                            
-                            # Group by call_id for better organization
-                            qa_by_call = {}
-                            for qa in all_qa_pairs:
-                                if qa['call_id'] not in qa_by_call:
-                                    qa_by_call[qa['call_id']] = []
-                                qa_by_call[qa['call_id']].append(qa)
-                            
-                            # Button to save all without checking duplicates (for bulk operations)
-                            if st.button("Save All Without Checking Duplicates"):
-                                saved_count = 0
-                                for qa in all_qa_pairs:
-                                    # Validate data before saving
-                                    if not qa.get('question') or not qa.get('answer'):
-                                        st.error(f"Invalid QA pair data: missing question or answer")
-                                        continue
-                                        
-                                    success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                    if success:
-                                        saved_count += 1
-                                    else:
-                                        st.error(f"Failed to save QA pair: {qa['question'][:50]}...")
-                                        
-                                    # Add a small delay to prevent database locking
-                                    time.sleep(0.1)
-                                
-                                st.success(f"Saved {saved_count} QA pairs successfully!")
-                                st.rerun()
-                            
-                            # Or review each call's QA pairs
-                            st.write("Or review QA pairs by call:")
-                            
-                            for call_id, qa_pairs in qa_by_call.items():
-                                with st.expander(f"Call ID: {call_id} ({len(qa_pairs)} pairs)"):
-                                    for i, qa in enumerate(qa_pairs):
-                                        st.write(f"**Q{i+1}:** {qa['question']}")
-                                        st.write(f"**A{i+1}:** {qa['answer']}")
-                                        st.write("---")
-                            
-                                    call_selected = st.checkbox(f"Save all pairs from call {call_id}", value=True, key=f"save_call_{call_id}")
-                                    
-                                    if call_selected:
-                                        duplicate_action = st.radio(
-                                            "If duplicates are found:",
-                                            ["Skip duplicates", "Override existing", "Save as new entries"],
-                                            key=f"dup_action_{call_id}"
-                                        )
-                                        
-                                        if st.button(f"Save QA Pairs for Call {call_id}"):
-                                            existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
-                                            saved_count = 0
-                                            updated_count = 0
-                                            skipped_count = 0
-                                            
-                                            for qa in qa_pairs:
-                                                duplicate = check_duplicate_qa(project_id, qa['question'], existing_qa_pairs)
-                                                
-                                                if duplicate:
-                                                    if duplicate_action == "Skip duplicates":
-                                                        skipped_count += 1
-                                                        continue
-                                                    elif duplicate_action == "Override existing":
-                                                        AppDatabase.remove_qa_pair(project_id, duplicate['id'])
-                                                        success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                                        if success:
-                                                            updated_count += 1
-                                                    else:  # Save as new
-                                                        success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                                        if success:
-                                                            saved_count += 1
-                                                else:
-                                                    success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                                    if success:
-                                                        saved_count += 1
-                                            
-                                            result_msg = []
-                                            if saved_count > 0:
-                                                result_msg.append(f"{saved_count} new QA pairs saved")
-                                            if updated_count > 0:
-                                                result_msg.append(f"{updated_count} existing QA pairs updated")
-                                            if skipped_count > 0:
-                                                result_msg.append(f"{skipped_count} duplicates skipped")
-                                            
-                                            st.success(f"Operation completed successfully! {' and '.join(result_msg)}.")
+                    if not selected_calls:
+                        st.info("All of these calls are already up to date.")
+                    else:
+                        # Generation runs in the background; results are kept until they are reviewed below
+                        job_id = queue_generation_job(project_id, selected_calls, llm_model, max_workers=max_workers,
+                                                      pack_token_budget=pack_token_budget, window_tokens=window_tokens)
+                        st.success(f"Queued generation job #{job_id} for {len(selected_calls)} calls. "
+                                   "Follow its progress and review the results under Generation Jobs.")
             
             elif call_options == "Process all calls":
                 max_calls = st.slider("Maximum number of calls to process", 
@@ -525,377 +455,481 @@ with tab1:
                                     value=min(20, len(calls)))
                 
                 if st.button("Generate QA from All Calls"):
-                    calls_to_process = calls[:max_calls]
-                    with st.spinner(f"Generating QA pairs from {len(calls_to_process)} calls..."):
-                        all_qa_pairs = []
-                        progress_bar = st.progress(0)
-                        
-                        for i, call in enumerate(calls_to_process):
-                            if call and call["transcript"]:
-                                qa_pairs = generate_qa_from_transcript(call["transcript"], call["call_id"], gemini_model)
-                                if qa_pairs:
-                                    all_qa_pairs.extend(qa_pairs)
-                            
-                            progress_bar.progress((i + 1) / len(calls_to_process))
-                            time.sleep(0.5)  # To avoid rate limiting
-                        
-                        progress_bar.empty()
-                        
-                        if not all_qa_pairs:
-                            st.warning("No QA pairs could be generated from the calls.")
-                        else:
-                            st.success(f"Generated {len(all_qa_pairs)} QA pairs in total!")
-                            
-                            duplicate_action = st.radio(
-                                "If duplicates are found:",
-                                ["Skip duplicates", "Override existing", "Save as new entries"],
-                                key="bulk_dup_action"
-                            )
-                            
-                            if st.button("Save All Generated QA Pairs"):
-                                existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
-                                saved_count = 0
-                                updated_count = 0
-                                skipped_count = 0
-                                
-                                for qa in all_qa_pairs:
-                                    duplicate = check_duplicate_qa(project_id, qa['question'], existing_qa_pairs)
-                                    
-                                    if duplicate:
-                                        if duplicate_action == "Skip duplicates":
-                                            skipped_count += 1
-                                            continue
-                                        elif duplicate_action == "Override existing":
-                                            AppDatabase.remove_qa_pair(project_id, duplicate['id'])
-                                            success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                            if success:
-                                                updated_count += 1
-                                        else:  # Save as new
-                                            success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                            if success:
-                                                saved_count += 1
-                                    else:
-                                        success = AppDatabase.store_qa_pair(project_id, qa['question'], qa['answer'], qa['call_id'])
-                                        if success:
-                                            saved_count += 1
-                                
-                                result_msg = []
-                                if saved_count > 0:
-                                    result_msg.append(f"{saved_count} new QA pairs saved")
-                                if updated_count > 0:
-                                    result_msg.append(f"{updated_count} existing QA pairs updated")
-                                if skipped_count > 0:
-                                    result_msg.append(f"{skipped_count} duplicates skipped")
-                                
-                                st.success(f"Operation completed successfully! {' and '.join(result_msg)}.")
-                                st.rerun()
+                    if only_unprocessed:
+                        call_ids = [call["call_id"] for call in AppDatabase.get_calls_needing_generation(
+                            project_id, CALL_GENERATION_VERSION, llm_model.model_name, limit=max_calls)]
+                    else:
+                        recent_calls = sorted(calls, key=lambda call: call["timestamp"] or "", reverse=True)
+                        call_ids = [call["call_id"] for call in recent_calls[:max_calls] if call["transcript"]]
+                    
+                    if not call_ids:
+                        st.info("All calls are already up to date.")
+                    else:
+                        job_id = queue_generation_job(project_id, call_ids, llm_model, max_workers=max_workers,
+                                                      pack_token_budget=pack_token_budget, window_tokens=window_tokens)
+                        st.success(f"Queued generation job #{job_id} for {len(call_ids)} calls. "
+                                   "Follow its progress and review the results under Generation Jobs.")
     
     # Generate from document upload
     elif gen_options == "Document Upload":
         st.subheader("Generate from Document")
+        
+        # Pairs saved from a document chunk that a later upload of the document no longer contains
+        flagged_pairs = AppDatabase.get_flagged_document_qa_pairs(project_id)
+        if flagged_pairs:
+            with st.expander(f"⚠️ {len(flagged_pairs)} QA pairs come from document sections that were removed"):
+                st.dataframe([{
+                    "ID": qa["id"],
+                    "Question": qa["question"],
+                    "Answer": qa["answer"],
+                    "Document": qa["file_name"],
+                    "Section": qa["title"] or ""
+                } for qa in flagged_pairs], hide_index=True, use_container_width=True)
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("Delete flagged QA pairs"):
+                        for qa in flagged_pairs:
+                            AppDatabase.remove_qa_pair(project_id, qa["id"])
+                        st.success(f"Deleted {len(flagged_pairs)} QA pairs.")
+                        st.rerun()
+                with col2:
+                    if st.button("Keep them and clear the flag"):
+                        AppDatabase.unflag_document_qa_pairs(project_id, [qa["id"] for qa in flagged_pairs])
+                        st.rerun()
+        
         uploaded_file = st.file_uploader("Upload .txt or .md file", type=["txt", "md"])
         
         if uploaded_file:
             file_type = uploaded_file.name.split(".")[-1].lower()
-            text = uploaded_file.read().decode("utf-8")
-            
-            # Preprocess the text
-            preprocessed_text = preprocess_text(text)
+            # Only the start of the file is decoded for the preview; processing streams the rest
+            sample = read_text_sample(uploaded_file, PREVIEW_SAMPLE_BYTES)
             
             # Show before/after preprocessing
             col1, col2 = st.columns(2)
             with col1:
                 st.write("Original Text Sample (first 500 chars):")
-                st.text_area("Original", text[:500], height=200, disabled=True)
+                st.text_area("Original", sample[:500], height=200, disabled=True)
             with col2:
                 st.write("Preprocessed Text Sample (first 500 chars):")
-                st.text_area("Preprocessed", preprocessed_text[:500], height=200, disabled=True)
+                st.text_area("Preprocessed", preprocess_text(sample)[:500], height=200, disabled=True)
             
-            chunk_size = st.slider("Chunk Size", min_value=500, max_value=5000, value=1500, step=100,
-                                 help="Larger chunks include more context but may result in less specific QA pairs")
+            chunk_tokens = st.slider("Chunk Size (tokens)", min_value=100, max_value=int(window_tokens),
+                                     value=min(DEFAULT_CHUNK_TOKENS, int(window_tokens)), step=50,
+                                     help="Larger chunks include more context but may result in less specific QA pairs. "
+                                          "Chunks end at paragraph breaks and, for .md files, at headings.")
+            regenerate_all = st.checkbox(
+                "Regenerate unchanged sections",
+                help="By default, sections whose content is unchanged since the last upload of a file with this "
+                     "name are skipped; only new or edited ones are sent to the model."
+            )
             
             if st.button("Process Document"):
-                with st.spinner("Processing document..."):
-                    # Save the file for future reference
-                    file_path = save_uploaded_file(project_id, uploaded_file)
-                    AppDatabase.store_document(project_id, uploaded_file.name, file_path, file_type)
+                # One set of instruction caches for all of the document's requests
+                with st.spinner("Processing document..."), prefix_cache_session():
+                    # Save the file for future reference; identical content is stored only once
+                    file_path, content_hash, _ = store_uploaded_file(uploaded_file)
+                    document_id = AppDatabase.store_document(project_id, uploaded_file.name, file_path, file_type,
+                                                             content_hash)
                     
-                    if file_type == "md":
-                        sections = extract_md_sections(preprocessed_text)
+                    uploaded_file.seek(0)
+                    lines = iter_text_lines(uploaded_file, max_line_chars=chunk_tokens * 4)
+                    chunks = [{"title": chunk["title"], "content": preprocess_text(chunk["content"])}
+                              for chunk in chunk_document(lines, chunk_tokens, markdown=file_type == "md")]
+                    
+                    if any(chunk["title"] for chunk in chunks):
+                        # Text before the first heading is titled after the document
+                        kind = "md_section"
+                        items = [{"title": chunk["title"] or uploaded_file.name, "content": chunk["content"]}
+                                 for chunk in chunks]
+                    else:
+                        # Plain text, or markdown without headings
+                        kind = "chunk"
+                        items = [chunk["content"] for chunk in chunks]
+                    
+                    pending, unchanged, removed = plan_document_generation(
+                        project_id, uploaded_file.name, items, kind, llm_model.model_name, regenerate=regenerate_all)
+                    
+                    results = []
+                    if pending and kind == "md_section":
+                        results = generate_with_live_preview(
+                            lambda items, **kwargs: generate_qa_for_md_sections(
+                                items, llm_model, max_workers=max_workers, dead_letter_project_id=project_id,
+                                **kwargs),
+                            pending, lambda i: f"section '{pending[i]['title']}'")
+                    elif pending:
+                        results = generate_with_live_preview(
+                            lambda items, **kwargs: generate_qa_for_chunks(
+                                items, llm_model, max_workers=max_workers, dead_letter_project_id=project_id, **kwargs),
+                            pending, lambda i: f"chunk {i + 1}")
+                    
+                    record_document_generation(project_id, uploaded_file.name, document_id, kind, results,
+                                               llm_model.model_name, removed)
+                    
+                    # Kept in the session so the review below survives the reruns of saving
+                    pairs = [dict(qa, chunk_hash=document_chunk_hash(item)) for item, qa_pairs, _ in results
+                             for qa in qa_pairs]
+                    for qa in pairs:
+                        similar = find_similar_qa(project_id, qa["question"])
+                        qa["similar_question"] = similar["question"] if similar else None
+                    # Chunks are only marked done once their pairs are saved below
+                    st.session_state.document_qa = {
+                        "file_name": uploaded_file.name,
+                        "document_id": document_id,
+                        "kind": kind,
+                        "model_name": llm_model.model_name,
+                        "chunk_titles": {document_chunk_hash(item): item["title"] if kind == "md_section" else None
+                                         for item, _, _ in results},
+                        "pairs": pairs,
+                    }
+                    
+                    summary = (f"{len(items)} {'sections' if kind == 'md_section' else 'chunks'}: "
+                               f"{len(pending)} new or changed, {unchanged} unchanged and skipped")
+                    if removed:
+                        summary += f", {len(removed)} removed since the last upload"
+                    st.info(summary + ".")
+            
+            document_qa = st.session_state.get("document_qa")
+            if document_qa and document_qa["file_name"] == uploaded_file.name:
+                all_qa_pairs = document_qa["pairs"]
+                if not all_qa_pairs:
+                    st.warning("No new QA pairs were generated from the document.")
+                else:
+                    st.success(f"Generated {len(all_qa_pairs)} QA pairs from the document!")
+                    
+                    # Show preview with ability to select pairs
+                    st.subheader("Review Generated QA Pairs")
+                    
+                    # Rows for display and selection
+                    qa_rows = [{
+                        "Select": not qa.get("similar_question"),
+                        "Question": qa["question"],
+                        "Answer": qa["answer"],
+                        "Section": qa.get("section", "Main"),
+                        "Similar Existing Question": qa.get("similar_question") or ""
+                    } for qa in all_qa_pairs]
+                    
+                    if any(row["Similar Existing Question"] for row in qa_rows):
+                        st.warning("Pairs resembling an existing question are left unselected: they may still ask "
+                                   "something different. Select the ones to keep; they are saved as new entries.")
+                    edited_rows = st.data_editor(qa_rows, hide_index=True, use_container_width=True,
+                                                 disabled=["Similar Existing Question"])
+                    
+                    # Options for handling duplicates
+                    duplicate_action = st.radio(
+                        "If the same question already exists:",
+                        ["Skip duplicates", "Override existing", "Save as new entries"],
+                        key="doc_dup_action"
+                    )
+                    
+                    if st.button("Save Selected QA Pairs"):
+                        selected_rows = [(index, row) for index, row in enumerate(edited_rows) if row["Select"]]
                         
-                        if not sections:
-                            # If no sections found, treat as plain text
-                            text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=200)
-                            chunks = text_splitter.split_text(preprocessed_text)
-                            
-                            all_qa_pairs = []
-                            progress_bar = st.progress(0)
+                        if len(selected_rows) == 0:
+                            st.error("Please select at least one QA pair to save.")
+                        else:
+                            existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
+                            saved_count = 0
+                            updated_count = 0
+                            skipped_count = 0
+                            # (chunk_hash, qa_id) of every stored pair, so removed chunks can flag them later
+                            chunk_links = []
                             
-                            for i, chunk in enumerate(chunks):
-                                qa_chunk = generate_qa_from_transcript(chunk, None, gemini_model)
-                                all_qa_pairs.extend(qa_chunk)
-                                progress_bar.progress((i + 1) / len(chunks))
-                                time.sleep(0.5)  # To avoid rate limiting
+                            for index, row in selected_rows:
+                                question = row["Question"]
+                                answer = row["Answer"]
+                                
+                                duplicate = check_duplicate_qa(project_id, question, existing_qa_pairs)
+                                
+                                if duplicate:
+                                    if duplicate_action == "Skip duplicates":
+                                        skipped_count += 1
+                                        continue
+                                    elif duplicate_action == "Override existing":
+                                        AppDatabase.remove_qa_pair(project_id, duplicate['id'])
+                                        qa_id = AppDatabase.store_qa_pair(project_id, question, answer, None)
+                                        if qa_id:
+                                            updated_count += 1
+                                    else:  # Save as new
+                                        qa_id = AppDatabase.store_qa_pair(project_id, question, answer, None)
+                                        if qa_id:
+                                            saved_count += 1
+                                else:
+                                    qa_id = AppDatabase.store_qa_pair(project_id, question, answer, None)
+                                    if qa_id:
+                                        saved_count += 1
+                                if qa_id:
+                                    chunk_links.append((all_qa_pairs[index]["chunk_hash"], qa_id))
                             
-                            progress_bar.empty()
-                        else:
-                            all_qa_pairs = []
-                            progress_bar = st.progress(0)
+                            record_saved_document_pairs(project_id, document_qa["file_name"],
+                                                        document_qa["document_id"], document_qa["kind"],
+                                                        document_qa["model_name"], document_qa["chunk_titles"],
+                                                        chunk_links)
+                            del st.session_state.document_qa
                             
-                            for i, section in enumerate(sections):
-                                qa_pairs = generate_qa_from_md_section(section, gemini_model)
-                                all_qa_pairs.extend(qa_pairs)
-                                progress_bar.progress((i + 1) / len(sections))
-                                time.sleep(0.5)  # To avoid rate limiting
+                            result_msg = []
+                            if saved_count > 0:
+                                result_msg.append(f"{saved_count} new QA pairs saved")
+                            if updated_count > 0:
+                                result_msg.append(f"{updated_count} existing QA pairs updated")
+                            if skipped_count > 0:
+                                result_msg.append(f"{skipped_count} duplicates skipped")
                             
-                            progress_bar.empty()
-                    else:
-                        # Plain text processing
-                        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=200)
-                        chunks = text_splitter.split_text(preprocessed_text)
-                        
-                        all_qa_pairs = []
-                        progress_bar = st.progress(0)
-                        
-                        for i, chunk in enumerate(chunks):
-                            qa_chunk = generate_qa_from_transcript(chunk, None)
-                            all_qa_pairs.extend(qa_chunk)
-                            progress_bar.progress((i + 1) / len(chunks))
-                            time.sleep(0.5)  # To avoid rate limiting
-                        
-                        progress_bar.empty()
+                            st.success(f"Operation completed successfully! {' and '.join(result_msg)}.")
+                            st.rerun()
+    
+    # Background generation jobs. Progress is polled while a job is active; generated
+    # pairs stay in the database until they are reviewed and saved or discarded.
+    generation_jobs = AppDatabase.get_project_generation_jobs(project_id)
+    if generation_jobs:
+        polling = any(job["status"] in ACTIVE_STATUSES for job in generation_jobs)
+        if polling:
+            ensure_worker()  # resumes queued jobs after a server restart
+        
+        @st.fragment(run_every=2 if polling else None)
+        def show_generation_jobs():
+            st.subheader("Generation Jobs")
+            # Result of the last save, kept across the rerun that drops the saved pairs from the review
+            if "generation_job_saved" in st.session_state:
+                st.success(st.session_state.pop("generation_job_saved"))
+            jobs = AppDatabase.get_project_generation_jobs(project_id)
+            for job in jobs:
+                job_id = job["job_id"]
+                progress = describe_generation_job(job)
+                active = job["status"] in ACTIVE_STATUSES
+                with st.container(border=True):
+                    st.write(f"**Job #{job_id}** ({job['status']}): {progress['processed']}/{progress['total']} calls, "
+                             f"{job['failed_items']} failed, {job['pairs_generated']} QA pairs generated")
+                    if active:
+                        st.progress(progress["progress"])
+                        details = []
+                        if progress["per_minute"]:
+                            details.append(f"{progress['per_minute']:.1f} calls/min")
+                        if progress["eta_seconds"] is not None:
+                            minutes, seconds = divmod(int(progress["eta_seconds"]), 60)
+                            details.append(f"about {minutes}m {seconds:02d}s remaining")
+                        if details:
+                            st.caption(", ".join(details))
+                        if st.button("Cancel Job", key=f"cancel_generation_job_{job_id}"):
+                            cancel_generation_job(job_id)
+                            st.rerun()
+                    if job["last_error"]:
+                        st.error(f"Last error: {job['last_error']}")
                     
-                    if not all_qa_pairs:
-                        st.warning("No QA pairs could be generated from the document.")
-                    else:
-                        st.success(f"Generated {len(all_qa_pairs)} QA pairs from the document!")
-                        
-                        # Show preview with ability to select pairs
-                        st.subheader("Review Generated QA Pairs")
-                        
-                        # Create dataframe for better display and selection
-                        qa_df = pd.DataFrame([{
-                            "Select": True,
-                            "Question": qa["question"],
-                            "Answer": qa["answer"],
-                            "Section": qa.get("section", "Main")
-                        } for qa in all_qa_pairs])
-                        
-                        edited_df = st.data_editor(qa_df, hide_index=True, use_container_width=True)
-                        
-                        # Options for handling duplicates
-                        duplicate_action = st.radio(
-                            "If duplicates are found:",
-                            ["Skip duplicates", "Override existing", "Save as new entries"],
-                            key="doc_dup_action"
-                        )
-                        
-                        if st.button("Save Selected QA Pairs"):
-                            selected_rows = edited_df[edited_df["Select"]]
+                    # Each call's pairs are stored as soon as it finishes; show them while the job runs
+                    if job["unsaved_pairs"] and active:
+                        with st.expander(f"Results so far ({job['unsaved_pairs']} QA pairs)", expanded=True):
+                            st.caption("Pairs can be edited and saved once the job has finished.")
+                            streamed_pairs = AppDatabase.get_pending_qa_pairs(job_id)
+                            st.dataframe([{
+                                "Question": qa["question"],
+                                "Answer": qa["answer"],
+                                "Call ID": qa["call_id"]
+                            } for qa in reversed(streamed_pairs)], hide_index=True, use_container_width=True)
+                    
+                    if job["unsaved_pairs"] and not active:
+                        with st.expander(f"Review {job['unsaved_pairs']} unsaved QA pairs"):
+                            pending_pairs = AppDatabase.get_pending_qa_pairs(job_id)
+                            # Looked up once per set of pending pairs, not on every poll of this fragment
+                            similar_key = f"generation_job_similar_{job_id}"
+                            pending_ids = [qa["id"] for qa in pending_pairs]
+                            if st.session_state.get(similar_key, (None,))[0] != pending_ids:
+                                similar_questions = []
+                                for qa in pending_pairs:
+                                    similar = find_similar_qa(project_id, qa["question"])
+                                    similar_questions.append(similar["question"] if similar else "")
+                                st.session_state[similar_key] = (pending_ids, similar_questions)
+                            similar_questions = st.session_state[similar_key][1]
+                            review_rows = [{
+                                "Select": not similar_question,
+                                "Question": qa["question"],
+                                "Answer": qa["answer"],
+                                "Call ID": qa["call_id"],
+                                "Similar Existing Question": similar_question
+                            } for qa, similar_question in zip(pending_pairs, similar_questions)]
+                            if any(similar_questions):
+                                st.warning("Pairs resembling an existing question are left unselected: they may "
+                                           "still ask something different. Select the ones to keep; they are "
+                                           "saved as new entries.")
+                            edited_rows = st.data_editor(review_rows, hide_index=True, use_container_width=True,
+                                                         disabled=["Call ID", "Similar Existing Question"],
+                                                         key=f"generation_job_review_{job_id}")
+                            duplicate_action = st.radio(
+                                "If the same question already exists:",
+                                ["Skip duplicates", "Override existing", "Save as new entries"],
+                                key=f"generation_job_dup_action_{job_id}"
+                            )
                             
-                            if len(selected_rows) == 0:
-                                st.error("Please select at least one QA pair to save.")
-                            else:
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                save_clicked = st.button("Save Selected QA Pairs", key=f"save_generation_job_{job_id}",
+                                                         help="Unselected pairs are discarded")
+                            with col2:
+                                if st.button("Discard All", key=f"discard_generation_job_{job_id}"):
+                                    AppDatabase.remove_pending_qa_pairs(job_id)
+                                    st.rerun()
+                            
+                            if save_clicked:
                                 existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
                                 saved_count = 0
                                 updated_count = 0
                                 skipped_count = 0
                                 
-                                for _, row in selected_rows.iterrows():
-                                    question = row["Question"]
-                                    answer = row["Answer"]
+                                for row in [row for row in edited_rows if row["Select"]]:
+                                    duplicate = check_duplicate_qa(project_id, row["Question"], existing_qa_pairs)
                                     
-                                    duplicate = check_duplicate_qa(project_id, question, existing_qa_pairs)
-                                    
-                                    if duplicate:
-                                        if duplicate_action == "Skip duplicates":
-                                            skipped_count += 1
-                                            continue
-                                        elif duplicate_action == "Override existing":
-                                            AppDatabase.remove_qa_pair(project_id, duplicate['id'])
-                                            success = AppDatabase.store_qa_pair(project_id, question, answer, None)
-                                            if success:
-                                                updated_count += 1
-                                        else:  # Save as new
-                                            success = AppDatabase.store_qa_pair(project_id, question, answer, None)
-                                            if success:
-                                                saved_count += 1
-                                    else:
-                                        success = AppDatabase.store_qa_pair(project_id, question, answer, None)
-                                        if success:
+                                    if duplicate and duplicate_action == "Skip duplicates":
+                                        skipped_count += 1
+                                        continue
+                                    if duplicate and duplicate_action == "Override existing":
+                                        AppDatabase.remove_qa_pair(project_id, duplicate['id'])
+                                    if AppDatabase.store_qa_pair(project_id, row["Question"], row["Answer"], row["Call ID"]):
+                                        if duplicate and duplicate_action == "Override existing":
+                                            updated_count += 1
+                                        else:
                                             saved_count += 1
                                 
-                                result_msg = []
-                                if saved_count > 0:
-                                    result_msg = []
-                                if saved_count > 0:
-                                    result_msg.append(f"{saved_count} new QA pairs saved")
-                                if updated_count > 0:
-                                    result_msg.append(f"{updated_count} existing QA pairs updated")
-                                if skipped_count > 0:
-                                    result_msg.append(f"{skipped_count} duplicates skipped")
-                                
-                                st.success(f"Operation completed successfully! {' and '.join(result_msg)}.")
-                                st.rerun()
+                                AppDatabase.remove_pending_qa_pairs(job_id)
+                                st.session_state.generation_job_saved = (
+                                    f"Job #{job_id}: {saved_count} new QA pairs saved, {updated_count} existing "
+                                    f"QA pairs updated, {skipped_count} duplicates skipped.")
+                                st.rerun(scope="fragment")
+            
+            if polling and not any(job["status"] in ACTIVE_STATUSES for job in jobs):
+                st.rerun()  # all jobs finished: rerun the page once to stop polling
+        
+        show_generation_jobs()
 
 # Tab 2: Import QA Pairs
 with tab2:
     st.header("Import QA Pairs")
-    uploaded_file = st.file_uploader("Upload CSV or Excel file with QA pairs", type=["csv", "xlsx"])
     
-    if uploaded_file is not None:
-        try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+    # Interrupted or failed imports can be resumed from their last committed batch
+    unfinished_jobs = AppDatabase.get_unfinished_import_jobs(project_id, "qa_pairs")
+    if unfinished_jobs:
+        from utils.import_jobs import run_import_job, describe_import_job
+        st.subheader("Unfinished Imports")
+        for job in unfinished_jobs:
+            with st.expander(f"Job #{job['job_id']}: {job['file_name']} ({job['status']})"):
+                st.write(describe_import_job(job))
+                if job["last_error"]:
+                    st.error(f"Last error: {job['last_error']}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("Resume Import", key=f"resume_qa_job_{job['job_id']}"):
+                        progress_bar = st.progress(0)
+                        total = job["total_rows"] or 1
+                        job = run_import_job(job["job_id"],
+                                             progress_callback=lambda j: progress_bar.progress(min(1.0, j["next_row"] / total)))
+                        if job["status"] == "completed":
+                            st.success(f"Import completed: {describe_import_job(job)}")
+                            st.rerun()
+                        else:
+                            st.error(f"Import stopped: {job['last_error']}")
+                with col2:
+                    if st.button("Discard Job", key=f"discard_qa_job_{job['job_id']}"):
+                        AppDatabase.update_import_job_status(job["job_id"], "cancelled")
+                        st.rerun()
+    
+    # Mapping columns and ticking rows in the preview only reruns the preview; a finished
+    # import reruns the page so the other tabs show the new pairs
+    @st.fragment
+    def qa_import_preview():
+        uploaded_file = st.file_uploader("Upload CSV, Excel, Parquet or Arrow file with QA pairs", type=IMPORT_FILE_TYPES)
+    
+        if uploaded_file is not None:
+            # pandas and pyarrow are only loaded once a file is uploaded
+            from utils.data_formats import list_columns, read_columns
+            try:
+                # Only read the header here; rows are loaded after the columns are mapped
+                columns = list_columns(uploaded_file)
             
-            st.success("File uploaded successfully!")
+                st.success("File uploaded successfully!")
             
-            # Column mapping
-            st.subheader("Map Columns")
-            columns = df.columns.tolist()
-            question_col = st.selectbox("Select Question Column", columns, key="question_col")
-            answer_col = st.selectbox("Select Answer Column", columns, key="answer_col")
-            call_id_col = st.session_state.get("import_call_id_col")
+                # Column mapping
+                st.subheader("Map Columns")
+                question_col = st.selectbox("Select Question Column", columns, key="question_col")
+                answer_col = st.selectbox("Select Answer Column", columns, key="answer_col")
             
-            # Optional call_id column
-            has_call_id = st.checkbox("File includes Call ID column", value=False)
-            if has_call_id:
-                call_id_col = st.selectbox("Select Call ID Column", columns, key="call_id_col")
+                # Optional call_id column
+                has_call_id = st.checkbox("File includes Call ID column", value=False)
+                if has_call_id:
+                    call_id_col = st.selectbox("Select Call ID Column", columns, key="call_id_col")
             
-            # Preview data
-            st.subheader("Preview Data")
-            preview_cols = [question_col, answer_col]
-            if has_call_id:
-                preview_cols.append(call_id_col)
+                # Preview data
+                st.subheader("Preview Data")
+                preview_cols = [question_col, answer_col]
+                if has_call_id:
+                    preview_cols.append(call_id_col)
             
-            preview_df = df[preview_cols].copy()
-            column_map = {
-                question_col: "Question",
-                answer_col: "Answer"
-            }
-            if has_call_id:
-                column_map[call_id_col] = "Call ID"
+                df = read_columns(uploaded_file, preview_cols)
+                preview_df = df[preview_cols].copy()
+                column_map = {
+                    question_col: "Question",
+                    answer_col: "Answer"
+                }
+                if has_call_id:
+                    column_map[call_id_col] = "Call ID"
             
-            preview_df = preview_df.rename(columns=column_map)
-            preview_df.insert(0, "Import", True)
+                preview_df = preview_df.rename(columns=column_map)
+                preview_df.insert(0, "Import", True)
             
-            # Clean up the data
-            preview_df["Question"] = preview_df["Question"].astype(str).apply(lambda x: x.strip())
-            preview_df["Answer"] = preview_df["Answer"].astype(str).apply(lambda x: x.strip())
-            if has_call_id:
-                preview_df["Call ID"] = preview_df["Call ID"].astype(str).apply(lambda x: x.strip() if x and x.lower() != 'nan' else None)
+                # Clean up the data
+                preview_df["Question"] = preview_df["Question"].astype(str).apply(lambda x: x.strip())
+                preview_df["Answer"] = preview_df["Answer"].astype(str).apply(lambda x: x.strip())
+                if has_call_id:
+                    preview_df["Call ID"] = preview_df["Call ID"].astype(str).apply(lambda x: x.strip() if x and x.lower() != 'nan' else None)
             
-            # Remove completely empty rows
-            preview_df = preview_df.dropna(subset=["Question", "Answer"], how='all')
+                # Remove completely empty rows
+                preview_df = preview_df.dropna(subset=["Question", "Answer"], how='all')
             
-            # Data editor for review
-            edited_df = st.data_editor(preview_df, hide_index=True, use_container_width=True)
+                # Data editor for review
+                edited_df = st.data_editor(preview_df, hide_index=True, use_container_width=True)
             
-            # Import selected QA pairs
-            if st.button("Import Selected QA Pairs"):
-                selected_rows = edited_df[edited_df["Import"]]
-                if len(selected_rows) == 0:
-                    st.error("Please select at least one QA pair to import.")
-                else:
-                    # Check for existing QA pairs
-                    existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
-                    duplicate_count = 0
-                    
-                    for _, row in selected_rows.iterrows():
-                        question = row["Question"]
-                        duplicate = check_duplicate_qa(project_id, question, existing_qa_pairs)
-                        if duplicate:
-                            duplicate_count += 1
-                    
-                    if duplicate_count > 0:
-                        st.warning(f"Found {duplicate_count} potential duplicate question(s). How would you like to proceed?")
-                        duplicate_action = st.radio(
-                            "Choose action for duplicates:",
-                            ["Skip duplicates", "Override existing", "Save as new entries"],
-                            key="import_dup_action"
-                        )
+                duplicate_action = st.radio(
+                    "Choose action for duplicates:",
+                    ["Skip duplicates", "Override existing", "Save as new entries"],
+                    key="import_dup_action"
+                )
+            
+                # Import selected QA pairs as a resumable job
+                if st.button("Import Selected QA Pairs"):
+                    # Rows dropped from the preview (completely empty) are excluded as well
+                    excluded_rows = sorted(set(df.index) - set(edited_df.index[edited_df["Import"]]))
+                    if len(excluded_rows) == len(df):
+                        st.error("Please select at least one QA pair to import.")
                     else:
-                        duplicate_action = "Skip duplicates"  # Default, but won't matter
+                        job_column_map = {"question": question_col, "answer": answer_col}
+                        preview_columns = {"question": "Question", "answer": "Answer"}
+                        if has_call_id:
+                            job_column_map["call_id"] = call_id_col
+                            preview_columns["call_id"] = "Call ID"
+                        from utils.import_jobs import create_import_job, get_edited_rows, run_import_job
+                        # The job reads rows from the stored file; cells fixed in the preview go with it
+                        edited_rows = get_edited_rows(preview_df, edited_df, preview_columns)
+                        job_id = create_import_job(project_id, "qa_pairs", uploaded_file, job_column_map,
+                                                   duplicate_action, excluded_rows, total_rows=len(df),
+                                                   edited_rows=edited_rows)
                     
-                    confirm_import = st.button("Confirm Import")
-                    if confirm_import:
                         with st.spinner("Importing QA pairs, please wait..."):
-                            saved_count = 0
-                            updated_count = 0
-                            skipped_count = 0
-                            error_count = 0
-                            
-                            for _, row in selected_rows.iterrows():
-                                question = row["Question"]
-                                answer = row["Answer"]
-                                call_id = row.get("Call ID", None)
-                                
-                                # Skip empty questions or answers
-                                if not question or not answer or pd.isna(question) or pd.isna(answer):
-                                    error_count += 1
-                                    continue
-                                
-                                # Clean up call_id
-                                if call_id and (pd.isna(call_id) or call_id.lower() == 'nan' or call_id.strip() == ''):
-                                    call_id = None
-                                
-                                # Check for duplicates
-                                duplicate = check_duplicate_qa(project_id, question, existing_qa_pairs)
-                                
-                                try:
-                                    if duplicate:
-                                        if duplicate_action == "Skip duplicates":
-                                            skipped_count += 1
-                                            continue
-                                        elif duplicate_action == "Override existing":
-                                            remove_success = AppDatabase.remove_qa_pair(project_id, duplicate['id'])
-                                            if not remove_success:
-                                                st.error(f"Failed to remove existing QA pair: '{question[:50]}...'")
-                                                error_count += 1
-                                                continue
-                                                
-                                            success = AppDatabase.store_qa_pair(project_id, question, answer, call_id)
-                                            if success:
-                                                updated_count += 1
-                                            else:
-                                                st.error(f"Failed to update QA pair: '{question[:50]}...'")
-                                                error_count += 1
-                                        else:  # Save as new
-                                            success = AppDatabase.store_qa_pair(project_id, question, answer, call_id)
-                                            if success:
-                                                saved_count += 1
-                                            else:
-                                                st.error(f"Failed to save new QA pair: '{question[:50]}...'")
-                                                error_count += 1
-                                    else:
-                                        success = AppDatabase.store_qa_pair(project_id, question, answer, call_id)
-                                        if success:
-                                            saved_count += 1
-                                        else:
-                                            st.error(f"Failed to save QA pair: '{question[:50]}...'")
-                                            error_count += 1
-                                            
-                                    # Add a small delay to prevent database locking
-                                    time.sleep(0.1)
-                                    
-                                except Exception as e:
-                                    st.error(f"Error processing QA pair: {str(e)}")
-                                    error_count += 1
-                        
+                            progress_bar = st.progress(0)
+                            job = run_import_job(job_id,
+                                                 progress_callback=lambda j: progress_bar.progress(min(1.0, j["next_row"] / max(1, len(df)))))
+                    
                         # Show import results
                         result_msg = []
-                        if saved_count > 0:
-                            result_msg.append(f"{saved_count} new QA pairs saved")
-                        if updated_count > 0:
-                            result_msg.append(f"{updated_count} existing QA pairs updated")
-                        if skipped_count > 0:
-                            result_msg.append(f"{skipped_count} duplicates skipped")
-                        if error_count > 0:
-                            result_msg.append(f"{error_count} errors encountered")
-                        
-                        if saved_count > 0 or updated_count > 0:
+                        if job["imported_count"] > 0:
+                            result_msg.append(f"{job['imported_count']} new QA pairs saved")
+                        if job["updated_count"] > 0:
+                            result_msg.append(f"{job['updated_count']} existing QA pairs updated")
+                        if job["skipped_count"] > 0:
+                            result_msg.append(f"{job['skipped_count']} duplicates skipped")
+                        if job["error_count"] > 0:
+                            result_msg.append(f"{job['error_count']} errors encountered")
+                    
+                        if job["status"] != "completed":
+                            st.error(f"Import stopped at row {job['next_row']}: {job['last_error']}. "
+                                     "Resume it from 'Unfinished Imports' above.")
+                        elif job["imported_count"] > 0 or job["updated_count"] > 0:
                             st.success(f"Import completed successfully! {' and '.join(result_msg)}")
                             # Give user time to see the success message before refreshing
                             time.sleep(2)
@@ -904,24 +938,79 @@ with tab2:
                             st.error(f"Import failed. {' and '.join(result_msg)}")
                             st.write("Please check the console logs for more details or try again.")
                 
-        except Exception as e:
-            st.error(f"Error processing file: {str(e)}")
+            except Exception as e:
+                st.error(f"Error processing file: {str(e)}")
+    
+    qa_import_preview()
 
 # Tab 3: View QA Pairs and Generate from Calls
 with tab3:
     st.header("View QA Pairs")
-    qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
     
-    if not qa_pairs:
-        st.write("No QA pairs stored in this project yet.")
-    else:
-        st.write(f"Total QA pairs: {len(qa_pairs)}")
+    # Paraphrased questions found through the project's MinHash/LSH index. Finding them only
+    # reruns this panel; collapsing groups reruns the page, as every other view changes
+    @st.fragment
+    def near_duplicate_panel():
+        with st.expander("Near-duplicate questions"):
+            near_threshold = st.slider(
+                "Word overlap threshold (Jaccard)", min_value=0.3, max_value=1.0,
+                value=min(1.0, max(0.3, get_near_duplicate_threshold() or DEFAULT_NEAR_DUPLICATE_THRESHOLD)), step=0.05,
+                help="Questions sharing at least this share of their words count as near-duplicates."
+            )
+            if st.button("Find near-duplicates"):
+                # New groups start unselected
+                st.session_state.pop("near_duplicate_groups", None)
+                with st.spinner("Comparing questions..."):
+                    st.session_state.near_duplicate_clusters = (
+                        near_threshold, find_near_duplicate_clusters(project_id, near_threshold))
+            found = st.session_state.get("near_duplicate_clusters")
+            if found is not None:
+                found_threshold, clusters = found
+                if not clusters:
+                    st.info("No near-duplicate questions found.")
+                else:
+                    # Only the groups on screen can be selected, so nothing unseen is deleted
+                    shown = clusters[:100]
+                    st.write(f"{len(clusters)} groups of near-duplicates. Collapsing a selected group keeps its "
+                             "oldest pair and deletes the others that still resemble it.")
+                    edited_groups = st.data_editor([{
+                        "Collapse": False,
+                        "Group": number,
+                        "Kept": f"#{cluster[0]['id']} {cluster[0]['question']}",
+                        "Near-duplicates": "; ".join(f"#{qa['id']} {qa['question']}" for qa in cluster[1:]),
+                    } for number, cluster in enumerate(shown, 1)],
+                        hide_index=True, use_container_width=True, disabled=["Group", "Kept", "Near-duplicates"],
+                        key="near_duplicate_groups")
+                    if len(clusters) > len(shown):
+                        st.caption(f"Showing the {len(shown)} largest of {len(clusters)} groups; "
+                                   "find near-duplicates again after collapsing them to see the rest.")
+                    if st.button("Collapse selected groups"):
+                        selected = [shown[i] for i, row in enumerate(edited_groups) if row["Collapse"]]
+                        if not selected:
+                            st.error("Please select at least one group to collapse.")
+                        else:
+                            # Pairs edited or deleted since the groups were found are checked again first
+                            removed = collapse_near_duplicates(project_id, selected, found_threshold)
+                            del st.session_state.near_duplicate_clusters
+                            st.session_state.pop("near_duplicate_groups", None)
+                            st.success(f"Deleted {removed} near-duplicate QA pairs.")
+                            st.rerun()
+    
+    # The list and editor rerun on their own when pairs are browsed, edited or deleted, and only
+    # read the page of pairs on screen; the other tabs catch up on the next full rerun
+    @st.fragment
+    def qa_pair_browser():
+        total_pairs = AppDatabase.count_qa_pairs(project_id)
+        if not total_pairs:
+            st.write("No QA pairs stored in this project yet.")
+            return
+        st.write(f"Total QA pairs: {total_pairs}")
         
         # Add search and filter functionality
         search_query = st.text_input("Search for questions containing:", key="qa_search")
         
         # Filter by call ID
-        call_ids = list(set([qa["call_id"] for qa in qa_pairs if qa["call_id"]]))
+        call_ids = AppDatabase.get_qa_call_ids(project_id)
         if call_ids:
             filter_call = st.checkbox("Filter by Call ID")
             if filter_call:
@@ -934,27 +1023,21 @@ with tab3:
             selected_call_id = "All"
         
         # Apply filters
-        filtered_qa_pairs = qa_pairs
-        if search_query:
-            filtered_qa_pairs = [qa for qa in filtered_qa_pairs if search_query.lower() in qa["question"].lower()]
-        
-        if selected_call_id != "All":
-            filtered_qa_pairs = [qa for qa in filtered_qa_pairs if qa["call_id"] == selected_call_id]
+        call_filter = None if selected_call_id == "All" else selected_call_id
+        filtered_count = AppDatabase.count_qa_pairs(project_id, search_query, call_filter)
         
-        st.write(f"Showing {len(filtered_qa_pairs)} of {len(qa_pairs)} QA pairs")
+        st.write(f"Showing {filtered_count} of {total_pairs} QA pairs")
         
         # Pagination
         items_per_page = st.slider("Items per page", 5, 50, 10)
-        total_pages = max(1, (len(filtered_qa_pairs) + items_per_page - 1) // items_per_page)
+        total_pages = max(1, (filtered_count + items_per_page - 1) // items_per_page)
         
         col1, col2, col3 = st.columns([1, 3, 1])
         with col2:
             page_number = st.number_input("Page", min_value=1, max_value=total_pages, value=1, step=1)
         
-        start_idx = (page_number - 1) * items_per_page
-        end_idx = min(start_idx + items_per_page, len(filtered_qa_pairs))
-        
-        page_items = filtered_qa_pairs[start_idx:end_idx]
+        page_items = AppDatabase.get_qa_pairs_page(project_id, search_query, call_filter, items_per_page,
+                                                   (page_number - 1) * items_per_page)
         
         for i, qa in enumerate(page_items):
             with st.expander(f"#{qa['id']} - {qa['question'][:50]}..."):
@@ -963,19 +1046,32 @@ with tab3:
                 st.write(f"**Call ID:** {qa['call_id'] or 'None'}")
                 st.write(f"**Created on:** {qa['created_at']}")
                 
-                col1, col2 = st.columns(2)
+                col1, col2, col3 = st.columns(3)
+                with col3:
+                    if st.button("Similar questions", key=f"similar_{qa['id']}"):
+                        st.session_state.similar_to_qa_id = qa['id']
+                if st.session_state.get("similar_to_qa_id") == qa['id']:
+                    similar = find_similar_questions(project_id, qa['question'], exclude_ids=[qa['id']])
+                    if similar:
+                        st.dataframe([{
+                            "ID": match["id"],
+                            "Question": match["question"],
+                            "Similarity": round(match["similarity"], 2),
+                        } for match in similar], hide_index=True, use_container_width=True)
+                    else:
+                        st.caption("No similar questions in this project.")
                 with col1:
                     if st.button("Edit", key=f"edit_{qa['id']}"):
                         st.session_state.editing_qa_id = qa['id']
                         st.session_state.editing_question = qa['question']
                         st.session_state.editing_answer = qa['answer']
                         st.session_state.editing_call_id = qa['call_id']
-                        st.rerun()
+                        st.rerun(scope="fragment")
                 with col2:
                     if st.button("Delete", key=f"delete_{qa['id']}"):
                         if AppDatabase.remove_qa_pair(project_id, qa["id"]):
                             st.success("QA pair deleted successfully!")
-                            st.rerun()
+                            st.rerun(scope="fragment")
                         else:
                             st.error("Failed to delete QA pair.")
         
@@ -1004,7 +1100,7 @@ with tab3:
                         del st.session_state.editing_question
                         del st.session_state.editing_answer
                         del st.session_state.editing_call_id
-                        st.rerun()
+                        st.rerun(scope="fragment")
                     else:
                         st.error("Failed to update QA pair.")
             with col2:
@@ -1014,14 +1110,18 @@ with tab3:
                     del st.session_state.editing_question
                     del st.session_state.editing_answer
                     del st.session_state.editing_call_id
-                    st.rerun()
+                    st.rerun(scope="fragment")
+    
+    if AppDatabase.count_qa_pairs(project_id):
+        near_duplicate_panel()
+    qa_pair_browser()
 
 # Tab 4: Export QA Pairs
 with tab4:
     st.header("Export QA Pairs")
-    qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
+    total_pairs = AppDatabase.count_qa_pairs(project_id)
     
-    if not qa_pairs:
+    if not total_pairs:
         st.write("No QA pairs available to export.")
     else:
         # Filter options for export
@@ -1029,20 +1129,23 @@ with tab4:
         export_opt = st.radio("Select what to export:", 
                            ["All QA Pairs", "Filter by Search", "Select Specific Pairs"])
         
-        export_format = st.selectbox("Export Format", ["CSV", "Excel", "JSONL"], key="export_format")
+        export_format = st.selectbox("Export Format", EXPORT_FORMATS, key="export_format")
         
-        # Initialize empty filtered list
-        filtered_export_pairs = []
+        # Pairs are counted and previewed in SQL; only the export itself reads them all
+        export_count = 0
+        preview_pairs = []
+        export_filters = {"option": export_opt}
         
         if export_opt == "All QA Pairs":
-            filtered_export_pairs = qa_pairs
-            st.write(f"Exporting all {len(qa_pairs)} QA pairs")
+            export_count = total_pairs
+            preview_pairs = AppDatabase.get_qa_pairs_page(project_id, limit=5)
+            st.write(f"Exporting all {total_pairs} QA pairs")
             
         elif export_opt == "Filter by Search":
             search_query = st.text_input("Search for questions containing:", key="export_search")
             
             # Filter by call ID
-            call_ids = list(set([qa["call_id"] for qa in qa_pairs if qa["call_id"]]))
+            call_ids = AppDatabase.get_qa_call_ids(project_id)
             if call_ids:
                 filter_call = st.checkbox("Filter by Call ID", key="export_filter_call")
                 if filter_call:
@@ -1055,16 +1158,16 @@ with tab4:
                 selected_call_id = "All"
             
             # Apply filters
-            filtered_export_pairs = qa_pairs
-            if search_query:
-                filtered_export_pairs = [qa for qa in filtered_export_pairs if search_query.lower() in qa["question"].lower()]
-            
-            if selected_call_id != "All":
-                filtered_export_pairs = [qa for qa in filtered_export_pairs if qa["call_id"] == selected_call_id]
+            call_filter = None if selected_call_id == "All" else selected_call_id
+            export_count = AppDatabase.count_qa_pairs(project_id, search_query, call_filter)
+            preview_pairs = AppDatabase.get_qa_pairs_page(project_id, search_query, call_filter, limit=5)
             
-            st.write(f"Exporting {len(filtered_export_pairs)} of {len(qa_pairs)} QA pairs")
+            export_filters.update({"search": search_query, "call_id": selected_call_id})
+            st.write(f"Exporting {export_count} of {total_pairs} QA pairs")
             
         elif export_opt == "Select Specific Pairs":
+            # The picker lists every pair, so only this option loads them up front
+            qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
             selected_qa_ids = st.multiselect("Select QA Pairs to Export",
                                           [f"#{qa['id']} - {qa['question'][:50]}..." for qa in qa_pairs],
                                           key="export_selected_pairs")
@@ -1072,71 +1175,88 @@ with tab4:
             # Extract IDs from selection strings
             selected_ids = [int(item.split('-')[0][1:].strip()) for item in selected_qa_ids]
             
-            filtered_export_pairs = [qa for qa in qa_pairs if qa["id"] in selected_ids]
+            selected_pairs = [qa for qa in qa_pairs if qa["id"] in selected_ids]
+            export_count = len(selected_pairs)
+            preview_pairs = selected_pairs[:5]
+            export_filters["ids"] = sorted(selected_ids)
             
-            st.write(f"Exporting {len(filtered_export_pairs)} selected QA pairs")
+            st.write(f"Exporting {export_count} selected QA pairs")
         
         # Preview export data
-        if filtered_export_pairs:
+        if export_count:
             st.subheader("Export Preview")
             
-            preview_df = pd.DataFrame([{
+            preview_rows = [{
                 "ID": qa["id"],
                 "Question": qa["question"],
                 "Answer": qa["answer"],
                 "Call ID": qa["call_id"] or "",
                 "Created At": qa["created_at"]
-            } for qa in filtered_export_pairs[:5]])  # Show only first 5 for preview
+            } for qa in preview_pairs]  # Show only first 5 for preview
             
-            st.dataframe(preview_df, use_container_width=True)
+            st.dataframe(preview_rows, use_container_width=True)
             
-            if len(filtered_export_pairs) > 5:
-                st.info(f"Showing preview of first 5 entries. Full export will include {len(filtered_export_pairs)} entries.")
+            if export_count > 5:
+                st.info(f"Showing preview of first 5 entries. Full export will include {export_count} entries.")
             
             # Generate export file
-            export_df = pd.DataFrame([{
-                "ID": qa["id"],
-                "Question": qa["question"],
-                "Answer": qa["answer"],
-                "Call ID": qa["call_id"] or "",
-                "Created At": qa["created_at"]
-            } for qa in filtered_export_pairs])
+            def build_qa_export():
+                from utils.data_formats import QA_EXPORT_COLUMNS, serialize_export, batched
+                if export_opt == "All QA Pairs":
+                    # Stream straight from the DB cursor
+                    batches = AppDatabase.iter_project_qa_pairs(project_id)
+                else:
+                    if export_opt == "Filter by Search":
+                        export_pairs = AppDatabase.get_qa_pairs_page(project_id, search_query, call_filter,
+                                                                     limit=export_count)
+                    else:
+                        export_pairs = selected_pairs
+                    batches = batched([(qa["id"], qa["question"], qa["answer"], qa["call_id"], qa["created_at"])
+                                       for qa in export_pairs])
+                return serialize_export(export_format, batches, QA_EXPORT_COLUMNS,
+                                        jsonl_keys=["id", "question", "answer", "call_id", "created_at"])
             
-            if export_format == "CSV":
-                csv_data = export_df.to_csv(index=False)
-                st.download_button(
-                    label="Download CSV",
-                    data=csv_data,
-                    file_name=f"qa_pairs_project_{project_id}.csv",
-                    mime="text/csv"
-                )
-            elif export_format == "Excel":
-                buffer = io.BytesIO()
-                export_df.to_excel(buffer, index=False)
-                buffer.seek(0)
-                st.download_button(
-                    label="Download Excel",
-                    data=buffer.getvalue(),
-                    file_name=f"qa_pairs_project_{project_id}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            # Unchanged projects are served from the export cache
+            data = get_or_build_export(project_id, export_filters, export_format, build_qa_export)
+            extension, mime = EXPORT_FILE_TYPES[export_format]
+            st.download_button(
+                label=f"Download {export_format}",
+                data=data,
+                file_name=f"qa_pairs_project_{project_id}.{extension}",
+                mime=mime
+            )
+        
+        # Training-ready dataset built straight from the DB cursor
+        st.subheader("Fine-tuning Dataset")
+        st.info("Exports every QA pair in the project as chat-format JSONL (system/user/assistant), "
+                "split into train/validation by a stable hash of the question and sharded into gzip files.")
+        ft_system_prompt = st.text_area("System prompt", DEFAULT_SYSTEM_PROMPT, key="ft_system_prompt")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            ft_validation_percent = st.number_input("Validation %", min_value=0.0, max_value=50.0, value=10.0,
+                                                    step=1.0, key="ft_validation_percent")
+        with col2:
+            ft_max_shard_mb = st.number_input("Max shard size (MB, uncompressed)", min_value=1, max_value=2048,
+                                              value=100, key="ft_max_shard_mb")
+        with col3:
+            ft_split_seed = st.text_input("Split seed", "v1", key="ft_split_seed",
+                                          help="Changing the seed reshuffles which questions go to validation")
+        
+        if st.button("Build Fine-tuning Dataset"):
+            progress_text = st.empty()
+            with st.spinner("Building dataset..."):
+                output_dir, manifest = build_finetune_dataset(
+                    project_id, ft_system_prompt, ft_validation_percent, ft_split_seed, ft_max_shard_mb,
+                    progress_callback=lambda n: progress_text.write(f"{n} examples written...")
                 )
-            else:  # JSONL
-                # Convert to JSONL format (one JSON object per line)
-                jsonl_data = "" 
-                for _, row in export_df.iterrows():
-                    # Convert row to dict and then to JSON string
-                    json_obj = {
-                        "id": row["ID"],
-                        "question": row["Question"],
-                        "answer": row["Answer"],
-                        "call_id": row["Call ID"] if row["Call ID"] else None,
-                        "created_at": row["Created At"]
-                    }
-                    jsonl_data += json.dumps(json_obj) + "\n"
-                
-                st.download_button(
-                    label="Download JSONL",
-                    data=jsonl_data,
-                    file_name=f"qa_pairs_project_{project_id}.jsonl",
-                    mime="application/jsonl"
-                )
\ No newline at end of file
+            progress_text.empty()
+            st.success(f"Built {manifest['total_examples']} examples "
+                       f"({manifest['splits']['train']['examples']} train, "
+                       f"{manifest['splits']['validation']['examples']} validation) in {output_dir}")
+            st.json(manifest, expanded=False)
+            st.download_button(
+                label="Download Dataset (zip)",
+                data=zip_dataset(output_dir),
+                file_name=f"{os.path.basename(output_dir)}_project_{project_id}.zip",
+                mime="application/zip"
+            )
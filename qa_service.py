@@ -0,0 +1,90 @@
+"""Standalone HTTP service serving a project's curated QA pairs to a support chatbot.
+
+Reads the same database as the Streamlit app (DB/retell.db, so run it from
+the repository root) and answers JSON lookups from in-memory indexes that
+reload when the project's data changes:
+
+    python qa_service.py --port 8502
+
+    GET /lookup?project_id=1&q=how+much+is+the+letter&mode=auto&limit=5
+        mode: auto (exact, else full-text), exact, keyword or fts
+    GET /stats
+    GET /health
+
+There is no authentication, so it listens on 127.0.0.1 unless --host says otherwise.
+"""
+import argparse
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from dotenv import load_dotenv
+from utils.qa_lookup import QALookupService, DEFAULT_LOOKUP_LIMIT
+
+class QALookupHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a chatbot backend can reuse its connection; without TCP_NODELAY the body,
+    # written after the headers, waits on the client's delayed ACK (~40 ms per request)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    service = None
+    verbose = False
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif url.path == "/stats":
+            self._send_json(200, self.service.describe())
+        elif url.path == "/lookup":
+            try:
+                response = self.service.lookup(int(params["project_id"]), params.get("q", ""),
+                                               params.get("mode", "auto"),
+                                               params.get("limit", DEFAULT_LOOKUP_LIMIT))
+            except KeyError:
+                self._send_json(400, {"error": "project_id is required"})
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+            else:
+                self._send_json(200, response)
+        else:
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.getenv("QA_SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("QA_SERVICE_PORT", "8502")))
+    parser.add_argument("--preload", type=int, nargs="*", default=[], metavar="PROJECT_ID",
+                        help="Build these projects' indexes before accepting requests")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    QALookupHandler.service = QALookupService()
+    QALookupHandler.verbose = args.verbose
+    for project_id in args.preload:
+        QALookupHandler.service.get_index(project_id)
+    server = ThreadingHTTPServer((args.host, args.port), QALookupHandler)
+    server.daemon_threads = True
+    print(f"Serving QA lookups on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
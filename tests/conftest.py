@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the app modules the way the pages do, from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def project_id(tmp_path, monkeypatch):
+    """A fresh database in a temp directory, with one user and one project."""
+    from utils.db import AppDatabase
+    monkeypatch.chdir(tmp_path)
+    AppDatabase.initialize(force_recreate=True)
+    AppDatabase.signup("tester", "x")
+    AppDatabase.create_project(1, "tests")
+    return 1
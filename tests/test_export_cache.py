@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from utils import export_cache
+from utils.db import AppDatabase, get_db_connection
+
+def execute(sql, params=()):
+    conn = get_db_connection()
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+@pytest.mark.parametrize("write", [
+    lambda project_id: AppDatabase.store_qa_pair(project_id, "New question?", "New answer"),
+    lambda project_id: execute("UPDATE qa_pairs SET answer = 'Changed' WHERE project_id = ?", (project_id,)),
+    lambda project_id: execute("DELETE FROM qa_pairs WHERE project_id = ?", (project_id,)),
+    lambda project_id: AppDatabase.store_call(project_id, "call-2", "Another transcript"),
+    lambda project_id: AppDatabase.store_document(project_id, "notes.md", "uploads/notes.md", "md"),
+])
+def test_every_write_bumps_the_data_version(project_id, write):
+    AppDatabase.store_qa_pair(project_id, "What is an ESA?", "An emotional support animal.")
+    before = AppDatabase.get_data_version(project_id)
+    write(project_id)
+    assert AppDatabase.get_data_version(project_id) > before
+
+def test_writes_to_another_project_leave_the_version_alone(project_id):
+    AppDatabase.create_project(1, "other")
+    before = AppDatabase.get_data_version(project_id)
+    AppDatabase.store_qa_pair(2, "Other question?", "Other answer")
+    assert AppDatabase.get_data_version(project_id) == before
+
+def test_export_is_served_from_cache_until_the_project_changes(project_id):
+    AppDatabase.store_qa_pair(project_id, "What is an ESA?", "An emotional support animal.")
+    builds = []
+
+    def build():
+        builds.append(1)
+        return f"export {len(builds)}".encode()
+
+    assert export_cache.get_or_build_export(project_id, {"option": "all"}, "CSV", build) == b"export 1"
+    assert export_cache.get_or_build_export(project_id, {"option": "all"}, "CSV", build) == b"export 1"
+    assert len(builds) == 1
+
+    # Another filter set or format is cached separately
+    assert export_cache.get_or_build_export(project_id, {"option": "search"}, "CSV", build) == b"export 2"
+
+    AppDatabase.store_qa_pair(project_id, "How long does it take?", "About a week.")
+    assert export_cache.get_or_build_export(project_id, {"option": "all"}, "CSV", build) == b"export 3"
+
+def test_stale_files_are_removed_on_the_next_export(project_id):
+    export_cache.get_or_build_export(project_id, {}, "CSV", lambda: b"old")
+    old_files = os.listdir(export_cache.CACHE_DIR)
+    AppDatabase.store_qa_pair(project_id, "What is an ESA?", "An emotional support animal.")
+    export_cache.get_or_build_export(project_id, {}, "CSV", lambda: b"new")
+    files = os.listdir(export_cache.CACHE_DIR)
+    assert len(files) == 1 and files != old_files
+
+def test_export_changed_while_building_is_not_cached(project_id):
+    def build():
+        AppDatabase.store_qa_pair(project_id, "Written mid-export?", "Yes")
+        return b"racy"
+
+    assert export_cache.get_or_build_export(project_id, {}, "CSV", build) == b"racy"
+    assert not os.path.isdir(export_cache.CACHE_DIR) or not os.listdir(export_cache.CACHE_DIR)
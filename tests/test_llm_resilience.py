@@ -0,0 +1,59 @@
+import httpx
+import pytest
+
+from utils.llm_resilience import (OTHER, PARSE_ERROR, RATE_LIMIT, SAFETY_BLOCK, SERVER_ERROR, TIMEOUT,
+                                  CircuitBreaker, classify_error, should_retry)
+from utils.qa_parsing import QAParseError
+
+def test_parse_error_wins_over_rate_limit_text_in_the_response():
+    error = QAParseError("Could not parse any QA pairs from the model response: '429 rate limit'")
+    assert classify_error(error) == PARSE_ERROR
+
+@pytest.mark.parametrize("message, kind", [
+    ("429 Resource exhausted", RATE_LIMIT),
+    ("Rate limit reached for requests", RATE_LIMIT),
+    ("Response blocked by safety filters", SAFETY_BLOCK),
+    ("Request timed out", TIMEOUT),
+    ("Deadline exceeded", TIMEOUT),
+    ("Invalid argument", OTHER),
+])
+def test_messages(message, kind):
+    assert classify_error(RuntimeError(message)) == kind
+
+def test_builtin_timeout():
+    assert classify_error(TimeoutError()) == TIMEOUT
+
+def test_google_exceptions():
+    google_exceptions = pytest.importorskip("google.api_core.exceptions")
+    assert classify_error(google_exceptions.ResourceExhausted("quota")) == RATE_LIMIT
+    assert classify_error(google_exceptions.DeadlineExceeded("slow")) == TIMEOUT
+    assert classify_error(google_exceptions.ServiceUnavailable("down")) == SERVER_ERROR
+    assert classify_error(google_exceptions.InternalServerError("oops")) == SERVER_ERROR
+
+def _openai_status_error(openai, status, cls=None):
+    request = httpx.Request("POST", "http://localhost/v1/chat/completions")
+    return (cls or openai.APIStatusError)("failed", response=httpx.Response(status, request=request), body=None)
+
+def test_openai_exceptions():
+    openai = pytest.importorskip("openai")
+    request = httpx.Request("POST", "http://localhost/v1/chat/completions")
+    assert classify_error(_openai_status_error(openai, 429, openai.RateLimitError)) == RATE_LIMIT
+    assert classify_error(_openai_status_error(openai, 500, openai.InternalServerError)) == SERVER_ERROR
+    assert classify_error(_openai_status_error(openai, 503)) == SERVER_ERROR
+    assert classify_error(_openai_status_error(openai, 400, openai.BadRequestError)) == OTHER
+    assert classify_error(openai.APITimeoutError(request=request)) == TIMEOUT
+    assert classify_error(openai.APIConnectionError(request=request)) == SERVER_ERROR
+
+def test_retry_budgets():
+    assert should_retry(RATE_LIMIT, 0)
+    assert not should_retry(SAFETY_BLOCK, 0)
+    assert not should_retry(OTHER, 0)
+    assert should_retry(PARSE_ERROR, 0) and not should_retry(PARSE_ERROR, 1)
+
+def test_circuit_breaker_opens_on_failure_spike():
+    breaker = CircuitBreaker(window=10, min_requests=4, failure_threshold=0.5, cooldown_seconds=60)
+    for success in (True, True, False):
+        breaker.record(success)
+    assert not breaker.is_open
+    breaker.record(False)
+    assert breaker.is_open
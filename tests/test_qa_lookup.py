@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from utils.db import AppDatabase
+from utils.qa_lookup import QAIndex, QAIndexClosedError, QALookupService
+
+PAIRS = [
+    ("How long does an ESA letter take?", "Usually about a week."),
+    ("Can my landlord refuse my emotional support dog?", "Not under the Fair Housing Act."),
+    ("How much does the letter cost?", "The price depends on the state."),
+    ("Do airlines accept ESA letters?", "Most airlines no longer do."),
+]
+
+@pytest.fixture
+def index(project_id):
+    for question, answer in PAIRS:
+        AppDatabase.store_qa_pair(project_id, question, answer)
+    index = QAIndex(project_id, AppDatabase.get_data_version(project_id))
+    yield index
+    index.close()
+
+def questions(results):
+    return [result["question"] for result in results]
+
+def test_exact_matches_normalized_question(index):
+    assert questions(index.lookup("how long does an esa letter take", "exact")) == [PAIRS[0][0]]
+    assert index.lookup("How long does it take?", "exact") == []
+
+def test_keyword_ranks_by_shared_rare_words(index):
+    results = index.lookup("landlord dog", "keyword")
+    assert questions(results)[0] == PAIRS[1][0]
+    assert results[0]["score"] > 0
+
+def test_fts_searches_questions_and_answers(index):
+    assert questions(index.lookup("airlines", "fts")) == [PAIRS[3][0]]
+    assert questions(index.lookup("Fair Housing", "fts")) == [PAIRS[1][0]]
+    assert index.lookup("", "fts") == []
+
+def test_fts_query_syntax_is_not_interpreted(index):
+    # Quotes, operators and column filters in user input must not raise
+    for query in ['"unbalanced', "letter OR", "question: cost", "NEAR(esa letter)", "*"]:
+        index.lookup(query, "fts")
+
+def test_auto_falls_back_to_fts(index):
+    assert questions(index.lookup("How much does the letter cost?"))[:1] == [PAIRS[2][0]]
+    assert PAIRS[2][0] in questions(index.lookup("letter price"))
+
+def test_limit(index):
+    assert len(index.lookup("letter", "fts", limit=1)) == 1
+
+def test_close_releases_connections_and_rejects_lookups(index):
+    threads = [threading.Thread(target=index.lookup, args=("letter", "fts")) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    index.close()
+    assert index._keeper is None and index._idle == []
+    with pytest.raises(QAIndexClosedError):
+        index.lookup("letter", "fts")
+
+def test_service_reloads_after_writes(project_id):
+    AppDatabase.store_qa_pair(project_id, *PAIRS[0])
+    service = QALookupService(reload_seconds=0)
+    first = service.lookup(project_id, "airlines", "fts")
+    assert first["results"] == []
+    assert service.lookup(project_id, "airlines", "fts")["cached"]
+
+    AppDatabase.store_qa_pair(project_id, *PAIRS[3])
+    second = service.lookup(project_id, "airlines", "fts")
+    assert not second["cached"] and second["data_version"] != first["data_version"]
+    assert questions(second["results"]) == [PAIRS[3][0]]
+
+def test_service_rejects_unknown_mode(project_id):
+    with pytest.raises(ValueError):
+        QALookupService().lookup(project_id, "letter", "regex")
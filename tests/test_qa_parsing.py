@@ -0,0 +1,53 @@
+from utils.qa_parsing import IncrementalQAParser, parse_qa_response
+
+def feed_all(parser, pieces):
+    completed = []
+    for piece in pieces:
+        completed.extend(parser.feed(piece))
+    return completed
+
+def test_objects_split_across_pieces():
+    text = '[{"question": "What is an ESA?", "answer": "An emotional support animal."}, ' \
+           '{"question": "How long?", "answer": "A week."}]'
+    parser = IncrementalQAParser()
+    pairs = feed_all(parser, [text[i:i + 7] for i in range(0, len(text), 7)])
+    assert [qa["question"] for qa in pairs] == ["What is an ESA?", "How long?"]
+    assert not parser.pending
+
+def test_each_object_returned_once_complete():
+    parser = IncrementalQAParser()
+    assert parser.feed('[{"question": "A?", "answer": "a"}, {"question": "B') == [{"question": "A?", "answer": "a"}]
+    assert parser.pending
+    assert parser.feed('?", "answer": "b"}]') == [{"question": "B?", "answer": "b"}]
+
+def test_braces_and_escaped_quotes_inside_strings():
+    parser = IncrementalQAParser()
+    pairs = parser.feed('[{"question": "Is {this} \\"quoted\\"?", "answer": "Yes }"}]')
+    assert pairs == [{"question": 'Is {this} "quoted"?', "answer": "Yes }"}]
+
+def test_code_fences_and_prose_are_ignored():
+    parser = IncrementalQAParser()
+    pairs = parser.feed('Here you go:\n```json\n[{"question": "Q?", "answer": "A"}]\n```')
+    assert pairs == [{"question": "Q?", "answer": "A"}]
+
+def test_invalid_object_is_counted_and_skipped():
+    parser = IncrementalQAParser()
+    pairs = parser.feed('[{"question": "Q?", "answer": oops}, {"question": "R?", "answer": "r"}]')
+    assert pairs == [{"question": "R?", "answer": "r"}]
+    assert parser.invalid == 1
+
+def test_truncated_output_loses_only_the_open_object():
+    parser = IncrementalQAParser()
+    pairs = parser.feed('[{"question": "Q?", "answer": "A"}, {"question": "Cut off')
+    assert pairs == [{"question": "Q?", "answer": "A"}]
+    assert parser.pending
+
+def test_parse_qa_response_keeps_complete_pairs_of_truncated_output():
+    qa_pairs, complete = parse_qa_response('[{"question": "Q?", "answer": "A"}, {"question": "Cut')
+    assert qa_pairs == [{"question": "Q?", "answer": "A"}]
+    assert not complete
+
+def test_parse_qa_response_well_formed():
+    qa_pairs, complete = parse_qa_response('[{"question": "Q?", "answer": "A"}]')
+    assert qa_pairs == [{"question": "Q?", "answer": "A"}]
+    assert complete
@@ -0,0 +1,25 @@
+from utils.qa_utils import merge_qa_sets
+
+def qa(question):
+    return {"question": question, "answer": f"Answer to {question}"}
+
+def test_merge_keeps_order_and_distinct_questions():
+    merged = merge_qa_sets([[qa("What is an ESA letter?"), qa("How much does it cost?")],
+                            [qa("Can my landlord refuse my dog?")]])
+    assert [pair["question"] for pair in merged] == ["What is an ESA letter?", "How much does it cost?",
+                                                     "Can my landlord refuse my dog?"]
+
+def test_merge_drops_repeats_from_overlapping_windows():
+    merged = merge_qa_sets([[qa("How long does the ESA letter take?")],
+                            [qa("how long does the ESA letter take"), qa("How long does the ESA letter usually take?")]])
+    # Exact repeat (case and punctuation aside) and a rewording with 7/8 word overlap
+    assert [pair["question"] for pair in merged] == ["How long does the ESA letter take?"]
+
+def test_merge_keeps_first_occurrence():
+    first, second = qa("Is the letter valid?"), qa("Is the letter valid?")
+    assert merge_qa_sets([[first], [second]])[0] is first
+
+def test_merge_similarity_threshold():
+    sets = [[qa("How long does the ESA letter take?")], [qa("How long does the ESA letter usually take?")]]
+    assert len(merge_qa_sets(sets, similarity=1.0)) == 2
+    assert merge_qa_sets([]) == []
@@ -0,0 +1,107 @@
+import contextlib
+import contextvars
+import hashlib
+import os
+import threading
+import time
+
+# Lifetime of a provider-side prefix cache; override with CONTEXT_CACHE_TTL_SECONDS
+DEFAULT_TTL_SECONDS = 3600
+
+# A cache is extended when a request finds less than this share of its TTL left
+REFRESH_FRACTION = 0.25
+
+_session = contextvars.ContextVar("context_cache_session", default=None)
+
+def join_prompt(instruction, content):
+    return f"{instruction}\n{content}"
+
+def supports_prefix_cache(model):
+    """Providers from llm_providers take the instruction separately; other models get one joined prompt."""
+    return hasattr(model, "create_prefix_cache")
+
+class PrefixCacheSession:
+    """Provider-side caches for static instruction prefixes, owned by one generation job or page run.
+
+    The first request with a given model and instruction creates the cache; a
+    request that finds less than REFRESH_FRACTION of the TTL left extends it;
+    close() deletes every cache the session created, so none outlives its job
+    (the TTL still expires them if the process dies first). A provider that
+    cannot cache the prefix (too short, unsupported) returns no handle and the
+    instruction is sent as a plain system instruction instead.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds or float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "refreshed": 0, "deleted": 0, "unsupported": 0}
+
+    def handle_for(self, model, instruction):
+        key = (id(model), hashlib.sha256(instruction.encode("utf-8")).hexdigest())
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None:
+                # Created under the lock so concurrent workers do not each create one
+                try:
+                    handle = model.create_prefix_cache(instruction, self.ttl_seconds)
+                except Exception as e:
+                    print(f"Context cache could not be created for {model.model_name}: {e}")
+                    handle = None
+                entry = {"model": model, "handle": handle, "expires_at": now + self.ttl_seconds}
+                self._entries[key] = entry
+                self.stats["created" if handle is not None else "unsupported"] += 1
+            elif entry["handle"] is not None and entry["expires_at"] - now < self.ttl_seconds * REFRESH_FRACTION:
+                try:
+                    model.refresh_prefix_cache(entry["handle"], self.ttl_seconds)
+                    entry["expires_at"] = now + self.ttl_seconds
+                    self.stats["refreshed"] += 1
+                except Exception as e:
+                    # Expired or deleted on the provider side; fall back to the plain instruction
+                    print(f"Context cache could not be refreshed for {model.model_name}: {e}")
+                    entry["handle"] = None
+            return entry["handle"]
+
+    def close(self):
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            if entry["handle"] is None:
+                continue
+            try:
+                entry["model"].delete_prefix_cache(entry["handle"])
+                self.stats["deleted"] += 1
+            except Exception as e:
+                print(f"Context cache could not be deleted for {entry['model'].model_name}: {e}")
+
+@contextlib.contextmanager
+def prefix_cache_session(ttl_seconds=None):
+    """Reuse provider-side instruction caches for every request made inside the block, then delete them.
+
+    The generation engine runs requests in a copy of the caller's context, so
+    worker threads started inside the block use the session too.
+    """
+    session = PrefixCacheSession(ttl_seconds)
+    token = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
+        session.close()
+
+def generate_content(model, instruction, content, generation_config=None, stream=False):
+    """Request a response for instruction + content, sending the instruction separately when the model allows.
+
+    stream is only passed on to models that support it (see llm_providers); the
+    caller should check supports_streaming before iterating the response.
+    """
+    if not supports_prefix_cache(model):
+        return model.generate_content(join_prompt(instruction, content), generation_config=generation_config)
+    session = _session.get()
+    handle = session.handle_for(model, instruction) if session is not None else None
+    return model.generate_content(content, generation_config=generation_config, system_instruction=instruction,
+                                  cached_prefix=handle, stream=stream)
+
+def supports_streaming(model):
+    return getattr(model, "supports_streaming", False)
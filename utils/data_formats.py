@@ -0,0 +1,164 @@
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from utils.file_types import BINARY_EXPORTS, get_file_format
+
+# Column layouts used by the export tabs: (column name, arrow type)
+CALL_EXPORT_COLUMNS = [
+    ("Call ID", pa.string()),
+    ("Transcript", pa.string()),
+    ("Timestamp", pa.string()),
+]
+
+QA_EXPORT_COLUMNS = [
+    ("ID", pa.int64()),
+    ("Question", pa.string()),
+    ("Answer", pa.string()),
+    ("Call ID", pa.string()),
+    ("Created At", pa.string()),
+]
+
+def list_columns(uploaded_file):
+    """Return the column names of an uploaded file without loading its rows."""
+    file_format = get_file_format(uploaded_file.name)
+    uploaded_file.seek(0)
+    try:
+        if file_format == "csv":
+            return pd.read_csv(uploaded_file, nrows=0).columns.tolist()
+        if file_format == "xlsx":
+            return pd.read_excel(uploaded_file, nrows=0).columns.tolist()
+        if file_format == "parquet":
+            return pq.ParquetFile(uploaded_file).schema_arrow.names
+        if file_format in ("arrow", "feather"):
+            return pa.ipc.open_file(uploaded_file).schema.names
+        raise ValueError(f"Unsupported file format: {file_format}")
+    finally:
+        uploaded_file.seek(0)
+
+def read_columns(uploaded_file, columns):
+    """Load only the given columns of an uploaded file into a DataFrame.
+
+    Parquet and Arrow files are read with column projection, so unmapped
+    columns (often large transcript or metadata fields) are never decoded.
+    """
+    columns = list(dict.fromkeys(columns))
+    file_format = get_file_format(uploaded_file.name)
+    uploaded_file.seek(0)
+    if file_format == "csv":
+        return pd.read_csv(uploaded_file, usecols=columns)[columns]
+    if file_format == "xlsx":
+        return pd.read_excel(uploaded_file, usecols=columns)[columns]
+    if file_format == "parquet":
+        return pq.read_table(uploaded_file, columns=columns).to_pandas()
+    if file_format in ("arrow", "feather"):
+        return feather.read_table(uploaded_file, columns=columns, memory_map=False).to_pandas()
+    raise ValueError(f"Unsupported file format: {file_format}")
+
+def _schema(columns):
+    return pa.schema([pa.field(name, arrow_type) for name, arrow_type in columns])
+
+def _record_batch(rows, schema):
+    arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def write_parquet(batches, columns):
+    """Write row batches (e.g. from cursor.fetchmany) to Parquet bytes, one row group per batch."""
+    schema = _schema(columns)
+    buffer = io.BytesIO()
+    with pq.ParquetWriter(buffer, schema, compression="zstd") as writer:
+        for rows in batches:
+            if rows:
+                writer.write_batch(_record_batch(rows, schema))
+    return buffer.getvalue()
+
+def write_arrow(batches, columns):
+    """Write row batches to an Arrow IPC (Feather v2) file, one record batch per input batch."""
+    schema = _schema(columns)
+    buffer = io.BytesIO()
+    with pa.ipc.new_file(buffer, schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        for rows in batches:
+            if rows:
+                writer.write_batch(_record_batch(rows, schema))
+    return buffer.getvalue()
+
+def write_binary_export(export_format, batches, columns):
+    """Serialize row batches for a binary export format, returning (data, extension, mime)."""
+    extension, mime = BINARY_EXPORTS[export_format]
+    if export_format == "Parquet":
+        data = write_parquet(batches, columns)
+    else:
+        data = write_arrow(batches, columns)
+    return data, extension, mime
+
+def serialize_export(export_format, batches, columns, jsonl_keys=None):
+    """Serialize row batches in any export format and return the file bytes.
+
+    jsonl_keys optionally renames the JSONL record keys (defaults to the column names).
+    """
+    if export_format in BINARY_EXPORTS:
+        return write_binary_export(export_format, batches, columns)[0]
+    names = [name for name, _ in columns]
+    if export_format == "JSONL":
+        keys = jsonl_keys or names
+        lines = [json.dumps(dict(zip(keys, row)), default=str) for rows in batches for row in rows]
+        return ("\n".join(lines) + "\n" if lines else "").encode("utf-8")
+    df = pd.DataFrame([tuple(row) for rows in batches for row in rows], columns=names)
+    if export_format == "CSV":
+        return df.to_csv(index=False).encode("utf-8")
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def batched(rows, batch_size=1000):
+    """Split an in-memory list of rows into batches for the binary writers."""
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+def iter_row_batches(file_path, file_format, columns, start_row=0, batch_size=500):
+    """Yield (first_row_index, DataFrame) batches of the given columns from a stored file.
+
+    Reading starts at start_row so a resumed import skips rows it already
+    committed: CSV and Excel skip them while parsing, Parquet skips whole row
+    groups before the offset and Arrow slices the memory-mapped table.
+    """
+    columns = list(dict.fromkeys(columns))
+    skip = range(1, start_row + 1)
+    if file_format == "csv":
+        reader = pd.read_csv(file_path, usecols=columns, skiprows=skip, chunksize=batch_size)
+        row = start_row
+        for chunk in reader:
+            yield row, chunk[columns].reset_index(drop=True)
+            row += len(chunk)
+    elif file_format == "xlsx":
+        df = pd.read_excel(file_path, usecols=columns, skiprows=skip)[columns]
+        for offset in range(0, len(df), batch_size):
+            yield start_row + offset, df.iloc[offset:offset + batch_size].reset_index(drop=True)
+    elif file_format == "parquet":
+        parquet_file = pq.ParquetFile(file_path)
+        first_row, row_groups = 0, []
+        for i in range(parquet_file.num_row_groups):
+            group_rows = parquet_file.metadata.row_group(i).num_rows
+            if row_groups or first_row + group_rows > start_row:
+                row_groups.append(i)
+            else:
+                first_row += group_rows
+        if not row_groups:
+            return
+        row = first_row
+        for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=columns):
+            df = batch.to_pandas()
+            if row + len(df) > start_row:
+                trim = max(0, start_row - row)
+                yield row + trim, df.iloc[trim:].reset_index(drop=True)
+            row += len(df)
+    elif file_format in ("arrow", "feather"):
+        table = feather.read_table(file_path, columns=columns, memory_map=True).slice(start_row)
+        row = start_row
+        for batch in table.to_batches(max_chunksize=batch_size):
+            yield row, batch.to_pandas()
+            row += batch.num_rows
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
@@ -1,5 +1,7 @@
 import sqlite3
 import os
+import json
+import hashlib
 
 DB_PATH = "DB/retell.db"
 
@@ -10,6 +12,21 @@ def get_db_connection():
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
+def text_sha256(text):
+    """Content hash used for transcripts; also registered as the sha256_text SQL function."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+def _qa_pair_filter(project_id, search=None, call_id=None):
+    """WHERE clause and parameters selecting a project's QA pairs by question substring and call ID."""
+    clause, params = "project_id = ?", [project_id]
+    if search:
+        clause += r" AND question LIKE ? ESCAPE '\'"
+        params.append("%" + search.replace("\\", "\\\\").replace("%", r"\%").replace("_", r"\_") + "%")
+    if call_id:
+        clause += " AND call_id = ?"
+        params.append(call_id)
+    return clause, params
+
 class AppDatabase:
     """Extended database manager for the app."""
     
@@ -127,6 +144,211 @@ class AppDatabase:
         else:
             print("Tables already exist, skipping initialization")
         
+        # Tables added after the original schema are created on every start
+        # so that existing databases pick them up.
+        document_columns = {row["name"] for row in cursor.execute("PRAGMA table_info(documents)")}
+        if "content_hash" not in document_columns:
+            # SHA-256 of the upload; its file_path is the shared blob for that content
+            cursor.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)")
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            import_type TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_format TEXT NOT NULL,
+            column_map TEXT NOT NULL,
+            options TEXT,
+            status TEXT DEFAULT 'pending',
+            total_rows INTEGER,
+            next_row INTEGER DEFAULT 0,
+            imported_count INTEGER DEFAULT 0,
+            updated_count INTEGER DEFAULT 0,
+            skipped_count INTEGER DEFAULT 0,
+            error_count INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (project_id) REFERENCES projects (project_id)
+        )
+        ''')
+        
+        # Per-project data version, bumped by triggers on every write to project data
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS project_data_versions (
+            project_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        for table in ("calls", "qa_pairs", "documents"):
+            for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS bump_version_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO project_data_versions (project_id, version) VALUES ({row}.project_id, 1)
+                    ON CONFLICT(project_id) DO UPDATE SET version = version + 1;
+                END
+                ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_cache (
+            cache_key TEXT PRIMARY KEY,
+            project_id INTEGER NOT NULL,
+            data_version INTEGER NOT NULL,
+            export_format TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_accessed REAL NOT NULL
+        )
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            cache_key TEXT PRIMARY KEY,
+            model_name TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_accessed REAL NOT NULL,
+            hit_count INTEGER DEFAULT 0
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_response_cache (last_accessed)")
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS llm_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            item_type TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            error_kind TEXT NOT NULL,
+            error_message TEXT,
+            attempts INTEGER DEFAULT 1,
+            created_at REAL NOT NULL,
+            last_attempt_at REAL NOT NULL,
+            UNIQUE (project_id, item_type, item_key),
+            FOREIGN KEY (project_id) REFERENCES projects (project_id)
+        )
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            options TEXT,
+            total_items INTEGER DEFAULT 0,
+            processed_items INTEGER DEFAULT 0,
+            failed_items INTEGER DEFAULT 0,
+            pairs_generated INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at REAL,
+            finished_at REAL,
+            FOREIGN KEY (project_id) REFERENCES projects (project_id)
+        )
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generation_job_items (
+            job_id INTEGER NOT NULL,
+            call_id TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (job_id, call_id),
+            FOREIGN KEY (job_id) REFERENCES generation_jobs (job_id)
+        )
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pending_qa_pairs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            project_id INTEGER NOT NULL,
+            call_id TEXT,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (job_id) REFERENCES generation_jobs (job_id),
+            FOREIGN KEY (project_id) REFERENCES projects (project_id)
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_qa_pairs_job ON pending_qa_pairs (job_id)")
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_generation_state (
+            project_id INTEGER NOT NULL,
+            call_id TEXT NOT NULL,
+            transcript_hash TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pair_count INTEGER DEFAULT 0,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (project_id, call_id),
+            FOREIGN KEY (project_id) REFERENCES projects (project_id)
+        )
+        ''')
+        
+        # Generation state of each chunk/section of a document, keyed by content hash within
+        # the document's lineage (every upload with the same file name in the project)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            project_id INTEGER NOT NULL,
+            file_name TEXT NOT NULL,
+            chunk_hash TEXT NOT NULL,
+            title TEXT,
+            document_id INTEGER,
+            prompt_version TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pair_count INTEGER DEFAULT 0,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (project_id, file_name, chunk_hash),
+            FOREIGN KEY (project_id) REFERENCES projects (project_id),
+            FOREIGN KEY (document_id) REFERENCES documents (document_id)
+        )
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_chunk_qa_pairs (
+            project_id INTEGER NOT NULL,
+            file_name TEXT NOT NULL,
+            chunk_hash TEXT NOT NULL,
+            qa_id INTEGER NOT NULL,
+            PRIMARY KEY (project_id, file_name, chunk_hash, qa_id),
+            FOREIGN KEY (qa_id) REFERENCES qa_pairs (id) ON DELETE CASCADE
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_chunk_qa_pairs_qa ON document_chunk_qa_pairs (qa_id)")
+        
+        # MinHash signature of each QA pair's question for near-duplicate lookup; seq grows with
+        # every (re)computed signature so in-memory indexes can load only what changed
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qa_minhash (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            qa_id INTEGER NOT NULL UNIQUE,
+            project_id INTEGER NOT NULL,
+            signature BLOB NOT NULL,
+            FOREIGN KEY (qa_id) REFERENCES qa_pairs (id) ON DELETE CASCADE
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_qa_minhash_project ON qa_minhash (project_id, seq)")
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS qa_minhash_question_update
+        AFTER UPDATE OF question ON qa_pairs
+        BEGIN
+            DELETE FROM qa_minhash WHERE qa_id = NEW.id;
+        END
+        ''')
+        
         conn.commit()
         conn.close()
     
@@ -215,6 +437,7 @@ class AppDatabase:
 
     @staticmethod
     def store_qa_pair(project_id, question, answer, call_id=None):
+        """Insert a QA pair and return its id, or False when it could not be stored."""
         print(f"Attempting to store QA pair - Project ID: {project_id}, Call ID: {call_id}")
         print(f"Question: {question[:50]}...")
         print(f"Answer: {answer[:50]}...")
@@ -281,7 +504,7 @@ class AppDatabase:
                 print("About to commit transaction")
                 conn.commit()
                 print(f"QA pair stored successfully for project_id {project_id}, call_id {call_id}")
-                return True
+                return cursor.lastrowid
             except sqlite3.IntegrityError as e:
                 # If fails with call_id, try without it
                 if call_id is not None:
@@ -292,7 +515,7 @@ class AppDatabase:
                     """, (project_id, question.strip(), answer.strip()))
                     conn.commit()
                     print("QA pair stored successfully without call_id reference")
-                    return True
+                    return cursor.lastrowid
                 else:
                     raise e
                     
@@ -382,21 +605,53 @@ class AppDatabase:
             conn.close()
     
     @staticmethod
-    def store_document(project_id, file_name, file_path, file_type):
+    def store_document(project_id, file_name, file_path, file_type, content_hash=None):
+        """Record an upload and return its document_id, or False when it could not be stored."""
         conn = get_db_connection()
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO documents (project_id, file_name, file_path, file_type) VALUES (?, ?, ?, ?)",
-                          (project_id, file_name, file_path, file_type))
+            cursor.execute("""
+            INSERT INTO documents (project_id, file_name, file_path, file_type, content_hash) VALUES (?, ?, ?, ?, ?)
+            """, (project_id, file_name, file_path, file_type, content_hash))
             conn.commit()
             print(f"Document '{file_name}' stored for project_id {project_id}")
-            return True
+            return cursor.lastrowid
         except sqlite3.IntegrityError as e:
             print(f"Failed to store document '{file_name}': {e}")
             return False
         finally:
             conn.close()
     
+    @staticmethod
+    def get_blob_reference_counts():
+        """Return {file_path: number of documents and import jobs referencing it}."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT file_path, COUNT(*) AS refs FROM (
+            SELECT file_path FROM documents
+            UNION ALL
+            SELECT file_path FROM import_jobs
+        )
+        GROUP BY file_path
+        """)
+        counts = {row["file_path"]: row["refs"] for row in cursor.fetchall()}
+        conn.close()
+        return counts
+    
+    @staticmethod
+    def repoint_uploaded_file(old_path, file_path, content_hash):
+        """Point every document and import job stored at old_path to the blob file_path."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE documents SET file_path = ?, content_hash = ? WHERE file_path = ?",
+                          (file_path, content_hash, old_path))
+            cursor.execute("UPDATE import_jobs SET file_path = ? WHERE file_path = ?", (file_path, old_path))
+            conn.commit()
+        finally:
+            conn.close()
+    
     @staticmethod
     def get_project_qa_pairs(project_id):
         conn = get_db_connection()
@@ -424,4 +679,945 @@ class AppDatabase:
             print(f"Failed to remove QA pair {qa_id}: {e}")
             return False
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+    @staticmethod
+    def iter_project_calls(project_id, batch_size=1000):
+        """Yield the project's calls in batches straight from the cursor."""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT call_id, transcript, timestamp FROM calls WHERE project_id = ?", (project_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def iter_project_qa_pairs(project_id, batch_size=1000):
+        """Yield the project's QA pairs in batches straight from the cursor."""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, question, answer, call_id, created_at FROM qa_pairs WHERE project_id = ?",
+                          (project_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def create_import_job(project_id, import_type, file_name, file_path, file_format, column_map, options=None,
+                          total_rows=None):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            INSERT INTO import_jobs (project_id, import_type, file_name, file_path, file_format, column_map, options, total_rows)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (project_id, import_type, file_name, file_path, file_format, json.dumps(column_map),
+                  json.dumps(options or {}), total_rows))
+            job_id = cursor.lastrowid
+            conn.commit()
+            print(f"Import job {job_id} created for '{file_name}' in project_id {project_id}")
+            return job_id
+        except sqlite3.IntegrityError as e:
+            print(f"Failed to create import job for '{file_name}': {e}")
+            return None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_import_job(job_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM import_jobs WHERE job_id = ?", (job_id,))
+        job = cursor.fetchone()
+        conn.close()
+        return job
+
+    @staticmethod
+    def get_unfinished_import_jobs(project_id, import_type):
+        """Return jobs that were interrupted or failed and can be resumed."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT * FROM import_jobs
+        WHERE project_id = ? AND import_type = ? AND status IN ('pending', 'running', 'failed')
+        ORDER BY job_id DESC
+        """, (project_id, import_type))
+        jobs = cursor.fetchall()
+        conn.close()
+        return jobs
+
+    @staticmethod
+    def update_import_job_status(job_id, status, last_error=None):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            UPDATE import_jobs SET status = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE job_id = ?
+            """, (status, last_error, job_id))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_existing_call_ids(project_id, call_ids):
+        """Return the subset of call_ids already stored in the project."""
+        if not call_ids:
+            return set()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(call_ids))
+        cursor.execute(f"SELECT call_id FROM calls WHERE project_id = ? AND call_id IN ({placeholders})",
+                      (project_id, *call_ids))
+        existing = {row["call_id"] for row in cursor.fetchall()}
+        conn.close()
+        return existing
+
+    @staticmethod
+    def commit_import_batch(job_id, project_id, import_type, rows, next_row, counts, remove_qa_ids=None):
+        """Write one import batch and checkpoint the job in a single transaction.
+
+        For 'calls' jobs rows are (call_id, transcript); for 'qa_pairs' jobs rows
+        are (question, answer, call_id). Either the whole batch and its
+        checkpoint land, or neither does, so a resumed job never double-imports.
+        """
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            if import_type == "calls":
+                cursor.executemany("INSERT OR REPLACE INTO calls (call_id, project_id, transcript) VALUES (?, ?, ?)",
+                                  [(call_id, project_id, transcript) for call_id, transcript in rows])
+            else:
+                if remove_qa_ids:
+                    cursor.executemany("DELETE FROM qa_pairs WHERE project_id = ? AND id = ?",
+                                      [(project_id, qa_id) for qa_id in remove_qa_ids])
+                # Unknown call_ids are stored as NULL, as in store_qa_pair
+                call_ids = list({call_id for _, _, call_id in rows if call_id})
+                valid_call_ids = set()
+                if call_ids:
+                    placeholders = ",".join("?" * len(call_ids))
+                    cursor.execute(f"SELECT call_id FROM calls WHERE project_id = ? AND call_id IN ({placeholders})",
+                                  (project_id, *call_ids))
+                    valid_call_ids = {row["call_id"] for row in cursor.fetchall()}
+                cursor.executemany("INSERT INTO qa_pairs (project_id, call_id, question, answer) VALUES (?, ?, ?, ?)",
+                                  [(project_id, call_id if call_id in valid_call_ids else None, question, answer)
+                                   for question, answer, call_id in rows])
+            cursor.execute("""
+            UPDATE import_jobs SET
+                next_row = ?,
+                imported_count = imported_count + ?,
+                updated_count = updated_count + ?,
+                skipped_count = skipped_count + ?,
+                error_count = error_count + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+            """, (next_row, counts.get("imported", 0), counts.get("updated", 0), counts.get("skipped", 0),
+                  counts.get("errors", 0), job_id))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to commit batch for import job {job_id}: {e}")
+            conn.rollback()
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def iter_finetune_examples(project_id, validation_percent, split_seed, batch_size=1000):
+        """Yield (id, question, answer, split) batches with the train/validation split computed in SQL.
+
+        The split bucket is a hash of the seed and the question, lowercased with
+        whitespace collapsed, so the same question always lands in the same split
+        across exports and its repeats stay together. Paraphrases hash differently
+        and can still end up on both sides of the split.
+        """
+        def split_bucket(question, seed):
+            normalized = " ".join((question or "").lower().split())
+            digest = hashlib.sha1(f"{seed}\x00{normalized}".encode("utf-8")).hexdigest()
+            return int(digest[:8], 16) % 10000
+
+        conn = get_db_connection()
+        conn.create_function("split_bucket", 2, split_bucket, deterministic=True)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT id, question, answer,
+                   CASE WHEN split_bucket(question, ?) < ? THEN 'validation' ELSE 'train' END AS split
+            FROM qa_pairs
+            WHERE project_id = ? AND question IS NOT NULL AND answer IS NOT NULL
+            ORDER BY id
+            """, (split_seed, int(round(validation_percent * 100)), project_id))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def store_dataset(project_id, dataset_name, file_path, source_type):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO datasets (project_id, dataset_name, file_path, source_type) VALUES (?, ?, ?, ?)",
+                          (project_id, dataset_name, file_path, source_type))
+            dataset_id = cursor.lastrowid
+            conn.commit()
+            print(f"Dataset '{dataset_name}' stored for project_id {project_id}")
+            return dataset_id
+        except sqlite3.IntegrityError as e:
+            print(f"Failed to store dataset '{dataset_name}': {e}")
+            return None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_data_version(project_id):
+        """Return the project's data version; it changes on every write to its calls, QA pairs or documents."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM project_data_versions WHERE project_id = ?", (project_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row["version"] if row else 0
+
+    @staticmethod
+    def get_export_cache_entry(cache_key):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM export_cache WHERE cache_key = ?", (cache_key,))
+        entry = cursor.fetchone()
+        conn.close()
+        return entry
+
+    @staticmethod
+    def touch_export_cache_entry(cache_key, accessed_at):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE export_cache SET last_accessed = ? WHERE cache_key = ?", (accessed_at, cache_key))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def store_export_cache_entry(cache_key, project_id, data_version, export_format, file_path, size_bytes,
+                                 accessed_at):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            INSERT OR REPLACE INTO export_cache
+                (cache_key, project_id, data_version, export_format, file_path, size_bytes, last_accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (cache_key, project_id, data_version, export_format, file_path, size_bytes, accessed_at))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to store export cache entry: {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_stale_export_cache_entries(project_id, data_version):
+        """Return cached exports of the project built from an older data version."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT cache_key, file_path FROM export_cache WHERE project_id = ? AND data_version != ?",
+                      (project_id, data_version))
+        entries = cursor.fetchall()
+        conn.close()
+        return entries
+
+    @staticmethod
+    def get_export_cache_lru():
+        """Return all cache entries, least recently used first, for size-based eviction."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT cache_key, file_path, size_bytes FROM export_cache ORDER BY last_accessed ASC")
+        entries = cursor.fetchall()
+        conn.close()
+        return entries
+
+    @staticmethod
+    def remove_export_cache_entries(cache_keys):
+        if not cache_keys:
+            return
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany("DELETE FROM export_cache WHERE cache_key = ?", [(key,) for key in cache_keys])
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def get_llm_cache_entry(cache_key, min_created_at, accessed_at):
+        """Return a cached response newer than min_created_at and mark it as used, or None."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT response FROM llm_response_cache WHERE cache_key = ? AND created_at >= ?",
+                          (cache_key, min_created_at))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("""
+                UPDATE llm_response_cache SET last_accessed = ?, hit_count = hit_count + 1 WHERE cache_key = ?
+                """, (accessed_at, cache_key))
+                conn.commit()
+            return row["response"] if row else None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def store_llm_cache_entry(cache_key, model_name, prompt_version, response, created_at):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            INSERT OR REPLACE INTO llm_response_cache
+                (cache_key, model_name, prompt_version, response, size_bytes, created_at, last_accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (cache_key, model_name, prompt_version, response, len(response.encode("utf-8")), created_at, created_at))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to store LLM cache entry: {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def evict_llm_cache(min_created_at, max_entries, max_bytes):
+        """Drop expired entries, then least recently used ones until under the entry and size caps."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM llm_response_cache WHERE created_at < ?", (min_created_at,))
+            expired = cursor.rowcount
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_response_cache")
+            count, total_bytes = cursor.fetchone()
+            evicted = 0
+            if count > max_entries or total_bytes > max_bytes:
+                cursor.execute("SELECT cache_key, size_bytes FROM llm_response_cache ORDER BY last_accessed ASC")
+                to_delete = []
+                for row in cursor.fetchall():
+                    if count <= max_entries and total_bytes <= max_bytes:
+                        break
+                    to_delete.append((row["cache_key"],))
+                    count -= 1
+                    total_bytes -= row["size_bytes"]
+                cursor.executemany("DELETE FROM llm_response_cache WHERE cache_key = ?", to_delete)
+                evicted = len(to_delete)
+            conn.commit()
+            return expired, evicted
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_llm_cache_summary():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS size_bytes FROM llm_response_cache")
+        summary = cursor.fetchone()
+        conn.close()
+        return {"entries": summary["entries"], "size_bytes": summary["size_bytes"]}
+
+    @staticmethod
+    def clear_llm_cache():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM llm_response_cache")
+        removed = cursor.rowcount
+        conn.commit()
+        conn.close()
+        print(f"Cleared {removed} LLM cache entries")
+        return removed
+
+    @staticmethod
+    def store_dead_letter(project_id, item_type, item_key, payload, error_kind, error_message, failed_at):
+        """Record a generation item that failed after retries; repeated failures bump its attempt count."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            INSERT INTO llm_dead_letters
+                (project_id, item_type, item_key, payload, error_kind, error_message, created_at, last_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (project_id, item_type, item_key) DO UPDATE SET
+                payload = excluded.payload,
+                error_kind = excluded.error_kind,
+                error_message = excluded.error_message,
+                attempts = attempts + 1,
+                last_attempt_at = excluded.last_attempt_at
+            """, (project_id, item_type, item_key, payload, error_kind, error_message, failed_at, failed_at))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to store dead letter for {item_type} {item_key}: {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_dead_letters(project_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT * FROM llm_dead_letters WHERE project_id = ? ORDER BY last_attempt_at DESC
+        """, (project_id,))
+        letters = cursor.fetchall()
+        conn.close()
+        return letters
+
+    @staticmethod
+    def resolve_dead_letter(project_id, item_type, item_key):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM llm_dead_letters WHERE project_id = ? AND item_type = ? AND item_key = ?",
+                      (project_id, item_type, item_key))
+        conn.commit()
+        conn.close()
+        return True
+
+    @staticmethod
+    def remove_dead_letters(project_id, letter_ids):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany("DELETE FROM llm_dead_letters WHERE project_id = ? AND id = ?",
+                          [(project_id, letter_id) for letter_id in letter_ids])
+        conn.commit()
+        conn.close()
+        return True
+
+    @staticmethod
+    def create_generation_job(project_id, call_ids, options=None):
+        """Queue a generation job over call_ids; the job and its items are written together."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            INSERT INTO generation_jobs (project_id, options, total_items) VALUES (?, ?, ?)
+            """, (project_id, json.dumps(options or {}), len(call_ids)))
+            job_id = cursor.lastrowid
+            cursor.executemany("INSERT OR IGNORE INTO generation_job_items (job_id, call_id) VALUES (?, ?)",
+                              [(job_id, call_id) for call_id in call_ids])
+            conn.commit()
+            print(f"Generation job {job_id} queued with {len(call_ids)} calls in project_id {project_id}")
+            return job_id
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Failed to create generation job: {e}")
+            return None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_generation_job(job_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT j.*, (SELECT COUNT(*) FROM pending_qa_pairs p WHERE p.job_id = j.job_id) AS unsaved_pairs
+        FROM generation_jobs j WHERE j.job_id = ?
+        """, (job_id,))
+        job = cursor.fetchone()
+        conn.close()
+        return job
+
+    @staticmethod
+    def get_project_generation_jobs(project_id, limit=10):
+        """Recent jobs, plus older ones that still have unsaved pairs to review."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT * FROM (
+            SELECT j.*, (SELECT COUNT(*) FROM pending_qa_pairs p WHERE p.job_id = j.job_id) AS unsaved_pairs
+            FROM generation_jobs j WHERE j.project_id = ?
+        )
+        WHERE unsaved_pairs > 0 OR status IN ('pending', 'running')
+           OR job_id IN (SELECT job_id FROM generation_jobs WHERE project_id = ? ORDER BY job_id DESC LIMIT ?)
+        ORDER BY job_id DESC
+        """, (project_id, project_id, limit))
+        jobs = cursor.fetchall()
+        conn.close()
+        return jobs
+
+    @staticmethod
+    def get_next_generation_job():
+        """Oldest queued job; 'running' jobs are included so work left by a restarted server is resumed."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT * FROM generation_jobs WHERE status IN ('pending', 'running') ORDER BY job_id LIMIT 1
+        """)
+        job = cursor.fetchone()
+        conn.close()
+        return job
+
+    @staticmethod
+    def update_generation_job_status(job_id, status, last_error=None, timestamp=None):
+        """Set a job's status; 'running' stamps started_at once, finished states stamp finished_at."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            if status == "running":
+                cursor.execute("""
+                UPDATE generation_jobs SET status = ?, last_error = ?, started_at = COALESCE(started_at, ?)
+                WHERE job_id = ?
+                """, (status, last_error, timestamp, job_id))
+            else:
+                cursor.execute("""
+                UPDATE generation_jobs SET status = ?, last_error = ?, finished_at = ? WHERE job_id = ?
+                """, (status, last_error, timestamp, job_id))
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_pending_generation_items(job_id, limit):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT call_id FROM generation_job_items WHERE job_id = ? AND status = 'pending' LIMIT ?
+        """, (job_id, limit))
+        call_ids = [row["call_id"] for row in cursor.fetchall()]
+        conn.close()
+        return call_ids
+
+    @staticmethod
+    def record_generation_results(job_id, project_id, results, generation_state=None):
+        """Store one batch of (call_id, qa_pairs, error) results and the job's counters in one transaction.
+
+        generation_state is an optional (prompt_version, model_name, {call_id: transcript_hash})
+        tuple; when given, the calls' generation state is updated in the same transaction.
+        """
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            if generation_state:
+                AppDatabase._upsert_generation_state(cursor, project_id, results, *generation_state)
+            pairs = [(job_id, project_id, call_id, qa['question'], qa['answer'])
+                     for call_id, qa_pairs, _ in results for qa in qa_pairs]
+            cursor.executemany("""
+            INSERT INTO pending_qa_pairs (job_id, project_id, call_id, question, answer) VALUES (?, ?, ?, ?, ?)
+            """, pairs)
+            cursor.executemany("""
+            UPDATE generation_job_items SET status = ?, error = ? WHERE job_id = ? AND call_id = ?
+            """, [("failed" if error else "done", error, job_id, call_id) for call_id, _, error in results])
+            failed = sum(1 for _, _, error in results if error)
+            cursor.execute("""
+            UPDATE generation_jobs
+            SET processed_items = processed_items + ?, failed_items = failed_items + ?,
+                pairs_generated = pairs_generated + ?
+            WHERE job_id = ?
+            """, (len(results), failed, len(pairs), job_id))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Failed to record results for generation job {job_id}: {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_pending_qa_pairs(job_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM pending_qa_pairs WHERE job_id = ? ORDER BY id", (job_id,))
+        pairs = cursor.fetchall()
+        conn.close()
+        return pairs
+
+    @staticmethod
+    def remove_pending_qa_pairs(job_id, pair_ids=None):
+        """Drop reviewed pairs of a job (all of them when pair_ids is None)."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if pair_ids is None:
+            cursor.execute("DELETE FROM pending_qa_pairs WHERE job_id = ?", (job_id,))
+        else:
+            cursor.executemany("DELETE FROM pending_qa_pairs WHERE job_id = ? AND id = ?",
+                              [(job_id, pair_id) for pair_id in pair_ids])
+        conn.commit()
+        conn.close()
+        return True
+
+    @staticmethod
+    def _upsert_generation_state(cursor, project_id, results, prompt_version, model_name, transcript_hashes):
+        cursor.executemany("""
+        INSERT INTO call_generation_state
+            (project_id, call_id, transcript_hash, prompt_version, model_name, status, pair_count, generated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (project_id, call_id) DO UPDATE SET
+            transcript_hash = excluded.transcript_hash,
+            prompt_version = excluded.prompt_version,
+            model_name = excluded.model_name,
+            status = excluded.status,
+            pair_count = excluded.pair_count,
+            generated_at = excluded.generated_at
+        """, [(project_id, call_id, transcript_hashes[call_id], prompt_version, model_name,
+               "failed" if error else "done", len(qa_pairs))
+              for call_id, qa_pairs, error in results if call_id in transcript_hashes])
+
+    @staticmethod
+    def record_call_generation_state(project_id, results, prompt_version, model_name, transcript_hashes):
+        """Record (call_id, qa_pairs, error) outcomes outside of a generation job."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            AppDatabase._upsert_generation_state(cursor, project_id, results, prompt_version, model_name,
+                                                 transcript_hashes)
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to record generation state: {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_calls_needing_generation(project_id, prompt_version, model_name, limit=None, call_ids=None):
+        """Calls with a transcript that were never generated, failed, or changed since their last generation.
+
+        A call is up to date when its state row says 'done' for the same prompt version
+        and model and the stored hash matches the current transcript; everything else
+        is selected with one anti-join. call_ids optionally restricts the candidates.
+        Most recent calls come first, so limit picks the newest ones.
+        """
+        conn = get_db_connection()
+        conn.create_function("sha256_text", 1, text_sha256, deterministic=True)
+        cursor = conn.cursor()
+        query = """
+        SELECT c.call_id, c.transcript FROM calls c
+        LEFT JOIN call_generation_state s
+            ON s.project_id = c.project_id AND s.call_id = c.call_id AND s.status = 'done'
+           AND s.prompt_version = ? AND s.model_name = ? AND s.transcript_hash = sha256_text(c.transcript)
+        WHERE c.project_id = ? AND c.transcript IS NOT NULL AND c.transcript != '' AND s.call_id IS NULL
+        """
+        params = [prompt_version, model_name, project_id]
+        if call_ids is not None:
+            query += f" AND c.call_id IN ({','.join('?' * len(call_ids))})"
+            params.extend(call_ids)
+        query += " ORDER BY c.timestamp DESC, c.rowid DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(query, params)
+        calls = cursor.fetchall()
+        conn.close()
+        return calls
+
+    @staticmethod
+    def get_generation_state_counts(project_id, prompt_version, model_name):
+        """How many of the project's calls are up to date, changed/stale, failed or never generated."""
+        conn = get_db_connection()
+        conn.create_function("sha256_text", 1, text_sha256, deterministic=True)
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT
+            SUM(CASE WHEN s.call_id IS NULL THEN 1 ELSE 0 END) AS new_calls,
+            SUM(CASE WHEN s.status = 'failed' THEN 1 ELSE 0 END) AS failed,
+            SUM(CASE WHEN s.status = 'done' AND s.prompt_version = ? AND s.model_name = ?
+                      AND s.transcript_hash = sha256_text(c.transcript) THEN 1 ELSE 0 END) AS up_to_date,
+            COUNT(*) AS total
+        FROM calls c
+        LEFT JOIN call_generation_state s ON s.project_id = c.project_id AND s.call_id = c.call_id
+        WHERE c.project_id = ? AND c.transcript IS NOT NULL AND c.transcript != ''
+        """, (prompt_version, model_name, project_id))
+        row = cursor.fetchone()
+        conn.close()
+        counts = {key: row[key] or 0 for key in ("new_calls", "failed", "up_to_date", "total")}
+        counts["changed"] = counts["total"] - counts["new_calls"] - counts["failed"] - counts["up_to_date"]
+        return counts
+
+    @staticmethod
+    def get_document_chunk_states(project_id, file_name):
+        """Generation state of every chunk ever seen in the document lineage, keyed by chunk hash."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM document_chunks WHERE project_id = ? AND file_name = ?", (project_id, file_name))
+        states = {row["chunk_hash"]: row for row in cursor.fetchall()}
+        conn.close()
+        return states
+
+    @staticmethod
+    def record_document_chunks(project_id, file_name, document_id, results, prompt_version, model_name,
+                               removed_hashes=()):
+        """Store (chunk_hash, title, pair_count, error) outcomes and mark chunks gone from the document as removed.
+
+        Both happen in one transaction, so a re-upload either fully updates the
+        lineage or leaves it as it was.
+        """
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("""
+            INSERT INTO document_chunks
+                (project_id, file_name, chunk_hash, title, document_id, prompt_version, model_name, status,
+                 pair_count, generated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (project_id, file_name, chunk_hash) DO UPDATE SET
+                title = excluded.title,
+                document_id = excluded.document_id,
+                prompt_version = excluded.prompt_version,
+                model_name = excluded.model_name,
+                status = excluded.status,
+                pair_count = excluded.pair_count,
+                generated_at = excluded.generated_at
+            """, [(project_id, file_name, chunk_hash, title, document_id or None, prompt_version, model_name,
+                   "failed" if error else "done", pair_count)
+                  for chunk_hash, title, pair_count, error in results])
+            cursor.executemany("""
+            UPDATE document_chunks SET status = 'removed'
+            WHERE project_id = ? AND file_name = ? AND chunk_hash = ?
+            """, [(project_id, file_name, chunk_hash) for chunk_hash in removed_hashes])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Failed to record chunks of document '{file_name}': {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def link_document_chunk_qa_pairs(project_id, file_name, links):
+        """Record which chunk produced each saved QA pair; links are (chunk_hash, qa_id) tuples."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("""
+            INSERT OR IGNORE INTO document_chunk_qa_pairs (project_id, file_name, chunk_hash, qa_id)
+            VALUES (?, ?, ?, ?)
+            """, [(project_id, file_name, chunk_hash, qa_id) for chunk_hash, qa_id in links])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Failed to link QA pairs to chunks of document '{file_name}': {e}")
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_flagged_document_qa_pairs(project_id):
+        """QA pairs generated from document chunks that a later upload of the document no longer contains."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT DISTINCT q.id, q.question, q.answer, l.file_name, c.title
+        FROM document_chunk_qa_pairs l
+        JOIN document_chunks c
+            ON c.project_id = l.project_id AND c.file_name = l.file_name AND c.chunk_hash = l.chunk_hash
+        JOIN qa_pairs q ON q.id = l.qa_id
+        WHERE l.project_id = ? AND c.status = 'removed'
+        ORDER BY l.file_name, q.id
+        """, (project_id,))
+        pairs = cursor.fetchall()
+        conn.close()
+        return pairs
+
+    @staticmethod
+    def unflag_document_qa_pairs(project_id, qa_ids):
+        """Keep flagged pairs: drop their links to removed chunks so they are no longer flagged."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.executemany("""
+        DELETE FROM document_chunk_qa_pairs
+        WHERE project_id = ? AND qa_id = ? AND chunk_hash IN (
+            SELECT chunk_hash FROM document_chunks c
+            WHERE c.project_id = document_chunk_qa_pairs.project_id
+              AND c.file_name = document_chunk_qa_pairs.file_name AND c.status = 'removed')
+        """, [(project_id, qa_id) for qa_id in qa_ids])
+        conn.commit()
+        conn.close()
+        return True
+
+    @staticmethod
+    def get_qa_pairs_missing_minhash(project_id, signature_bytes, batch_size=5000):
+        """Yield batches of (id, question) for QA pairs without a signature of signature_bytes bytes."""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT q.id, q.question FROM qa_pairs q
+            LEFT JOIN qa_minhash m ON m.qa_id = q.id
+            WHERE q.project_id = ? AND (m.qa_id IS NULL OR length(m.signature) != ?)
+            """, (project_id, signature_bytes))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def store_qa_minhashes(project_id, signatures):
+        """Store (qa_id, signature bytes) pairs, replacing older signatures of the same QA pairs."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Pairs deleted since their question was read are skipped instead of failing the batch
+            cursor.executemany("""
+            INSERT OR REPLACE INTO qa_minhash (qa_id, project_id, signature)
+            SELECT id, project_id, ? FROM qa_pairs WHERE id = ? AND project_id = ?
+            """, [(signature, qa_id, project_id) for qa_id, signature in signatures])
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def iter_qa_minhashes(project_id, after_seq=0, batch_size=5000):
+        """Yield batches of (seq, qa_id, question, signature) stored after after_seq, in seq order."""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+            SELECT m.seq, m.qa_id, q.question, m.signature FROM qa_minhash m
+            JOIN qa_pairs q ON q.id = m.qa_id
+            WHERE m.project_id = ? AND m.seq > ?
+            ORDER BY m.seq
+            """, (project_id, after_seq))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def count_qa_minhashes(project_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) AS n FROM qa_minhash WHERE project_id = ?", (project_id,))
+        count = cursor.fetchone()["n"]
+        conn.close()
+        return count
+
+    @staticmethod
+    def get_qa_pair_ids(project_id):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM qa_pairs WHERE project_id = ?", (project_id,))
+        ids = {row["id"] for row in cursor.fetchall()}
+        conn.close()
+        return ids
+
+    @staticmethod
+    def remove_qa_pairs(project_id, qa_ids):
+        """Delete many QA pairs in one transaction; returns how many were removed."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("DELETE FROM qa_pairs WHERE project_id = ? AND id = ?",
+                              [(project_id, qa_id) for qa_id in qa_ids])
+            removed = cursor.rowcount
+            conn.commit()
+            print(f"Removed {removed} QA pairs from project_id {project_id}")
+            return removed
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_qa_pair_stats(project_id):
+        """Return (number of QA pairs in the project, highest QA id ever assigned in the database)."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM qa_pairs WHERE project_id = ?) AS n,
+               COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'qa_pairs'), 0) AS last_id
+        """, (project_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row["n"], row["last_id"]
+
+    @staticmethod
+    def iter_qa_questions(project_id, after_id=0, batch_size=5000):
+        """Yield batches of (id, question) for the project's QA pairs with ids above after_id, in id order."""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, question FROM qa_pairs WHERE project_id = ? AND id > ? ORDER BY id",
+                          (project_id, after_id))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    @staticmethod
+    def get_qa_pairs_by_ids(project_id, qa_ids):
+        """Return {id: row} for the given QA ids of the project."""
+        qa_ids = list(qa_ids)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        found = {}
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(qa_ids), 500):
+            batch = qa_ids[start:start + 500]
+            cursor.execute(f"""
+            SELECT id, call_id, question, answer, created_at FROM qa_pairs
+            WHERE project_id = ? AND id IN ({','.join('?' * len(batch))})
+            """, (project_id, *batch))
+            found.update((row["id"], row) for row in cursor.fetchall())
+        conn.close()
+        return found
+
+    @staticmethod
+    def get_call_ids(project_id):
+        """The project's call IDs, without loading their transcripts."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT call_id FROM calls WHERE project_id = ?", (project_id,))
+        call_ids = [row["call_id"] for row in cursor.fetchall()]
+        conn.close()
+        return call_ids
+
+    @staticmethod
+    def get_qa_call_ids(project_id):
+        """Distinct call IDs that the project's QA pairs refer to."""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT call_id FROM qa_pairs WHERE project_id = ? AND call_id IS NOT NULL",
+                      (project_id,))
+        call_ids = [row["call_id"] for row in cursor.fetchall()]
+        conn.close()
+        return call_ids
+
+    @staticmethod
+    def count_qa_pairs(project_id, search=None, call_id=None):
+        """Number of the project's QA pairs whose question contains search (case-insensitive), optionally for one call."""
+        clause, params = _qa_pair_filter(project_id, search, call_id)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) AS n FROM qa_pairs WHERE {clause}", params)
+        count = cursor.fetchone()["n"]
+        conn.close()
+        return count
+
+    @staticmethod
+    def get_qa_pairs_page(project_id, search=None, call_id=None, limit=10, offset=0):
+        """One page of the QA pairs count_qa_pairs counts, in id order."""
+        clause, params = _qa_pair_filter(project_id, search, call_id)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        SELECT id, call_id, question, answer, created_at FROM qa_pairs WHERE {clause}
+        ORDER BY id LIMIT ? OFFSET ?
+        """, (*params, limit, offset))
+        qa_pairs = cursor.fetchall()
+        conn.close()
+        return qa_pairs
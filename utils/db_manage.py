@@ -1,8 +1,14 @@
+import argparse
 import os
 from utils.db import AppDatabase
+from utils.file_utils import migrate_uploads_to_blobs, remove_unreferenced_blobs
+
+# Home.py initializes the database on every rerun; moving old uploads only needs to happen once per process
+_uploads_migrated = False
 
 def initialize_database(clear=False):
     """Initialize the database if it doesn't exist, with an option to clear it."""
+    global _uploads_migrated
     db_path = "DB/retell.db"
     
     if clear:
@@ -18,8 +24,23 @@ def initialize_database(clear=False):
     else:
         print("Database found. No need to recreate tables.")
         os.makedirs(os.path.dirname(db_path), exist_ok=True) # Just ensure the directory exists, but don't recreate tables
+        AppDatabase.initialize() # Creates any tables added since the database was first built
+        if not _uploads_migrated:
+            migrate_uploads_to_blobs() # Uploads saved by name before the blob store existed
+            _uploads_migrated = True
         users = AppDatabase.list_users()
         print(f"Current users in database (username, email): {users}")
 
+def main():
+    parser = argparse.ArgumentParser(description="Initialize the app database and run maintenance tasks.")
+    parser.add_argument("--remove-unreferenced-blobs", action="store_true",
+                        help="Delete uploaded blobs no document or import job refers to any more")
+    args = parser.parse_args()
+
+    initialize_database(clear=False)
+    if args.remove_unreferenced_blobs:
+        # Kept off the page-load path: a blob is written before the row that references it
+        print(f"Removed {remove_unreferenced_blobs()} unreferenced blobs")
+
 if __name__ == "__main__":
-    initialize_database(clear=False)
\ No newline at end of file
+    main()
@@ -0,0 +1,165 @@
+import codecs
+import re
+from utils.text_normalize import estimate_tokens
+
+# Chunk size for document generation; 400 tokens is about the 1,500 characters the page used to split on
+DEFAULT_CHUNK_TOKENS = 400
+
+# Text carried over from the end of one chunk to the start of the next
+DEFAULT_CHUNK_OVERLAP_TOKENS = 50
+
+# Bytes decoded per read when streaming an uploaded file
+READ_BLOCK_BYTES = 1024 * 1024
+
+# Longest line iter_text_lines yields; longer ones, such as a whole file without newlines, come in pieces
+MAX_LINE_CHARS = 64 * 1024
+
+# Bytes of an upload decoded for the page's before/after preview
+PREVIEW_SAMPLE_BYTES = 4096
+
+_HEADING = re.compile(r'#{1,6}\s+(.*)')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def _cut_line(line, max_chars):
+    """Split line into a first piece of at most max_chars, ending at a space where there is one, and the rest."""
+    cut = line.rfind(" ", 1, max_chars + 1)
+    if cut <= 0:
+        cut = max_chars
+    return line[:cut], line[cut:].lstrip(" ")
+
+def iter_text_lines(binary_file, encoding="utf-8", max_line_chars=MAX_LINE_CHARS):
+    """Yield the lines of a binary file-like object (without line endings), decoding it block by block.
+
+    Lines longer than max_line_chars are yielded in pieces of at most that
+    many characters, so memory stays bounded even for a file without newlines.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    while True:
+        block = binary_file.read(READ_BLOCK_BYTES)
+        lines = (pending + decoder.decode(block, final=not block)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            line = line.rstrip("\r")
+            while len(line) > max_line_chars:
+                piece, line = _cut_line(line, max_line_chars)
+                yield piece
+            yield line
+        # The unfinished last line is flushed in pieces too, rather than growing with every block
+        while len(pending) > max_line_chars:
+            piece, pending = _cut_line(pending, max_line_chars)
+            yield piece
+        if not block:
+            break
+    if pending:
+        yield pending.rstrip("\r")
+
+def read_text_sample(binary_file, max_bytes):
+    """The first max_bytes of an uploaded file as text, without copying the rest of it."""
+    return bytes(binary_file.getbuffer()[:max_bytes]).decode("utf-8", errors="ignore")
+
+def _split_long_text(text, max_tokens):
+    """Cut text longer than max_tokens at sentence ends, or at whitespace for overlong sentences."""
+    if estimate_tokens(text) <= max_tokens:
+        yield text
+        return
+    max_chars = max_tokens * 4
+    piece = ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if piece:
+                yield piece
+                piece = ""
+            yield sentence[:cut]
+            sentence = sentence[cut:].strip()
+        if piece and len(piece) + 1 + len(sentence) > max_chars:
+            yield piece
+            piece = ""
+        piece = f"{piece} {sentence}" if piece else sentence
+    if piece:
+        yield piece
+
+def _iter_blocks(lines, markdown, max_tokens):
+    """Yield ("heading", title) and ("paragraph", text) blocks, no paragraph longer than max_tokens.
+
+    Paragraphs end at blank lines and headings. One that keeps growing past the
+    limit is emitted early, so a file without blank lines is still read in
+    bounded pieces.
+    """
+    paragraph, paragraph_chars = [], 0
+    for line in lines:
+        line = line.strip()
+        heading = _HEADING.match(line) if markdown else None
+        if heading or not line:
+            if paragraph:
+                for piece in _split_long_text("\n".join(paragraph), max_tokens):
+                    yield "paragraph", piece
+                paragraph, paragraph_chars = [], 0
+            if heading:
+                yield "heading", heading.group(1).strip(" #")
+            continue
+        paragraph.append(line)
+        paragraph_chars += len(line) + 1
+        if paragraph_chars > max_tokens * 4:
+            for piece in _split_long_text("\n".join(paragraph), max_tokens):
+                yield "paragraph", piece
+            paragraph, paragraph_chars = [], 0
+    if paragraph:
+        for piece in _split_long_text("\n".join(paragraph), max_tokens):
+            yield "paragraph", piece
+
+def _overlap_tail(text, overlap_tokens):
+    if overlap_tokens <= 0:
+        return ""
+    tail = text[-overlap_tokens * 4:]
+    if len(tail) < len(text):
+        # Start at a word boundary rather than mid-word
+        space = tail.find(" ")
+        tail = tail[space + 1:] if space >= 0 else ""
+    return tail.strip()
+
+def chunk_document(lines, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_CHUNK_OVERLAP_TOKENS,
+                   markdown=False):
+    """Pack a document's lines into chunks of at most about max_tokens; yields {"title", "content"}.
+
+    Chunks are filled with whole paragraphs; a paragraph is only cut (at
+    sentence ends, then whitespace) when it does not fit in a chunk on its own.
+    Each chunk after the first in a section starts with the last overlap_tokens
+    of the one before. With markdown=True, headings (#..######) end the current
+    chunk and title the chunks that follow; a section spread over several
+    chunks is titled "<heading> (part n)". Text before the first heading, and
+    every chunk of a plain-text document, has title None.
+
+    lines can be any iterable (see iter_text_lines), and only the chunk being
+    filled is held in memory.
+    """
+    overlap_tokens = min(overlap_tokens, max_tokens // 4)
+    title, part, current, current_tokens, fresh = None, 1, [], 0, False
+
+    def emit():
+        chunk_title = title if title is None or part == 1 else f"{title} (part {part})"
+        return {"title": chunk_title, "content": "\n\n".join(current)}
+
+    # Paragraph pieces leave room for the overlap carried into their chunk
+    for kind, text in _iter_blocks(lines, markdown, max_tokens - overlap_tokens):
+        if kind == "heading":
+            if fresh:
+                yield emit()
+            title, part, current, current_tokens, fresh = text, 1, [], 0, False
+            continue
+        tokens = estimate_tokens(text)
+        if fresh and current_tokens + tokens > max_tokens:
+            chunk = emit()
+            yield chunk
+            overlap = _overlap_tail(chunk["content"], overlap_tokens)
+            part += 1
+            current = [overlap] if overlap else []
+            current_tokens = estimate_tokens(overlap) if overlap else 0
+        current.append(text)
+        current_tokens += tokens
+        fresh = True
+    if fresh:
+        yield emit()
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import time
+from utils.db import AppDatabase
+from utils.file_types import EXPORT_FILE_TYPES
+
+CACHE_DIR = os.path.join("cache", "exports")
+
+# Total size cap for cached export files; least recently used files are evicted first
+MAX_CACHE_BYTES = int(os.getenv("EXPORT_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+def _cache_key(project_id, filters, export_format, data_version):
+    payload = json.dumps([project_id, filters, export_format, data_version], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _remove_files(entries):
+    for entry in entries:
+        try:
+            os.remove(entry["file_path"])
+        except FileNotFoundError:
+            pass
+    AppDatabase.remove_export_cache_entries([entry["cache_key"] for entry in entries])
+
+def _evict_to_cap():
+    entries = AppDatabase.get_export_cache_lru()
+    total = sum(entry["size_bytes"] for entry in entries)
+    evicted = []
+    for entry in entries:
+        if total <= MAX_CACHE_BYTES:
+            break
+        evicted.append(entry)
+        total -= entry["size_bytes"]
+    if evicted:
+        _remove_files(evicted)
+
+def get_or_build_export(project_id, filters, export_format, build_fn):
+    """Return export bytes from the artifact cache, building and storing them on a miss.
+
+    Entries are keyed by (project, filter set, format, project data version). The
+    data version changes on every write to the project, so stale entries are never
+    served; they are deleted the next time the project is exported.
+    """
+    data_version = AppDatabase.get_data_version(project_id)
+    cache_key = _cache_key(project_id, filters, export_format, data_version)
+
+    entry = AppDatabase.get_export_cache_entry(cache_key)
+    if entry and os.path.exists(entry["file_path"]):
+        AppDatabase.touch_export_cache_entry(cache_key, time.time())
+        with open(entry["file_path"], "rb") as f:
+            return f.read()
+
+    stale = AppDatabase.get_stale_export_cache_entries(project_id, data_version)
+    if stale:
+        _remove_files(stale)
+
+    data = build_fn()
+    if AppDatabase.get_data_version(project_id) != data_version:
+        # The project changed while the export was being built; don't cache it
+        return data
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    file_path = os.path.join(CACHE_DIR, f"{cache_key}.{EXPORT_FILE_TYPES[export_format][0]}")
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+    AppDatabase.store_export_cache_entry(cache_key, project_id, data_version, export_format, file_path,
+                                         len(data), time.time())
+    _evict_to_cap()
+    return data
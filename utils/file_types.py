@@ -0,0 +1,25 @@
+# Kept apart from utils.data_formats (pandas, pyarrow) so pages can show their uploaders
+# and format pickers without importing either
+
+# File extensions accepted by the import tabs
+IMPORT_FILE_TYPES = ["csv", "xlsx", "parquet", "arrow", "feather"]
+
+# Export formats offered by the export tabs
+EXPORT_FORMATS = ["CSV", "Excel", "JSONL", "Parquet", "Arrow"]
+
+BINARY_EXPORTS = {
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+# (file extension, mime type) per export format
+EXPORT_FILE_TYPES = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "JSONL": ("jsonl", "application/jsonl"),
+    **BINARY_EXPORTS,
+}
+
+def get_file_format(file_name):
+    """Return the lowercase extension used to pick a reader for an uploaded file."""
+    return file_name.rsplit(".", 1)[-1].lower()
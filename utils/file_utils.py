@@ -1,11 +1,111 @@
+import hashlib
 import os
+import tempfile
+import time
+from utils.db import AppDatabase
 
 UPLOAD_DIR = "uploads"
 
-def save_uploaded_file(project_id, uploaded_file):
-    project_dir = os.path.join(UPLOAD_DIR, str(project_id))
-    os.makedirs(project_dir, exist_ok=True)
-    file_path = os.path.join(project_dir, uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return file_path
\ No newline at end of file
+# Uploads are stored once per distinct content, as blobs/<first 2 hex digits>/<sha256>
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+
+# Bytes read, hashed and written per step when storing an upload
+WRITE_BLOCK_BYTES = 1024 * 1024
+
+# Unreferenced blobs and leftover temp files younger than this are kept, as an upload may
+# be between writing its blob and recording the row that references it
+BLOB_GRACE_SECONDS = 3600
+
+_TEMP_PREFIX = ".upload-"
+
+def blob_path(content_hash):
+    return os.path.join(BLOB_DIR, content_hash[:2], content_hash)
+
+def _write_blob(file_obj):
+    """Copy file_obj into the blob store; returns (file_path, content_hash, created)."""
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(prefix=_TEMP_PREFIX, dir=BLOB_DIR)
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                block = file_obj.read(WRITE_BLOCK_BYTES)
+                if not block:
+                    break
+                digest.update(block)
+                temp_file.write(block)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        content_hash = digest.hexdigest()
+        file_path = blob_path(content_hash)
+        if os.path.exists(file_path):
+            # Same content already stored: drop the copy and mark the blob as in use
+            os.remove(temp_path)
+            os.utime(file_path)
+            return file_path, content_hash, False
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Readers only ever see a missing or a complete blob
+        os.replace(temp_path, file_path)
+        return file_path, content_hash, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_uploaded_file(uploaded_file):
+    """Store an upload in the content-addressed blob store; returns (file_path, content_hash, created).
+
+    The file is streamed in blocks through SHA-256 into a temp file that is
+    renamed into place, so uploads with the same content (in any project, under
+    any name) share one file on disk and created is False for all but the
+    first. The rows that reference a blob (documents.content_hash, import job
+    file paths) are its reference counts; see remove_unreferenced_blobs.
+    """
+    uploaded_file.seek(0)
+    try:
+        return _write_blob(uploaded_file)
+    finally:
+        uploaded_file.seek(0)
+
+def remove_unreferenced_blobs(grace_seconds=BLOB_GRACE_SECONDS):
+    """Delete blobs no document or import job references, and temp files left by interrupted uploads."""
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+    referenced = {os.path.normpath(path) for path in AppDatabase.get_blob_reference_counts()}
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for root, _, names in os.walk(BLOB_DIR):
+        for name in names:
+            path = os.path.normpath(os.path.join(root, name))
+            if path in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+def migrate_uploads_to_blobs():
+    """Move uploads saved under uploads/<project_id>/<file name> into the blob store.
+
+    Every document and import job row pointing outside the store is repointed
+    at the blob with its content; the old file is deleted once no row refers
+    to it. Rows whose file is gone are left as they are.
+    """
+    blob_root = os.path.normpath(BLOB_DIR) + os.sep
+    legacy_paths = [path for path in AppDatabase.get_blob_reference_counts()
+                    if not os.path.normpath(path).startswith(blob_root)]
+    moved = 0
+    for old_path in legacy_paths:
+        if not os.path.isfile(old_path):
+            continue
+        with open(old_path, "rb") as old_file:
+            file_path, content_hash, _ = _write_blob(old_file)
+        AppDatabase.repoint_uploaded_file(old_path, file_path, content_hash)
+        os.remove(old_path)
+        moved += 1
+    if moved:
+        print(f"Moved {moved} uploaded files into the content-addressed store")
+    return moved
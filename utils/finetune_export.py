@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+from utils.db import AppDatabase
+
+DATASET_DIR = "datasets"
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are a friendly Wellness Wag customer support agent helping customers with ESA "
+    "(Emotional Support Animal) letters. Answer conversationally and accurately, and point "
+    "customers to hello@wellnesswag.com or (415) 570-7864 when they need more help."
+)
+
+class _HashingFile:
+    """File wrapper that feeds every written byte into a SHA-256 digest."""
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self.sha256 = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes_written += len(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class _ShardWriter:
+    """Writes one split as gzip JSONL shards, rolling to a new shard at the size cap.
+
+    The cap applies to uncompressed JSONL bytes so shard boundaries do not depend
+    on the compressor; checksums are computed over the compressed files as written.
+    """
+
+    def __init__(self, output_dir, split, max_shard_bytes):
+        self.output_dir = output_dir
+        self.split = split
+        self.max_shard_bytes = max_shard_bytes
+        self.shards = []
+        self._raw = None
+        self._gzip = None
+
+    def _open_shard(self):
+        self._close_shard()
+        file_name = f"{self.split}-{len(self.shards):05d}.jsonl.gz"
+        self._raw = _HashingFile(os.path.join(self.output_dir, file_name))
+        # mtime=0 and an empty header name keep the output byte-for-byte reproducible
+        self._gzip = gzip.GzipFile(filename="", mode="wb", fileobj=self._raw, mtime=0)
+        self.shards.append({"file": file_name, "examples": 0, "uncompressed_bytes": 0})
+
+    def _close_shard(self):
+        if self._gzip is not None:
+            self._gzip.close()
+            self._raw.close()
+            self.shards[-1]["compressed_bytes"] = self._raw.bytes_written
+            self.shards[-1]["sha256"] = self._raw.sha256.hexdigest()
+            self._gzip = None
+            self._raw = None
+
+    def write(self, line):
+        shard = self.shards[-1] if self.shards else None
+        if shard is None or (shard["uncompressed_bytes"] and
+                             shard["uncompressed_bytes"] + len(line) > self.max_shard_bytes):
+            self._open_shard()
+            shard = self.shards[-1]
+        self._gzip.write(line)
+        shard["examples"] += 1
+        shard["uncompressed_bytes"] += len(line)
+
+    def close(self):
+        self._close_shard()
+        return self.shards
+
+def _create_output_dir(project_id):
+    """Create a new, empty dataset directory; builds started in the same second get a numbered suffix."""
+    base = os.path.join(DATASET_DIR, str(project_id), f"finetune_{time.strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    suffix = 0
+    while True:
+        output_dir = f"{base}_{suffix}" if suffix else base
+        try:
+            os.mkdir(output_dir)
+            return output_dir
+        except FileExistsError:
+            suffix += 1
+
+def build_finetune_dataset(project_id, system_prompt=DEFAULT_SYSTEM_PROMPT, validation_percent=10.0,
+                           split_seed="v1", max_shard_mb=100, progress_callback=None):
+    """Write the project's QA pairs as a chat-format fine-tuning dataset in one streaming pass.
+
+    Rows come straight from the DB cursor with their split already assigned in SQL,
+    are encoded as {"messages": [system, user, assistant]} lines and appended to
+    size-capped gzip shards per split. A manifest.json with counts and SHA-256
+    checksums is written next to the shards. Returns (output_dir, manifest).
+    """
+    output_dir = _create_output_dir(project_id)
+    max_shard_bytes = int(max_shard_mb * 1024 * 1024)
+    writers = {split: _ShardWriter(output_dir, split, max_shard_bytes) for split in ("train", "validation")}
+    system_message = {"role": "system", "content": system_prompt}
+
+    written = 0
+    for rows in AppDatabase.iter_finetune_examples(project_id, validation_percent, split_seed):
+        for _, question, answer, split in rows:
+            example = {"messages": [
+                system_message,
+                {"role": "user", "content": question.strip()},
+                {"role": "assistant", "content": answer.strip()},
+            ]}
+            writers[split].write((json.dumps(example, ensure_ascii=False) + "\n").encode("utf-8"))
+        written += len(rows)
+        if progress_callback:
+            progress_callback(written)
+
+    splits = {}
+    for split, writer in writers.items():
+        shards = writer.close()
+        splits[split] = {"examples": sum(s["examples"] for s in shards), "shards": shards}
+
+    manifest = {
+        "project_id": project_id,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "format": "chat-jsonl-gzip",
+        "system_prompt": system_prompt,
+        "validation_percent": validation_percent,
+        "split_seed": split_seed,
+        "max_shard_bytes": max_shard_bytes,
+        "total_examples": written,
+        "splits": splits,
+    }
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    AppDatabase.store_dataset(project_id, os.path.basename(output_dir), manifest_path, "finetune")
+    return output_dir, manifest
+
+def zip_dataset(output_dir):
+    """Bundle a dataset directory into zip bytes for download (shards are already gzip, so no recompression)."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for file_name in sorted(os.listdir(output_dir)):
+            archive.write(os.path.join(output_dir, file_name), arcname=file_name)
+    return buffer.getvalue()
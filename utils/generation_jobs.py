@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from utils.db import AppDatabase, text_sha256
+from utils import llm_tracing
+from utils.context_cache import prefix_cache_session
+from utils.llm_providers import GEMINI, build_model_from_spec
+from utils.qa_utils import generate_qa_for_calls, get_generation_settings, CALL_GENERATION_VERSION
+
+ACTIVE_STATUSES = ("pending", "running")
+
+# Seconds the idle worker waits before checking the queue again
+WORKER_POLL_SECONDS = 2.0
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def queue_generation_job(project_id, call_ids, llm_model, max_workers=None, pack_token_budget=None,
+                         window_tokens=None):
+    """Queue QA generation for call_ids and make sure the background worker is running."""
+    options = {
+        "model_name": llm_model.model_name,
+        "model_spec": llm_model.spec,
+        "max_workers": max_workers,
+        "pack_token_budget": pack_token_budget,
+        "window_tokens": window_tokens,
+    }
+    job_id = AppDatabase.create_generation_job(project_id, call_ids, options)
+    ensure_worker()
+    return job_id
+
+def ensure_worker():
+    """Start the process-wide worker thread if it is not running (it also resumes jobs left by a restart)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="qa-generation-worker", daemon=True)
+            _worker.start()
+
+def _worker_loop():
+    while True:
+        job = AppDatabase.get_next_generation_job()
+        if job is None:
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        try:
+            run_generation_job(job["job_id"])
+        except Exception as e:
+            print(f"Generation job {job['job_id']} failed: {e}")
+            AppDatabase.update_generation_job_status(job["job_id"], "failed", str(e), time.time())
+
+def run_generation_job(job_id):
+    """Process a job's pending calls batch by batch until done or cancelled.
+
+    Each call's pairs, item state, the job counters and the call's generation
+    state (see get_calls_needing_generation) are committed together as soon as
+    the call finishes, so its pairs show up for review while the rest of the job
+    runs and a restart only repeats the calls in flight.
+    """
+    job = AppDatabase.get_generation_job(job_id)
+    options = json.loads(job["options"] or "{}")
+    # Jobs queued before providers were configurable only recorded a Gemini model name
+    llm_model = build_model_from_spec(options.get("model_spec") or {"provider": GEMINI, "model": options["model_name"]})
+    max_workers = options.get("max_workers") or get_generation_settings()["max_workers"]
+    batch_size = max(20, max_workers * 4)
+
+    llm_tracing.set_project(job["project_id"])
+    AppDatabase.update_generation_job_status(job_id, "running", timestamp=time.time())
+    # The job's instruction caches are created on its first request and deleted when it ends
+    with prefix_cache_session():
+        while True:
+            if AppDatabase.get_generation_job(job_id)["status"] not in ACTIVE_STATUSES:
+                return  # cancelled from the page
+            call_ids = AppDatabase.get_pending_generation_items(job_id, batch_size)
+            if not call_ids:
+                break
+            calls, missing = [], []
+            for call_id in call_ids:
+                call = AppDatabase.get_call(job["project_id"], call_id)
+                if call and call["transcript"]:
+                    calls.append((call_id, call["transcript"]))
+                else:
+                    missing.append((call_id, [], "Call not found or has no transcript"))
+            if missing:
+                _record_results(job, options, missing, {})
+            transcript_hashes = {call_id: text_sha256(transcript) for call_id, transcript in calls}
+            for call_id, qa_pairs, error in generate_qa_for_calls(calls, llm_model, max_workers=max_workers,
+                                                               pack_token_budget=options.get("pack_token_budget"),
+                                                               dead_letter_project_id=job["project_id"],
+                                                               ordered=False,
+                                                               window_tokens=options.get("window_tokens")):
+                _record_results(job, options, [(call_id, qa_pairs, str(error) if error else None)],
+                                {call_id: transcript_hashes[call_id]})
+    AppDatabase.update_generation_job_status(job_id, "completed", timestamp=time.time())
+
+def _record_results(job, options, results, transcript_hashes):
+    if not AppDatabase.record_generation_results(job["job_id"], job["project_id"], results,
+                                                 (CALL_GENERATION_VERSION, options["model_name"], transcript_hashes)):
+        raise RuntimeError("Generated pairs could not be stored")
+
+def cancel_generation_job(job_id):
+    """Stop a queued or running job after its current batch; pairs generated so far are kept for review."""
+    return AppDatabase.update_generation_job_status(job_id, "cancelled", timestamp=time.time())
+
+def describe_generation_job(job):
+    """Progress, throughput (calls/min) and ETA (seconds, None when unknown) for the UI."""
+    total = job["total_items"] or 0
+    processed = job["processed_items"] or 0
+    elapsed = None
+    if job["started_at"]:
+        elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+    per_minute = processed / elapsed * 60 if elapsed and processed else None
+    eta = None
+    if per_minute and job["status"] in ACTIVE_STATUSES:
+        eta = (total - processed) / per_minute * 60
+    return {
+        "progress": processed / total if total else 1.0,
+        "processed": processed,
+        "total": total,
+        "per_minute": per_minute,
+        "eta_seconds": eta,
+    }
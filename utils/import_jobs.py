@@ -0,0 +1,166 @@
+import json
+import pandas as pd
+from utils.db import AppDatabase
+from utils.data_formats import iter_row_batches
+from utils.file_types import get_file_format
+from utils.file_utils import store_uploaded_file
+from utils.text_normalize import normalize_question, normalize_questions
+
+def create_import_job(project_id, import_type, uploaded_file, column_map, duplicate_action, excluded_rows=None,
+                      total_rows=None, edited_rows=None):
+    """Store the upload in the blob store and register a resumable import job for it.
+
+    column_map maps target fields ('call_id'/'transcript' or 'question'/'answer'/'call_id')
+    to source columns. excluded_rows holds the row indices unticked in the preview, and
+    edited_rows the cells changed there (see get_edited_rows), which replace the file's values.
+    """
+    file_path, _, _ = store_uploaded_file(uploaded_file)
+    options = {
+        "duplicate_action": duplicate_action,
+        "excluded_rows": sorted(int(i) for i in (excluded_rows or [])),
+        # JSON object keys are strings, so rows are looked up by str(index) when the job runs
+        "edited_rows": {str(int(i)): values for i, values in (edited_rows or {}).items()},
+    }
+    return AppDatabase.create_import_job(project_id, import_type, uploaded_file.name, file_path,
+                                         get_file_format(uploaded_file.name), column_map, options, total_rows)
+
+def _clean(value):
+    if value is None or pd.isna(value):
+        return None
+    value = str(value).strip()
+    if value == "" or value.lower() == "nan":
+        return None
+    return value
+
+def get_edited_rows(preview_df, edited_df, field_columns):
+    """Cells changed in a preview data editor, as {row index: {target field: new value}}.
+
+    field_columns maps target fields to the preview's column names. Only rows
+    whose cleaned value differs are returned, so an untouched preview adds nothing.
+    """
+    edited_rows = {}
+    for field, column in field_columns.items():
+        before, after = preview_df[column], edited_df[column]
+        changed = ~(before.eq(after) | (before.isna() & after.isna()))
+        for row in edited_df.index[changed]:
+            value = _clean(after[row])
+            if value != _clean(before[row]):
+                edited_rows.setdefault(int(row), {})[field] = value
+    return edited_rows
+
+def _prepare_call_rows(project_id, first_row, df, column_map, options, excluded):
+    duplicate_action = options.get("duplicate_action", "Skip existing calls")
+    edited_rows = options.get("edited_rows", {})
+    candidates = []
+    counts = {"imported": 0, "updated": 0, "skipped": 0, "errors": 0}
+    for offset, (call_id, transcript) in enumerate(df[[column_map["call_id"], column_map["transcript"]]].itertuples(index=False)):
+        if first_row + offset in excluded:
+            continue
+        edits = edited_rows.get(str(first_row + offset), {})
+        call_id = _clean(edits.get("call_id", call_id))
+        if "transcript" in edits:
+            transcript = edits["transcript"] or ""
+        if not call_id:
+            counts["errors"] += 1
+            continue
+        candidates.append((call_id, str(transcript)))
+
+    existing = AppDatabase.get_existing_call_ids(project_id, [call_id for call_id, _ in candidates])
+    rows = []
+    for call_id, transcript in candidates:
+        if call_id in existing:
+            if duplicate_action == "Skip existing calls":
+                counts["skipped"] += 1
+                continue
+            counts["updated"] += 1
+        else:
+            counts["imported"] += 1
+        rows.append((call_id, transcript))
+    return rows, counts, []
+
+def _prepare_qa_rows(first_row, df, column_map, options, excluded, existing_questions):
+    duplicate_action = options.get("duplicate_action", "Skip duplicates")
+    edited_rows = options.get("edited_rows", {})
+    rows, remove_ids = [], []
+    counts = {"imported": 0, "updated": 0, "skipped": 0, "errors": 0}
+    call_id_col = column_map.get("call_id")
+    for offset, record in enumerate(df.to_dict("records")):
+        if first_row + offset in excluded:
+            continue
+        edits = edited_rows.get(str(first_row + offset), {})
+        question = _clean(edits.get("question", record[column_map["question"]]))
+        answer = _clean(edits.get("answer", record[column_map["answer"]]))
+        call_id = _clean(edits.get("call_id", record[call_id_col])) if call_id_col else None
+        if not question or not answer:
+            counts["errors"] += 1
+            continue
+
+        duplicate_id = existing_questions.get(normalize_question(question))
+        if duplicate_id is not None:
+            if duplicate_action == "Skip duplicates":
+                counts["skipped"] += 1
+                continue
+            elif duplicate_action == "Override existing":
+                remove_ids.append(duplicate_id)
+                existing_questions.pop(normalize_question(question), None)
+                counts["updated"] += 1
+            else:  # Save as new
+                counts["imported"] += 1
+        else:
+            counts["imported"] += 1
+        rows.append((question, answer, call_id))
+    return rows, counts, remove_ids
+
+def run_import_job(job_id, batch_size=500, progress_callback=None):
+    """Run (or resume) an import job from its last checkpoint.
+
+    Every batch is written together with the job's new row offset and counts,
+    so an interrupted run - a failure or a Streamlit rerun - picks up at the
+    first uncommitted row. Returns the final job row.
+    """
+    job = AppDatabase.get_import_job(job_id)
+    if job is None or job["status"] == "completed":
+        return job
+
+    AppDatabase.update_import_job_status(job_id, "running")
+    column_map = json.loads(job["column_map"])
+    options = json.loads(job["options"] or "{}")
+    excluded = set(options.get("excluded_rows", []))
+    import_type = job["import_type"]
+    project_id = job["project_id"]
+
+    existing_questions = {}
+    if import_type == "qa_pairs":
+        existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
+        for qa, normalized in zip(existing_qa_pairs, normalize_questions(qa["question"] for qa in existing_qa_pairs)):
+            existing_questions.setdefault(normalized, qa["id"])
+
+    try:
+        batches = iter_row_batches(job["file_path"], job["file_format"], list(column_map.values()),
+                                   start_row=job["next_row"], batch_size=batch_size)
+        for first_row, df in batches:
+            if import_type == "calls":
+                rows, counts, remove_ids = _prepare_call_rows(project_id, first_row, df, column_map, options, excluded)
+            else:
+                rows, counts, remove_ids = _prepare_qa_rows(first_row, df, column_map, options, excluded,
+                                                            existing_questions)
+            if not AppDatabase.commit_import_batch(job_id, project_id, import_type, rows, first_row + len(df),
+                                                   counts, remove_qa_ids=remove_ids):
+                raise RuntimeError(f"Batch starting at row {first_row} could not be committed")
+            if progress_callback:
+                progress_callback(AppDatabase.get_import_job(job_id))
+        AppDatabase.update_import_job_status(job_id, "completed")
+    except Exception as e:
+        print(f"Import job {job_id} failed: {e}")
+        AppDatabase.update_import_job_status(job_id, "failed", str(e))
+    return AppDatabase.get_import_job(job_id)
+
+def describe_import_job(job):
+    """One-line summary of a job's progress and counts for the UI."""
+    total = job["total_rows"] or "?"
+    parts = [f"{job['next_row']}/{total} rows processed",
+             f"{job['imported_count']} imported",
+             f"{job['updated_count']} updated",
+             f"{job['skipped_count']} skipped",
+             f"{job['error_count']} errors"]
+    return ", ".join(parts)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from utils.db import AppDatabase
+
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_MB = 256
+
+# Run eviction once every this many stores rather than on every write
+EVICT_EVERY = 100
+
+_stats = {"hits": 0, "misses": 0, "stores": 0}
+_stats_lock = threading.Lock()
+
+def _settings():
+    return {
+        "ttl_seconds": float(os.getenv("LLM_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS)) * 86400,
+        "max_entries": int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        "max_bytes": int(float(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024),
+    }
+
+def get_model_name(model):
+    """Identify a model for cache keys (GenerativeModel exposes model_name)."""
+    return getattr(model, "model_name", None) or type(model).__name__
+
+def make_cache_key(prompt_version, model_name, input_text):
+    payload = "\x00".join([prompt_version, model_name, input_text])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_cached_response(prompt_version, model_name, input_text):
+    """Return the cached QA list for this (prompt version, model, input), or None on a miss."""
+    now = time.time()
+    response = AppDatabase.get_llm_cache_entry(make_cache_key(prompt_version, model_name, input_text),
+                                               now - _settings()["ttl_seconds"], now)
+    with _stats_lock:
+        _stats["hits" if response is not None else "misses"] += 1
+    return json.loads(response) if response is not None else None
+
+def store_cached_response(prompt_version, model_name, input_text, qa_pairs):
+    AppDatabase.store_llm_cache_entry(make_cache_key(prompt_version, model_name, input_text), model_name,
+                                      prompt_version, json.dumps(qa_pairs), time.time())
+    with _stats_lock:
+        _stats["stores"] += 1
+        run_eviction = _stats["stores"] % EVICT_EVERY == 0
+    if run_eviction:
+        evict()
+
+def evict():
+    settings = _settings()
+    expired, evicted = AppDatabase.evict_llm_cache(time.time() - settings["ttl_seconds"],
+                                                   settings["max_entries"], settings["max_bytes"])
+    if expired or evicted:
+        print(f"LLM cache eviction: {expired} expired, {evicted} over size cap")
+
+def cached_generation(prompt_version, model, input_text, generate_fn):
+    """Return a QA list through the response cache.
+
+    On a miss generate_fn() returns (qa_pairs, complete); only complete results
+    are stored, so pairs salvaged from a truncated response are regenerated next time.
+    """
+    model_name = get_model_name(model)
+    cached = get_cached_response(prompt_version, model_name, input_text)
+    if cached is not None:
+        return cached
+    qa_pairs, complete = generate_fn()
+    if complete:
+        store_cached_response(prompt_version, model_name, input_text, qa_pairs)
+    return qa_pairs
+
+def get_cache_stats():
+    """Hit/miss counters for this process plus the size of the persisted cache."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats.update(AppDatabase.get_llm_cache_summary())
+    return stats
+
+def clear_cache():
+    return AppDatabase.clear_llm_cache()
@@ -0,0 +1,550 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from utils.llm_resilience import RATE_LIMIT, SERVER_ERROR, TIMEOUT, classify_error
+
+# Providers selectable with LLM_PROVIDER (primary) and LLM_FALLBACK_PROVIDERS (comma separated)
+GEMINI = "gemini"
+OPENAI = "openai"
+FAKE = "fake"
+
+DEFAULT_MODELS = {
+    GEMINI: "gemini-2.0-pro-exp-02-05",
+    OPENAI: "gpt-4o-mini",
+    FAKE: "fake-qa",
+}
+
+# Requests in flight per provider; override with <PROVIDER>_MAX_CONCURRENCY
+DEFAULT_MAX_CONCURRENCY = {GEMINI: 8, OPENAI: 8, FAKE: 64}
+
+# Seconds a throttled provider is skipped by the router before it is tried again
+DEFAULT_THROTTLE_COOLDOWN = 30.0
+
+# Gemini rejects explicit caches below a minimum prompt size (model dependent);
+# shorter instructions go as a plain system instruction. Override with GEMINI_CONTEXT_CACHE_MIN_TOKENS
+DEFAULT_GEMINI_CACHE_MIN_TOKENS = 4096
+
+# Error classes that make the router move on to the next provider
+FALLBACK_ERRORS = (RATE_LIMIT, TIMEOUT, SERVER_ERROR)
+
+class UsageMetadata:
+    """Token counts in the shape of Gemini's usage_metadata, for providers that report them differently."""
+
+    def __init__(self, prompt_token_count=0, candidates_token_count=0, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+class ProviderResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class StreamedResponse:
+    """A response read as it is generated, like Gemini's stream=True responses.
+
+    Iterating yields chunks with `.text`; once the stream is exhausted `.text`
+    holds the whole response and `.usage_metadata` the provider's token counts
+    (the value returned by the `pieces` generator). Reading `.text` first
+    consumes the stream. A stream that is not read to the end must be closed
+    (or used as a context manager) to give back its concurrency slot; one that
+    is simply dropped is closed when it is garbage collected.
+    """
+
+    def __init__(self, pieces, on_close=None):
+        self._pieces = pieces
+        self._parts = []
+        self._on_close = on_close
+        self._closed = False
+        self.usage_metadata = None
+
+    def __iter__(self):
+        if self._closed:
+            return
+        try:
+            while True:
+                try:
+                    text = next(self._pieces)
+                except StopIteration as stop:
+                    self.usage_metadata = stop.value
+                    return
+                self._parts.append(text)
+                yield ProviderResponse(text)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop reading and release the request's slot; safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close_pieces = getattr(self._pieces, "close", None)
+            if close_pieces:
+                close_pieces()
+        finally:
+            if self._on_close:
+                self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, "_closed", True):
+            self.close()
+
+    @property
+    def text(self):
+        if not self._closed:
+            for _ in self:
+                pass
+        return "".join(self._parts)
+
+class LLMProvider:
+    """Base for the objects passed around as the generation model.
+
+    The rest of the pipeline only relies on `model_name` and
+    generate_content(prompt, generation_config=None) returning something with
+    `.text` (and optionally `.usage_metadata`), which is what a Gemini
+    GenerativeModel offers. Each provider caps its own in-flight requests with
+    a semaphore, independently of the shared requests/tokens-per-minute limiter.
+
+    Providers also take a separate system_instruction and, where supported, a
+    cached_prefix handle from create_prefix_cache (see context_cache). With
+    stream=True a StreamedResponse is returned; it keeps its concurrency slot
+    until it has been read to the end or closed.
+    """
+
+    provider = None
+    supports_streaming = True
+
+    def __init__(self, model_name, max_concurrency=None):
+        self.model_name = model_name
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv(f"{self.provider.upper()}_MAX_CONCURRENCY",
+                                            DEFAULT_MAX_CONCURRENCY[self.provider]))
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    @property
+    def spec(self):
+        """What build_model_from_spec needs to rebuild this provider (stored with background jobs)."""
+        return {"provider": self.provider, "model": self.model_name}
+
+    def generate_content(self, prompt, generation_config=None, system_instruction=None, cached_prefix=None,
+                         stream=False):
+        if not stream:
+            with self._slots:
+                return self._generate(prompt, generation_config, system_instruction, cached_prefix, False)
+        self._slots.acquire()
+        try:
+            pieces = self._generate(prompt, generation_config, system_instruction, cached_prefix, True)
+        except BaseException:
+            self._slots.release()
+            raise
+        return StreamedResponse(pieces, on_close=self._release_stream)
+
+    def _release_stream(self):
+        """Called once when a StreamedResponse is exhausted or closed, whether or not it was read."""
+        self._slots.release()
+
+    def _generate(self, prompt, generation_config, system_instruction, cached_prefix, stream):
+        """A response, or with stream=True a generator of text pieces returning the usage metadata.
+
+        The request itself must be made before returning, so errors such as
+        rate limits surface here rather than while the stream is read.
+        """
+        raise NotImplementedError
+
+    def create_prefix_cache(self, instruction, ttl_seconds):
+        """Handle for a provider-side cache of `instruction`, or None when the provider cannot cache it."""
+        return None
+
+    def refresh_prefix_cache(self, handle, ttl_seconds):
+        pass
+
+    def delete_prefix_cache(self, handle):
+        pass
+
+class GeminiProvider(LLMProvider):
+    provider = GEMINI
+
+    def __init__(self, model_name=None, api_key=None, max_concurrency=None):
+        self._api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self._genai = None
+        self._model = None
+        # Models bound to a system instruction or a cached prefix, built once each
+        self._bound_models = {}
+        self._bound_models_lock = threading.Lock()
+        model_name = model_name or DEFAULT_MODELS[GEMINI]
+        # GenerativeModel reports "models/<name>"; keep that so existing cache keys and traces still match
+        super().__init__(model_name if "/" in model_name else f"models/{model_name}", max_concurrency)
+
+    def _client(self):
+        """google.generativeai and the base model, imported and configured on first use.
+
+        The import takes about a second, so pages that build the provider but
+        send no request do not pay for it.
+        """
+        with self._bound_models_lock:
+            if self._genai is None:
+                import google.generativeai as genai
+                if self._api_key:
+                    genai.configure(api_key=self._api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+                self._genai = genai
+            return self._genai, self._model
+
+    @property
+    def spec(self):
+        return {"provider": self.provider, "model": self.model_name.split("/")[-1]}
+
+    def _bound_model(self, key, factory):
+        with self._bound_models_lock:
+            if key not in self._bound_models:
+                self._bound_models[key] = factory()
+            return self._bound_models[key]
+
+    def _generate(self, prompt, generation_config, system_instruction, cached_prefix, stream):
+        genai, model = self._client()
+        if cached_prefix is not None:
+            model = self._bound_model(("cache", cached_prefix.name),
+                                      lambda: genai.GenerativeModel.from_cached_content(cached_prefix))
+        elif system_instruction:
+            model = self._bound_model(("instruction", system_instruction),
+                                      lambda: genai.GenerativeModel(self.model_name,
+                                                                    system_instruction=system_instruction))
+        response = model.generate_content(prompt, generation_config=generation_config, stream=stream)
+        return _gemini_pieces(response) if stream else response
+
+    def create_prefix_cache(self, instruction, ttl_seconds):
+        min_tokens = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", DEFAULT_GEMINI_CACHE_MIN_TOKENS))
+        if len(instruction) // 4 < min_tokens:
+            return None
+        self._client()
+        from google.generativeai import caching
+        return caching.CachedContent.create(model=self.model_name, system_instruction=instruction,
+                                            ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def refresh_prefix_cache(self, handle, ttl_seconds):
+        handle.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def delete_prefix_cache(self, handle):
+        with self._bound_models_lock:
+            self._bound_models.pop(("cache", handle.name), None)
+        handle.delete()
+
+def _gemini_pieces(response):
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunk without text parts, e.g. only the finish reason
+        yield text
+    return response.usage_metadata
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Chat completions against OpenAI or any server speaking its API (OPENAI_BASE_URL).
+
+    There is no explicit prefix cache: OpenAI caches repeated prompt prefixes
+    on its own, so the instruction is always sent first as the system message
+    and the cached share is read back from the usage details.
+    """
+
+    provider = OPENAI
+
+    def __init__(self, model_name=None, api_key=None, base_url=None, max_concurrency=None, timeout=120.0):
+        from openai import OpenAI
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key and self.base_url:
+            api_key = "unused"  # self-hosted servers usually ignore the key but the client requires one
+        # The generation engine retries with its own backoff, so the client does not
+        self._client = OpenAI(api_key=api_key, base_url=self.base_url, timeout=timeout, max_retries=0)
+        super().__init__(model_name or DEFAULT_MODELS[OPENAI], max_concurrency)
+
+    @property
+    def spec(self):
+        return {"provider": self.provider, "model": self.model_name, "base_url": self.base_url}
+
+    def _generate(self, prompt, generation_config, system_instruction, cached_prefix, stream):
+        system = [system_instruction] if system_instruction else []
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            # The prompts ask for a bare JSON array, which json_object mode does not allow
+            system.append("Respond with the requested JSON only, no prose or code fences.")
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": "\n\n".join(system)})
+        if stream:
+            events = self._client.chat.completions.create(model=self.model_name, messages=messages, stream=True,
+                                                          stream_options={"include_usage": True})
+            return _openai_pieces(events)
+        completion = self._client.chat.completions.create(model=self.model_name, messages=messages)
+        return ProviderResponse(completion.choices[0].message.content or "", _openai_usage(completion.usage))
+
+def _openai_usage(usage):
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return UsageMetadata(usage.prompt_tokens or 0, usage.completion_tokens or 0,
+                         getattr(details, "cached_tokens", 0) or 0)
+
+def _openai_pieces(events):
+    usage = None
+    for event in events:
+        if event.usage is not None:
+            usage = _openai_usage(event.usage)  # sent in a final event without choices
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+    return usage
+
+class FakeProvider(LLMProvider):
+    """Deterministic offline model for load tests and benchmarks.
+
+    Answers `pairs_per_item` QA pairs per transcript in the prompt (tagging
+    them with call_id for packed prompts), derived from a hash of the prompt so
+    the same prompt always gets the same answer. Latency is `latency_seconds`
+    plus up to `latency_jitter` seconds. `rate_limit_rate` and `failure_rate`
+    inject 429s and 503s; the injections come from a seeded generator, so a
+    sequential run is reproducible. Prefix caches are simulated for
+    instructions of at least `prefix_cache_min_tokens` tokens and reported in
+    usage_metadata the way Gemini does.
+    """
+
+    provider = FAKE
+
+    def __init__(self, model_name=None, latency_seconds=None, latency_jitter=0.0, failure_rate=None,
+                 rate_limit_rate=None, pairs_per_item=6, seed=0, prefix_cache_min_tokens=0, max_concurrency=None):
+        super().__init__(model_name or DEFAULT_MODELS[FAKE], max_concurrency)
+        if latency_seconds is None:
+            latency_seconds = float(os.getenv("FAKE_LLM_LATENCY_MS", 0)) / 1000
+        if failure_rate is None:
+            failure_rate = float(os.getenv("FAKE_LLM_FAILURE_RATE", 0))
+        if rate_limit_rate is None:
+            rate_limit_rate = float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", 0))
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.pairs_per_item = pairs_per_item
+        self.seed = seed
+        self.prefix_cache_min_tokens = prefix_cache_min_tokens
+        self._prefix_caches = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats = {"requests": 0, "rate_limited": 0, "failed": 0, "max_in_flight": 0,
+                      "prefix_caches_created": 0, "prefix_caches_deleted": 0}
+
+    @property
+    def spec(self):
+        return {"provider": self.provider, "model": self.model_name, "latency_seconds": self.latency_seconds,
+                "latency_jitter": self.latency_jitter, "failure_rate": self.failure_rate,
+                "rate_limit_rate": self.rate_limit_rate, "pairs_per_item": self.pairs_per_item, "seed": self.seed,
+                "prefix_cache_min_tokens": self.prefix_cache_min_tokens}
+
+    def create_prefix_cache(self, instruction, ttl_seconds):
+        if len(instruction) // 4 < self.prefix_cache_min_tokens:
+            return None
+        with self._lock:
+            self.stats["prefix_caches_created"] += 1
+            handle = f"cachedContents/fake-{self.stats['prefix_caches_created']}"
+            self._prefix_caches[handle] = instruction
+        return handle
+
+    def delete_prefix_cache(self, handle):
+        with self._lock:
+            if self._prefix_caches.pop(handle, None) is not None:
+                self.stats["prefix_caches_deleted"] += 1
+
+    def _generate(self, prompt, generation_config, system_instruction, cached_prefix, stream):
+        with self._lock:
+            self.stats["requests"] += 1
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            roll = self._rng.random()
+            delay = self.latency_seconds + self._rng.uniform(0, self.latency_jitter)
+        try:
+            if roll < self.rate_limit_rate + self.failure_rate:
+                from google.api_core import exceptions as google_exceptions
+            if roll < self.rate_limit_rate:
+                with self._lock:
+                    self.stats["rate_limited"] += 1
+                raise google_exceptions.ResourceExhausted(f"429 {self.model_name}: injected rate limit")
+            if roll < self.rate_limit_rate + self.failure_rate:
+                time.sleep(delay)
+                with self._lock:
+                    self.stats["failed"] += 1
+                raise google_exceptions.ServiceUnavailable(f"503 {self.model_name}: injected failure")
+            qa_pairs = self._answer(prompt)
+            instruction_tokens = len(system_instruction or "") // 4
+            with self._lock:
+                cached = instruction_tokens if cached_prefix in self._prefix_caches else 0
+            text = json.dumps(qa_pairs)
+            usage = UsageMetadata(max(1, len(prompt) // 4) + instruction_tokens, max(1, len(text) // 4), cached)
+        except BaseException:
+            self._finish_request()
+            raise
+        if stream:
+            return self._stream_pieces(qa_pairs, delay, usage)
+        try:
+            time.sleep(delay)
+            return ProviderResponse(text, usage)
+        finally:
+            self._finish_request()
+
+    def _stream_pieces(self, qa_pairs, delay, usage):
+        """One piece per pair, with the latency spread evenly over them."""
+        for i, qa in enumerate(qa_pairs):
+            time.sleep(delay / len(qa_pairs))
+            yield ("[" if i == 0 else ", ") + json.dumps(qa)
+        yield "]" if qa_pairs else "[]"
+        return usage
+
+    def _release_stream(self):
+        # Not in _stream_pieces' finally: that never runs for a stream nobody started reading
+        self._finish_request()
+        super()._release_stream()
+
+    def _finish_request(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _answer(self, prompt):
+        call_ids = re.findall(r'<transcript call_id="([^"]+)">', prompt)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        qa_pairs = []
+        for call_id in call_ids or [None]:
+            for i in range(self.pairs_per_item):
+                qa = {"question": f"How does item {i} of {call_id or digest} work?",
+                      "answer": f"Synthetic answer {digest}-{i}."}
+                if call_id is not None:
+                    qa["call_id"] = call_id
+                qa_pairs.append(qa)
+        return qa_pairs
+
+class FallbackRouter:
+    """Sends each request to the first provider that is not throttled.
+
+    A rate limit, timeout or server error from one provider marks it throttled
+    for `cooldown_seconds` and the same request goes straight to the next one.
+    Only when every provider has failed this way is the last error raised, so
+    the generation engine's limiter and backoff take over. Responses are cached
+    under the router's combined model_name. Prefix caches belong to a single
+    provider, so routed requests send the instruction uncached.
+    """
+
+    supports_streaming = True
+
+    def __init__(self, providers, cooldown_seconds=DEFAULT_THROTTLE_COOLDOWN):
+        self.providers = list(providers)
+        self.cooldown_seconds = cooldown_seconds
+        self.model_name = "+".join(p.model_name for p in self.providers)
+        self._throttled_until = [0.0] * len(self.providers)
+        self._lock = threading.Lock()
+        self.stats = {p.model_name: {"requests": 0, "throttled": 0} for p in self.providers}
+
+    @property
+    def spec(self):
+        return {"provider": "router", "providers": [p.spec for p in self.providers],
+                "cooldown_seconds": self.cooldown_seconds}
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            ready = [i for i, until in enumerate(self._throttled_until) if until <= now]
+            # All throttled: try the one whose cooldown ends first rather than failing outright
+            return ready or [min(range(len(self.providers)), key=self._throttled_until.__getitem__)]
+
+    def create_prefix_cache(self, instruction, ttl_seconds):
+        return None
+
+    def generate_content(self, prompt, generation_config=None, system_instruction=None, cached_prefix=None,
+                         stream=False):
+        # A failure in the middle of a stream is not rerouted; the engine retries the request
+        error = None
+        for index in self._candidates():
+            provider = self.providers[index]
+            with self._lock:
+                self.stats[provider.model_name]["requests"] += 1
+            try:
+                return provider.generate_content(prompt, generation_config=generation_config,
+                                                 system_instruction=system_instruction, stream=stream)
+            except Exception as e:
+                if classify_error(e) not in FALLBACK_ERRORS:
+                    raise
+                error = e
+                with self._lock:
+                    self._throttled_until[index] = time.monotonic() + self.cooldown_seconds
+                    self.stats[provider.model_name]["throttled"] += 1
+        raise error
+
+def build_provider(provider, model_name=None, **options):
+    if provider == GEMINI:
+        return GeminiProvider(model_name, **options)
+    if provider == OPENAI:
+        return OpenAICompatibleProvider(model_name, **options)
+    if provider == FAKE:
+        return FakeProvider(model_name, **options)
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+_shared_models = {}
+_shared_models_lock = threading.RLock()
+
+def build_model_from_spec(spec):
+    """Provider or router for a `spec`, shared process-wide so its concurrency limit covers every run."""
+    key = json.dumps(spec, sort_keys=True)
+    with _shared_models_lock:
+        if key not in _shared_models:
+            model = _build_from_spec(spec)
+            # Jobs rebuild the model from model.spec, which may spell out defaults the original spec left implicit
+            _shared_models[key] = _shared_models.setdefault(json.dumps(model.spec, sort_keys=True), model)
+        return _shared_models[key]
+
+def _build_from_spec(spec):
+    if spec.get("provider") == "router":
+        return FallbackRouter([build_model_from_spec(s) for s in spec["providers"]],
+                              spec.get("cooldown_seconds", DEFAULT_THROTTLE_COOLDOWN))
+    options = {key: value for key, value in spec.items() if key not in ("provider", "model")}
+    return build_provider(spec["provider"], spec.get("model"), **options)
+
+def _model_name_from_env(provider):
+    return os.getenv(f"{provider.upper()}_MODEL") or DEFAULT_MODELS[provider]
+
+def build_model_from_env():
+    """Generation model configured by LLM_PROVIDER, <PROVIDER>_MODEL and LLM_FALLBACK_PROVIDERS.
+
+    Defaults to Gemini alone. With fallbacks configured a FallbackRouter over
+    all of them is returned.
+    """
+    names = [os.getenv("LLM_PROVIDER", GEMINI).strip().lower()]
+    names += [n.strip().lower() for n in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",")
+              if n.strip() and n.strip().lower() not in names]
+    specs = [{"provider": name, "model": _model_name_from_env(name)} for name in names]
+    if len(specs) == 1:
+        return build_model_from_spec(specs[0])
+    cooldown = float(os.getenv("LLM_THROTTLE_COOLDOWN", DEFAULT_THROTTLE_COOLDOWN))
+    return build_model_from_spec({"provider": "router", "providers": specs, "cooldown_seconds": cooldown})
+
+def missing_credentials():
+    """Environment variables the configured providers need but that are not set."""
+    names = [os.getenv("LLM_PROVIDER", GEMINI)] + os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",")
+    required = {GEMINI: "GEMINI_API_KEY", OPENAI: "OPENAI_API_KEY"}
+    missing = []
+    for name in names:
+        name = name.strip().lower()
+        variable = required.get(name)
+        if name == OPENAI and os.getenv("OPENAI_BASE_URL"):
+            continue
+        if variable and not os.getenv(variable) and variable not in missing:
+            missing.append(variable)
+    return missing
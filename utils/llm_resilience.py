@@ -0,0 +1,130 @@
+import collections
+import json
+import random
+import sys
+import threading
+import time
+from utils.db import AppDatabase
+from utils.qa_parsing import QAParseError
+
+# Error classes used to decide whether and how often a failed request is retried
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+SAFETY_BLOCK = "safety_block"
+PARSE_ERROR = "parse_error"
+OTHER = "other"
+
+# Attempts per error class after the first one; safety blocks and unknown errors are not retried
+MAX_RETRIES = {RATE_LIMIT: 5, TIMEOUT: 3, SERVER_ERROR: 3, PARSE_ERROR: 1, SAFETY_BLOCK: 0, OTHER: 0}
+
+# Google exception types are looked up in sys.modules instead of imported: an error
+# can only be one of them if the Google client was loaded, and importing it takes ~1s
+def _google_error(error, *names):
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    return google_exceptions is not None and isinstance(error, tuple(getattr(google_exceptions, n) for n in names))
+
+# Same for the openai client, used by OpenAI-compatible providers
+def _openai_error(error, *names):
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, tuple(getattr(openai, n) for n in names))
+
+def _status_code(error):
+    """HTTP status of an error that carries one (openai's APIStatusError and similar clients), else None."""
+    status = getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_rate_limit_error(error):
+    if _google_error(error, "ResourceExhausted", "TooManyRequests") or _openai_error(error, "RateLimitError"):
+        return True
+    if _status_code(error) == 429:
+        return True
+    message = str(error).lower()
+    return "429" in message or "resource exhausted" in message or "rate limit" in message
+
+def classify_error(error):
+    """Map an exception from a generation request to one of the error classes above."""
+    # Checked first: a parse error's message quotes the response, which may mention "429" or "rate limit"
+    if isinstance(error, QAParseError):
+        return PARSE_ERROR
+    if is_rate_limit_error(error):
+        return RATE_LIMIT
+    generation_types = sys.modules.get("google.generativeai.types.generation_types")
+    if generation_types is not None and isinstance(
+            error, (generation_types.BlockedPromptException, generation_types.StopCandidateException)):
+        return SAFETY_BLOCK
+    status = _status_code(error)
+    # Before server errors: openai's APITimeoutError is a kind of APIConnectionError
+    if (isinstance(error, TimeoutError) or _google_error(error, "DeadlineExceeded")
+            or _openai_error(error, "APITimeoutError") or status == 408):
+        return TIMEOUT
+    if (_google_error(error, "ServerError") or _openai_error(error, "InternalServerError", "APIConnectionError")
+            or (status is not None and status >= 500)):
+        return SERVER_ERROR
+    message = str(error).lower()
+    if "safety" in message or "blocked" in message:
+        return SAFETY_BLOCK
+    if "deadline" in message or "timed out" in message or "timeout" in message:
+        return TIMEOUT
+    return OTHER
+
+def should_retry(kind, attempt):
+    """attempt counts the retries already made for this error class."""
+    return attempt < MAX_RETRIES.get(kind, 0)
+
+def backoff_delay(attempt, base_seconds=1.0, max_seconds=30.0):
+    """Exponential backoff with full jitter, so workers retrying together spread out."""
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** attempt))
+
+class CircuitBreaker:
+    """Pauses every worker when the recent failure rate spikes.
+
+    Outcomes of the last `window` requests are kept. Once at least `min_requests`
+    are recorded and the failure share reaches `failure_threshold`, the breaker
+    opens: wait() blocks all workers for `cooldown_seconds`, after which the
+    window is cleared and requests are let through again. Rate limits are not
+    counted here; the token bucket limiter already backs off on those.
+    """
+
+    def __init__(self, window=20, min_requests=10, failure_threshold=0.5, cooldown_seconds=30.0):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = collections.deque(maxlen=window)
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.monotonic()
+                if remaining <= 0:
+                    return
+            time.sleep(min(remaining, 5.0))
+
+    def record(self, success):
+        with self._lock:
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (len(self._outcomes) >= self.min_requests and
+                    failures / len(self._outcomes) >= self.failure_threshold):
+                self._open_until = time.monotonic() + self.cooldown_seconds
+                self._outcomes.clear()
+                print(f"{failures} recent generation requests failed; pausing workers for {self.cooldown_seconds:.0f}s")
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return time.monotonic() < self._open_until
+
+_shared_breaker = CircuitBreaker()
+
+def get_shared_breaker():
+    """Process-wide breaker, shared like the rate limiter by every generation run."""
+    return _shared_breaker
+
+def record_dead_letter(project_id, item_type, item_key, payload, error):
+    """Persist an item that still failed after retries so it can be retried on its own later."""
+    return AppDatabase.store_dead_letter(project_id, item_type, item_key, json.dumps(payload),
+                                         classify_error(error), str(error)[:1000], time.time())
@@ -0,0 +1,309 @@
+import collections
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+from utils.llm_resilience import classify_error
+
+# Local request log; always written (unless tracing is off) because it feeds the usage summary
+TRACE_FILE = os.path.join("logs", "llm_requests.jsonl")
+
+# When the log grows past this size it is moved to <log>.1 (replacing the previous one) and
+# started afresh; override with LLM_TRACE_MAX_BYTES
+DEFAULT_TRACE_MAX_BYTES = 20 * 1024 * 1024
+
+# Prompt/response text sent to Langfuse is cut to this many characters
+LANGFUSE_MAX_CHARS = 4000
+
+# USD per 1M (input, output) tokens, matched by model name prefix. GEMINI_PRICE_INPUT_PER_M /
+# GEMINI_PRICE_OUTPUT_PER_M override the price of Gemini models, and LLM_MODEL_PRICES (JSON mapping
+# model name prefixes to [input, output]) that of any model. Models without a published price
+# (such as the experimental gemini-2.0-pro-exp) are left out, so their cost is reported as unknown.
+MODEL_PRICES = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Cached prompt tokens (context cache / provider prefix cache) are billed at this share of the input price
+CACHED_INPUT_PRICE_FACTOR = 0.25
+
+# Project and retry attempt of the request being made. The generation engine runs
+# each request in a copy of the submitting context, so both reach worker threads.
+_project_id = contextvars.ContextVar("llm_trace_project_id", default=None)
+_attempt = contextvars.ContextVar("llm_trace_attempt", default=0)
+
+_file_lock = threading.Lock()
+_summary_cache = {}
+_summary_lock = threading.Lock()
+_langfuse_client = None
+_langfuse_checked = False
+_langfuse_lock = threading.Lock()
+
+def set_project(project_id):
+    _project_id.set(project_id)
+
+def set_attempt(attempt):
+    _attempt.set(attempt)
+
+def tracing_enabled():
+    return os.getenv("LLM_TRACING", "on").lower() not in ("off", "0", "false", "none")
+
+def _get_langfuse():
+    """Langfuse client when LANGFUSE_PUBLIC_KEY/LANGFUSE_SECRET_KEY are set and the SDK imports, else None."""
+    global _langfuse_client, _langfuse_checked
+    with _langfuse_lock:
+        if not _langfuse_checked:
+            _langfuse_checked = True
+            if os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY"):
+                try:
+                    from langfuse import Langfuse
+                    _langfuse_client = Langfuse()
+                except Exception as e:
+                    print(f"Langfuse tracing disabled: {e}")
+        return _langfuse_client
+
+def get_model_price(model_name):
+    """USD per 1M (input, output) tokens for model_name, or None when its price is not known."""
+    name = model_name.split("/")[-1]
+    # Longest prefix first, so "gpt-4o-mini" is not priced as "gpt-4o"
+    overrides = json.loads(os.getenv("LLM_MODEL_PRICES") or "{}")
+    for prefix in sorted(overrides, key=len, reverse=True):
+        if name.startswith(prefix):
+            input_price, output_price = overrides[prefix]
+            return float(input_price), float(output_price)
+    input_price = os.getenv("GEMINI_PRICE_INPUT_PER_M")
+    output_price = os.getenv("GEMINI_PRICE_OUTPUT_PER_M")
+    if name.startswith("gemini") and input_price is not None and output_price is not None:
+        return float(input_price), float(output_price)
+    for prefix, prices in MODEL_PRICES.items():
+        if name.startswith(prefix):
+            return prices
+    return None
+
+def _usage(response):
+    """(prompt, response, total, cached) token counts from usage_metadata, or None when the response has none.
+
+    Cached tokens are the part of the prompt served from a context cache; they are included in the prompt count.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None or not getattr(usage, "total_token_count", 0):
+        return None
+    return (getattr(usage, "prompt_token_count", 0) or 0,
+            getattr(usage, "candidates_token_count", 0) or 0,
+            usage.total_token_count,
+            getattr(usage, "cached_content_token_count", 0) or 0)
+
+class RequestSpan:
+    """Measures one model request and exports it to the local log and, when configured, Langfuse."""
+
+    def __init__(self, kind, model_name, prompt):
+        self.kind = kind
+        self.model_name = model_name
+        self.prompt = prompt
+        self.project_id = _project_id.get()
+        self.attempt = _attempt.get()
+        self._observation = None
+        self._langfuse_v2 = False
+        self._start_langfuse_observation()
+        self._started = time.perf_counter()
+
+    def _start_langfuse_observation(self):
+        client = _get_langfuse()
+        if client is None:
+            return
+        kind, model_name, prompt = self.kind, self.model_name, self.prompt
+        try:
+            metadata = {"project_id": self.project_id, "kind": kind, "retry": self.attempt}
+            if hasattr(client, "start_observation"):  # Langfuse SDK v3+
+                self._observation = client.start_observation(
+                    name=f"qa_generation.{kind}", as_type="generation", model=model_name,
+                    input=prompt[:LANGFUSE_MAX_CHARS], metadata=metadata)
+            elif hasattr(client, "generation"):  # Langfuse SDK v2
+                self._langfuse_v2 = True
+                self._observation = client.generation(
+                    name=f"qa_generation.{kind}", model=model_name, input=prompt[:LANGFUSE_MAX_CHARS],
+                    metadata=metadata, start_time=datetime.datetime.now(datetime.timezone.utc))
+        except Exception as e:
+            print(f"Langfuse trace could not be started: {e}")
+
+    def finish(self, response=None, pairs=0, error=None):
+        latency = time.perf_counter() - self._started
+        usage = _usage(response) if response is not None else None
+        cached_tokens = 0
+        if usage:
+            prompt_tokens, response_tokens, total_tokens, cached_tokens = usage
+        elif response is not None:
+            prompt_tokens = max(1, len(self.prompt) // 4)
+            response_tokens = 0
+            total_tokens = prompt_tokens
+        else:
+            # Failed before any response; nothing is known to be billed
+            prompt_tokens = response_tokens = total_tokens = 0
+        prices = get_model_price(self.model_name)
+        cost = None
+        if prices is not None:
+            billed_input = prompt_tokens - cached_tokens + cached_tokens * CACHED_INPUT_PRICE_FACTOR
+            cost = (billed_input * prices[0] + response_tokens * prices[1]) / 1_000_000
+        record = {
+            "ts": time.time(),
+            "project_id": self.project_id,
+            "kind": self.kind,
+            "model": self.model_name,
+            "latency_s": round(latency, 4),
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "total_tokens": total_tokens,
+            "cached_tokens": cached_tokens,
+            "tokens_estimated": usage is None and response is not None,
+            "retry": self.attempt,
+            "pairs": pairs,
+            "cost_usd": cost,
+            "status": "error" if error else "ok",
+            "error_kind": classify_error(error) if error else None,
+        }
+        _write_record(record)
+        self._export_langfuse(record, response, error)
+        return record
+
+    def _export_langfuse(self, record, response, error):
+        if self._observation is None:
+            return
+        try:
+            output = None
+            if response is not None:
+                try:
+                    output = response.text[:LANGFUSE_MAX_CHARS]
+                except Exception:
+                    output = None
+            metadata = {"project_id": record["project_id"], "kind": record["kind"], "retry": record["retry"],
+                        "pairs": record["pairs"], "latency_s": record["latency_s"]}
+            level = "ERROR" if error else "DEFAULT"
+            status_message = str(error)[:500] if error else None
+            if not self._langfuse_v2:
+                self._observation.update(
+                    output=output, metadata=metadata, level=level, status_message=status_message,
+                    usage_details={"input": record["prompt_tokens"] - record["cached_tokens"],
+                                   "input_cached_tokens": record["cached_tokens"],
+                                   "output": record["response_tokens"]},
+                    cost_details={"total": record["cost_usd"]} if record["cost_usd"] is not None else None)
+                self._observation.end()
+            else:
+                self._observation.end(
+                    output=output, metadata=metadata, level=level, status_message=status_message,
+                    usage={"input": record["prompt_tokens"], "output": record["response_tokens"],
+                           "total_cost": record["cost_usd"]})
+        except Exception as e:
+            print(f"Langfuse trace could not be exported: {e}")
+
+class _NoopSpan:
+    def finish(self, response=None, pairs=0, error=None):
+        return None
+
+def start_request_span(kind, model_name, prompt):
+    """Start timing a model request; call finish() on the returned span when it completes or fails."""
+    if not tracing_enabled():
+        return _NoopSpan()
+    return RequestSpan(kind, model_name, prompt)
+
+def _trace_paths():
+    """The log's rotated file and the current one, oldest first."""
+    path = os.getenv("LLM_TRACE_FILE", TRACE_FILE)
+    return [path + ".1", path]
+
+def _write_record(record):
+    path = os.getenv("LLM_TRACE_FILE", TRACE_FILE)
+    max_bytes = int(os.getenv("LLM_TRACE_MAX_BYTES", DEFAULT_TRACE_MAX_BYTES))
+    try:
+        with _file_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+                os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Could not write LLM trace record: {e}")
+
+def read_records(project_id=None, max_records=50000):
+    """Most recent request records from the local log and its rotated file, optionally for one project."""
+    records = collections.deque(maxlen=max_records)
+    for path in _trace_paths():
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if project_id is None or record.get("project_id") == project_id:
+                    records.append(record)
+    return list(records)
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def summarize_usage(project_id=None):
+    """Request count, error/retry counts, p50/p95 latency, tokens per pair, cached share and cost from the local log.
+
+    The summary is reused until the log files change (by modification time
+    and size), so pages can show it on every run without re-reading the log.
+    Requests on models without a known price are counted in unpriced_requests
+    and left out of cost_usd.
+    """
+    stamp = []
+    for path in _trace_paths():
+        try:
+            stat = os.stat(path)
+            stamp.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamp.append((path, None, None))
+    key = tuple(stamp)
+    with _summary_lock:
+        summary = _summary_cache.get(project_id)
+        if summary is not None and summary[0] == key:
+            return summary[1]
+    summary = _summarize_records(read_records(project_id))
+    with _summary_lock:
+        _summary_cache[project_id] = (key, summary)
+    return summary
+
+def _summarize_records(records):
+    latencies = sorted(r["latency_s"] for r in records if r["status"] == "ok")
+    pairs = sum(r["pairs"] for r in records)
+    total_tokens = sum(r["total_tokens"] for r in records)
+    prompt_tokens = sum(r["prompt_tokens"] for r in records)
+    # Records written before cached tokens were tracked have no such field
+    cached_tokens = sum(r.get("cached_tokens", 0) for r in records)
+    by_model = {}
+    for r in records:
+        model = by_model.setdefault(r["model"], {"requests": 0, "tokens": 0, "cost_usd": None})
+        model["requests"] += 1
+        model["tokens"] += r["total_tokens"]
+        if r["cost_usd"] is not None:
+            model["cost_usd"] = (model["cost_usd"] or 0.0) + r["cost_usd"]
+    return {
+        "requests": len(records),
+        "errors": sum(1 for r in records if r["status"] == "error"),
+        "retried": sum(1 for r in records if r.get("retry")),
+        "p50_latency_s": _percentile(latencies, 0.5),
+        "p95_latency_s": _percentile(latencies, 0.95),
+        "total_tokens": total_tokens,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "cached_share": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "pairs": pairs,
+        "tokens_per_pair": total_tokens / pairs if pairs else None,
+        "cost_usd": sum(r["cost_usd"] for r in records if r["cost_usd"] is not None),
+        "unpriced_requests": sum(1 for r in records if r["cost_usd"] is None),
+        "by_model": by_model,
+    }
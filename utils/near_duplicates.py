@@ -0,0 +1,324 @@
+import os
+import threading
+import zlib
+import numpy as np
+from utils.db import AppDatabase
+from utils.text_normalize import normalize_question, normalize_questions
+
+# MinHash permutations per question signature; the LSH index splits them into bands of rows
+NUM_PERMUTATIONS = 64
+
+# Questions whose word sets overlap at least this much (Jaccard) are near-duplicates;
+# override with QA_NEAR_DUPLICATE_THRESHOLD, or set it to 0 to match exact duplicates only
+DEFAULT_NEAR_DUPLICATE_THRESHOLD = 0.7
+
+# Bands and rows are chosen so a pair right at the threshold still becomes a candidate this often
+MIN_CANDIDATE_RECALL = 0.95
+
+# When collapsing, each question in an LSH bucket is compared with at most this many earlier ones
+MAX_BUCKET_COMPARISONS = 64
+
+# Signatures computed per step when filling in the ones a project is missing
+SIGNATURE_BATCH_SIZE = 5000
+
+# New entries are kept in a small unsorted delta until there are this many, then merged into the bands
+INDEX_DELTA_LIMIT = 2048
+
+_PRIME = 4294967291  # largest prime below 2**32, so hashes of 32-bit shingles stay in uint32
+_EMPTY = np.uint32(0xFFFFFFFF)
+_permutations = np.random.RandomState(20240611)
+_A = _permutations.randint(1, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+_B = _permutations.randint(0, _PRIME, NUM_PERMUTATIONS).astype(np.uint64)
+SIGNATURE_BYTES = NUM_PERMUTATIONS * 4
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_near_duplicate_threshold():
+    return float(os.getenv("QA_NEAR_DUPLICATE_THRESHOLD", DEFAULT_NEAR_DUPLICATE_THRESHOLD))
+
+def _shingles(normalized):
+    return set(normalized.split())
+
+def question_shingles(question):
+    """Words of the normalized question (see normalize_question); near-duplicates are compared on these."""
+    return _shingles(normalize_question(question))
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def minhash_signatures(questions):
+    """MinHash signatures of many questions as a (len(questions), NUM_PERMUTATIONS) uint32 array.
+
+    Each word is hashed with CRC32 (stable across processes) and put through
+    NUM_PERMUTATIONS universal hashes (a*x + b) mod p in one vectorized step
+    for the whole batch; the per-question minimums are taken with reduceat.
+    Questions without words get an all-0xFFFFFFFF signature that the indexes skip.
+    """
+    shingle_sets = [_shingles(text) for text in normalize_questions(questions)]
+    counts = np.fromiter((len(s) for s in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    signatures = np.full((len(shingle_sets), NUM_PERMUTATIONS), _EMPTY, dtype=np.uint32)
+    if not counts.sum():
+        return signatures
+    hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for s in shingle_sets for word in s),
+                         dtype=np.uint64, count=int(counts.sum()))
+    permuted = (hashes[:, None] * _A % _PRIME + _B) % _PRIME
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    signatures[present] = np.minimum.reduceat(permuted, starts[present], axis=0).astype(np.uint32)
+    return signatures
+
+def lsh_bands(threshold):
+    """(bands, rows) with the fewest candidates that still finds MIN_CANDIDATE_RECALL of pairs at threshold."""
+    best = (NUM_PERMUTATIONS, 1)
+    for rows in range(1, NUM_PERMUTATIONS + 1):
+        bands = NUM_PERMUTATIONS // rows
+        if 1 - (1 - threshold ** rows) ** bands >= MIN_CANDIDATE_RECALL:
+            best = (bands, rows)
+    return best
+
+def band_keys(signatures, bands, rows):
+    """One uint32 hash per band of each signature, as a (len(signatures), bands) array."""
+    banded = signatures[:, :bands * rows].reshape(len(signatures), bands, rows).astype(np.uint64)
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for row in range(rows):
+        keys = (keys * np.uint64(1000003) + banded[:, :, row]) & np.uint64(0xFFFFFFFF)
+    return keys.astype(np.uint32)
+
+def sync_minhash_signatures(project_id):
+    """Compute and store signatures for the project's QA pairs that have none (new or edited questions)."""
+    computed = 0
+    # Batches are read in full before writing so the read cursor is not open across the writes
+    for rows in list(AppDatabase.get_qa_pairs_missing_minhash(project_id, SIGNATURE_BYTES, SIGNATURE_BATCH_SIZE)):
+        signatures = minhash_signatures([row["question"] for row in rows])
+        AppDatabase.store_qa_minhashes(project_id, [(row["id"], signature.tobytes())
+                                                    for row, signature in zip(rows, signatures)])
+        computed += len(rows)
+    return computed
+
+def _load_signatures(project_id, after_seq=0):
+    """Stored signatures after after_seq as (last seq, qa ids, questions, signature matrix)."""
+    last_seq, ids, questions, blobs = after_seq, [], [], []
+    for rows in AppDatabase.iter_qa_minhashes(project_id, after_seq, SIGNATURE_BATCH_SIZE):
+        last_seq = rows[-1]["seq"]
+        for row in rows:
+            ids.append(row["qa_id"])
+            questions.append(row["question"])
+            blobs.append(row["signature"])
+    signatures = np.frombuffer(b"".join(blobs), dtype=np.uint32).reshape(len(blobs), NUM_PERMUTATIONS)
+    return last_seq, ids, questions, signatures
+
+class NearDuplicateIndex:
+    """LSH index over the MinHash signatures of one project's questions.
+
+    Each band keeps its keys sorted next to the matching QA ids, so a lookup
+    is one binary search per band. Entries added since the last merge sit in
+    a small delta that is scanned directly. Candidates are confirmed on the
+    exact Jaccard similarity of their word sets.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold)
+        self.questions = {}
+        # Pairs whose question has no words: stored with a signature but never matched
+        self.unindexed_ids = set()
+        self.data_version = None
+        self.last_seq = 0
+        self._band_keys = [np.empty(0, dtype=np.uint32) for _ in range(self.bands)]
+        self._band_ids = [np.empty(0, dtype=np.int64) for _ in range(self.bands)]
+        self._delta_ids = []
+        self._delta_keys = []
+        self._shingles = {}
+
+    def __len__(self):
+        return len(self.questions)
+
+    def add_signatures(self, ids, questions, signatures):
+        """Add or replace entries; signatures come from minhash_signatures or qa_minhash."""
+        keep = ~(signatures == _EMPTY).all(axis=1)
+        keys = band_keys(signatures, self.bands, self.rows)
+        for qa_id, question, key, kept in zip(ids, questions, keys, keep):
+            # A replaced question's old bucket entries stay behind and fail verification
+            self._shingles.pop(qa_id, None)
+            if not kept:
+                self.questions.pop(qa_id, None)
+                self.unindexed_ids.add(qa_id)
+                continue
+            self.unindexed_ids.discard(qa_id)
+            self.questions[qa_id] = question
+            self._delta_ids.append(qa_id)
+            self._delta_keys.append(key)
+        if len(self._delta_ids) >= INDEX_DELTA_LIMIT:
+            self._merge_delta()
+
+    def remove(self, qa_ids):
+        for qa_id in qa_ids:
+            self.questions.pop(qa_id, None)
+            self.unindexed_ids.discard(qa_id)
+            self._shingles.pop(qa_id, None)
+
+    def _merge_delta(self):
+        if not self._delta_ids:
+            return
+        delta_ids = np.asarray(self._delta_ids, dtype=np.int64)
+        delta_keys = np.vstack(self._delta_keys)
+        for band in range(self.bands):
+            keys = np.concatenate((self._band_keys[band], delta_keys[:, band]))
+            ids = np.concatenate((self._band_ids[band], delta_ids))
+            order = np.argsort(keys, kind="stable")
+            self._band_keys[band], self._band_ids[band] = keys[order], ids[order]
+        self._delta_ids, self._delta_keys = [], []
+
+    def _question_shingles(self, qa_id):
+        shingles = self._shingles.get(qa_id)
+        if shingles is None:
+            shingles = self._shingles[qa_id] = question_shingles(self.questions[qa_id])
+        return shingles
+
+    def candidates(self, signature):
+        keys = band_keys(signature[None, :], self.bands, self.rows)[0]
+        found = set()
+        for band, key in enumerate(keys):
+            sorted_keys = self._band_keys[band]
+            start = np.searchsorted(sorted_keys, key, side="left")
+            end = np.searchsorted(sorted_keys, key, side="right")
+            found.update(self._band_ids[band][start:end].tolist())
+        if self._delta_ids:
+            matches = (np.vstack(self._delta_keys) == keys).any(axis=1)
+            found.update(np.asarray(self._delta_ids)[matches].tolist())
+        return found
+
+    def find(self, question, exclude_id=None):
+        """Most similar indexed question at or above the threshold, as (qa_id, similarity), or None."""
+        signature = minhash_signatures([question])[0]
+        if (signature == _EMPTY).all():
+            return None
+        shingles = question_shingles(question)
+        best = None
+        for qa_id in self.candidates(signature):
+            if qa_id == exclude_id or qa_id not in self.questions:
+                continue
+            similarity = jaccard(shingles, self._question_shingles(qa_id))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (qa_id, similarity)
+        return best
+
+def get_near_duplicate_index(project_id, threshold=None):
+    """The project's NearDuplicateIndex, brought up to date with the database.
+
+    Indexes are kept per process and refreshed only when the project's data
+    version changed: missing signatures are computed and stored, signatures
+    stored since the last refresh are added, and deleted pairs are dropped.
+    """
+    threshold = get_near_duplicate_threshold() if threshold is None else threshold
+    with _indexes_lock:
+        index = _indexes.get((project_id, threshold))
+        if index is None:
+            index = _indexes[(project_id, threshold)] = NearDuplicateIndex(threshold)
+        data_version = AppDatabase.get_data_version(project_id)
+        if index.data_version == data_version:
+            return index
+        sync_minhash_signatures(project_id)
+        index.last_seq, ids, questions, signatures = _load_signatures(project_id, index.last_seq)
+        index.add_signatures(ids, questions, signatures)
+        # Deleted pairs take their signatures with them, so a drop in the count means deletions
+        if len(index) + len(index.unindexed_ids) > AppDatabase.count_qa_minhashes(project_id):
+            known = set(index.questions) | index.unindexed_ids
+            index.remove(known - AppDatabase.get_qa_pair_ids(project_id))
+        index.data_version = data_version
+        return index
+
+def find_near_duplicate(project_id, question, threshold=None):
+    """The project's QA pair whose question is nearest to question at the threshold, or None.
+
+    Returns a dict with the pair's id, question and similarity.
+    """
+    index = get_near_duplicate_index(project_id, threshold)
+    match = index.find(question)
+    if match is None:
+        return None
+    return {"id": match[0], "question": index.questions[match[0]], "similarity": match[1]}
+
+def _find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def find_near_duplicate_clusters(project_id, threshold=None):
+    """Group the project's questions into clusters of near-duplicates.
+
+    Works on the stored signatures in bulk: for every band the band keys of
+    all pairs are sorted, pairs sharing a key are compared on exact word-set
+    Jaccard, and the matches are joined with union-find, so the work grows
+    with the number of pairs and candidates rather than with all pairs of
+    questions. Returns clusters of two or more {"id", "question"} dicts, each
+    sorted by id (oldest first), largest clusters first.
+    """
+    threshold = get_near_duplicate_threshold() if threshold is None else threshold
+    bands, rows = lsh_bands(threshold)
+    sync_minhash_signatures(project_id)
+    _, ids, questions, signatures = _load_signatures(project_id)
+    keep = np.flatnonzero(~(signatures == _EMPTY).all(axis=1))
+    ids = [ids[i] for i in keep]
+    questions = [questions[i] for i in keep]
+    keys = band_keys(signatures[keep], bands, rows)
+
+    parent = list(range(len(ids)))
+    shingles = [None] * len(ids)
+
+    def words(i):
+        if shingles[i] is None:
+            shingles[i] = question_shingles(questions[i])
+        return shingles[i]
+
+    for band in range(bands):
+        order = np.argsort(keys[:, band], kind="stable")
+        sorted_keys = keys[order, band]
+        boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(order)]))
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            members = order[start:end].tolist()
+            for position, i in enumerate(members[1:], 1):
+                for j in members[max(0, position - MAX_BUCKET_COMPARISONS):position]:
+                    root_i, root_j = _find_root(parent, i), _find_root(parent, j)
+                    if root_i != root_j and jaccard(words(i), words(j)) >= threshold:
+                        parent[root_i] = root_j
+
+    clusters = {}
+    for i in range(len(ids)):
+        clusters.setdefault(_find_root(parent, i), []).append(i)
+    result = [sorted(({"id": ids[i], "question": questions[i]} for i in members), key=lambda qa: qa["id"])
+              for members in clusters.values() if len(members) > 1]
+    result.sort(key=len, reverse=True)
+    return result
+
+def collapse_near_duplicates(project_id, clusters, threshold=None):
+    """Keep the oldest pair of each cluster and delete the members that are still its near-duplicates.
+
+    Clusters can be stale by the time they are collapsed, and union-find
+    chains A~B~C even when A and C differ, so every member is re-read first.
+    A member is deleted only if its question is unchanged and overlaps the
+    kept pair's current question by at least threshold; clusters whose kept
+    pair is gone are left alone. Returns how many pairs were deleted.
+    """
+    threshold = get_near_duplicate_threshold() if threshold is None else threshold
+    current = AppDatabase.get_qa_pairs_by_ids(project_id, [qa["id"] for cluster in clusters for qa in cluster])
+    removed_ids = []
+    for cluster in clusters:
+        kept = current.get(cluster[0]["id"])
+        if kept is None:
+            continue
+        kept_words = question_shingles(kept["question"])
+        for qa in cluster[1:]:
+            row = current.get(qa["id"])
+            if row is not None and row["question"] == qa["question"] \
+                    and jaccard(kept_words, question_shingles(row["question"])) >= threshold:
+                removed_ids.append(qa["id"])
+    if not removed_ids:
+        return 0
+    return AppDatabase.remove_qa_pairs(project_id, removed_ids)
@@ -0,0 +1,218 @@
+import heapq
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from utils.db import AppDatabase
+from utils.text_normalize import normalize_question, normalize_questions
+
+LOOKUP_MODES = ("auto", "exact", "keyword", "fts")
+
+DEFAULT_LOOKUP_LIMIT = 5
+MAX_LOOKUP_LIMIT = 50
+
+# Lookup responses kept in the LRU cache; override with QA_SERVICE_CACHE_SIZE
+DEFAULT_CACHE_SIZE = 10000
+
+# How often a project's data version is checked for changes; override with QA_SERVICE_RELOAD_SECONDS
+DEFAULT_RELOAD_SECONDS = 1.0
+
+# Keyword lookups skip words found in more than this share of a project's questions,
+# unless the query has nothing else
+KEYWORD_MAX_DF_SHARE = 0.2
+
+class QAIndexClosedError(RuntimeError):
+    """Raised by an FTS lookup on an index that a reload has already closed."""
+
+class QAIndex:
+    """One project's QA pairs at one data version, held in memory for lookups.
+
+    exact maps normalized questions to pairs, keyword scores pairs by the IDF
+    of the question words they share with the query, and fts ranks questions
+    and answers with BM25 in an in-memory SQLite FTS5 table. Concurrent FTS
+    lookups each take a connection to the shared in-memory database from the
+    index's pool, so they run in parallel. close() closes every connection
+    the index opened, once the lookups using them have finished.
+    """
+
+    def __init__(self, project_id, data_version):
+        self.project_id = project_id
+        self.data_version = data_version
+        self.pairs = {}
+        self._exact = {}
+        self._postings = {}
+        self._uri = f"file:qa_lookup_{project_id}_{data_version}_{id(self)}?mode=memory&cache=shared"
+        self._lock = threading.Lock()
+        self._idle = []
+        self._in_use = 0
+        self._closed = False
+        # Keeps the in-memory database alive for as long as the index is
+        self._keeper = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        self._keeper.execute("CREATE VIRTUAL TABLE qa_fts USING fts5(question, answer, content='', "
+                             "tokenize='porter unicode61')")
+        for rows in AppDatabase.iter_project_qa_pairs(project_id, batch_size=5000):
+            normalized = normalize_questions(row["question"] for row in rows)
+            for row, question in zip(rows, normalized):
+                self.pairs[row["id"]] = {"id": row["id"], "question": row["question"], "answer": row["answer"],
+                                         "call_id": row["call_id"]}
+                self._exact.setdefault(question, []).append(row["id"])
+                for word in set(question.split()):
+                    self._postings.setdefault(word, []).append(row["id"])
+            self._keeper.executemany("INSERT INTO qa_fts (rowid, question, answer) VALUES (?, ?, ?)",
+                                     [(row["id"], row["question"], row["answer"]) for row in rows])
+        self._keeper.commit()
+        self._idf = {word: math.log(1 + len(self.pairs) / len(ids)) for word, ids in self._postings.items()}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if not self._in_use:
+                self._close_connections()
+
+    def _close_connections(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+        if self._keeper is not None:
+            self._keeper.close()
+            self._keeper = None
+
+    def _results(self, scored):
+        return [dict(self.pairs[qa_id], score=round(score, 4)) for qa_id, score in scored]
+
+    def exact(self, query, limit):
+        return self._results((qa_id, 1.0) for qa_id in self._exact.get(normalize_question(query), [])[:limit])
+
+    def keyword(self, query, limit):
+        words = [word for word in set(normalize_question(query).split()) if word in self._postings]
+        max_ids = KEYWORD_MAX_DF_SHARE * len(self.pairs)
+        words = [word for word in words if len(self._postings[word]) <= max_ids] or words
+        scores = Counter()
+        for word in words:
+            idf = self._idf[word]
+            for qa_id in self._postings[word]:
+                scores[qa_id] += idf
+        return self._results(heapq.nlargest(limit, scores.items(), key=lambda item: item[1]))
+
+    def _checkout(self):
+        with self._lock:
+            if self._keeper is None:
+                raise QAIndexClosedError(f"QA index for project {self.project_id} has been closed")
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        except BaseException:
+            self._checkin(None)
+            raise
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._in_use -= 1
+            if conn is not None:
+                self._idle.append(conn)
+            if self._closed and not self._in_use:
+                self._close_connections()
+
+    def fts(self, query, limit):
+        words = normalize_question(query).split()
+        if not words:
+            return []
+        # Every word quoted, so user input is never read as FTS5 query syntax
+        match = " OR ".join(f'"{word}"' for word in words)
+        conn = self._checkout()
+        try:
+            rows = conn.execute(
+                "SELECT rowid, bm25(qa_fts, 2.0, 1.0) FROM qa_fts WHERE qa_fts MATCH ? ORDER BY 2 LIMIT ?",
+                (match, limit)).fetchall()
+        finally:
+            self._checkin(conn)
+        # bm25() is lower for better matches; report it so that higher is better
+        return self._results((qa_id, -score) for qa_id, score in rows if qa_id in self.pairs)
+
+    def lookup(self, query, mode="auto", limit=DEFAULT_LOOKUP_LIMIT):
+        if mode == "auto":
+            return self.exact(query, limit) or self.fts(query, limit)
+        return getattr(self, mode)(query, limit)
+
+class QALookupService:
+    """Per-project QAIndexes kept current with the database, behind an LRU response cache.
+
+    A project's index is loaded on its first lookup. Its data version is
+    checked at most every reload_seconds; when it changed, a new index is
+    built while lookups keep using the old one, then swapped in. Cached
+    responses are keyed by data version, so a reload never serves stale ones.
+    """
+
+    def __init__(self, cache_size=None, reload_seconds=None):
+        self.cache_size = int(os.getenv("QA_SERVICE_CACHE_SIZE", DEFAULT_CACHE_SIZE)) \
+            if cache_size is None else cache_size
+        self.reload_seconds = float(os.getenv("QA_SERVICE_RELOAD_SECONDS", DEFAULT_RELOAD_SECONDS)) \
+            if reload_seconds is None else reload_seconds
+        self._indexes = {}
+        self._checked_at = {}
+        self._build_locks = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get_index(self, project_id):
+        index = self._indexes.get(project_id)
+        now = time.monotonic()
+        if index is not None and now - self._checked_at.get(project_id, 0) < self.reload_seconds:
+            return index
+        with self._lock:
+            build_lock = self._build_locks.setdefault(project_id, threading.Lock())
+        with build_lock:
+            index = self._indexes.get(project_id)
+            if index is not None and time.monotonic() - self._checked_at.get(project_id, 0) < self.reload_seconds:
+                return index
+            data_version = AppDatabase.get_data_version(project_id)
+            if index is None or index.data_version != data_version:
+                index = QAIndex(project_id, data_version)
+                old = self._indexes.get(project_id)
+                self._indexes[project_id] = index
+                self.stats["reloads"] += 1
+                if old is not None:
+                    old.close()
+            self._checked_at[project_id] = time.monotonic()
+            return index
+
+    def lookup(self, project_id, query, mode="auto", limit=DEFAULT_LOOKUP_LIMIT):
+        """Lookup response for a project: {project_id, data_version, mode, query, cached, results}."""
+        if mode not in LOOKUP_MODES:
+            raise ValueError(f"Unknown lookup mode '{mode}'; use one of {', '.join(LOOKUP_MODES)}")
+        limit = max(1, min(int(limit), MAX_LOOKUP_LIMIT))
+        index = self.get_index(project_id)
+        key = (project_id, index.data_version, mode, normalize_question(query), limit)
+        with self._lock:
+            self.stats["lookups"] += 1
+            results = self._cache.get(key)
+            if results is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+        cached = results is not None
+        if not cached:
+            try:
+                results = index.lookup(query, mode, limit)
+            except QAIndexClosedError:
+                # Swapped out by a reload since get_index returned it; the new index is current
+                return self.lookup(project_id, query, mode, limit)
+            with self._lock:
+                self._cache[key] = results
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return {"project_id": project_id, "data_version": index.data_version, "mode": mode, "query": query,
+                "cached": cached, "results": results}
+
+    def describe(self):
+        with self._lock:
+            return {"projects": {project_id: {"data_version": index.data_version, "qa_pairs": len(index)}
+                                 for project_id, index in self._indexes.items()},
+                    "cache_entries": len(self._cache), "cache_size": self.cache_size, **self.stats}
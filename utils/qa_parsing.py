@@ -0,0 +1,127 @@
+import json
+import threading
+
+# Response schemas for Gemini structured output (generation_config.response_schema)
+QA_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING"},
+            "answer": {"type": "STRING"},
+        },
+        "required": ["question", "answer"],
+    },
+}
+
+PACKED_QA_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "call_id": {"type": "STRING"},
+            "question": {"type": "STRING"},
+            "answer": {"type": "STRING"},
+        },
+        "required": ["call_id", "question", "answer"],
+    },
+}
+
+class QAParseError(ValueError):
+    """Raised when a model response contains no usable QA pair."""
+
+class IncrementalQAParser:
+    """Pulls complete JSON objects out of model output as it arrives.
+
+    Text can be fed in any number of pieces; feed() returns the objects that
+    became complete with that piece. Objects are found by tracking brace depth
+    outside of strings, so code fences, a missing closing bracket or a response
+    cut off mid-object only lose the unfinished object. An object that is
+    complete but not valid JSON is counted in `invalid` and skipped.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.invalid = 0
+
+    def feed(self, text):
+        completed = []
+        for char in text:
+            if self._depth:
+                self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char == "{":
+                if not self._depth:
+                    self._buffer = ["{"]
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    try:
+                        completed.append(json.loads("".join(self._buffer)))
+                    except ValueError:
+                        self.invalid += 1
+                    self._buffer = []
+        return completed
+
+    @property
+    def pending(self):
+        """True while an object is open (the output so far ends mid-object)."""
+        return self._depth > 0
+
+def is_valid_qa(qa):
+    return (isinstance(qa, dict) and isinstance(qa.get("question"), str) and qa["question"].strip()
+            and isinstance(qa.get("answer"), str))
+
+def parse_qa_response(text):
+    """Parse a QA array from model output; returns (qa_pairs, complete).
+
+    Well-formed output takes the plain json.loads path. Anything else is run
+    through IncrementalQAParser so every complete pair is kept; complete is
+    False whenever something had to be salvaged or dropped.
+    """
+    cleaned = text.replace("```json", "").replace("```", "").strip()
+    try:
+        data = json.loads(cleaned)
+        if isinstance(data, dict):
+            data = [data]
+        if isinstance(data, list):
+            qa_pairs = [qa for qa in data if is_valid_qa(qa)]
+            return qa_pairs, len(qa_pairs) == len(data)
+    except ValueError:
+        pass
+    parser = IncrementalQAParser()
+    qa_pairs = [qa for qa in parser.feed(cleaned) if is_valid_qa(qa)]
+    return qa_pairs, False
+
+# Parse outcomes per model name: ok (clean JSON), salvaged (partial), failed (nothing usable)
+_parse_stats = {}
+_parse_stats_lock = threading.Lock()
+
+def record_parse_result(model_name, qa_pairs, complete):
+    outcome = "ok" if complete else ("salvaged" if qa_pairs else "failed")
+    with _parse_stats_lock:
+        stats = _parse_stats.setdefault(model_name, {"ok": 0, "salvaged": 0, "failed": 0})
+        stats[outcome] += 1
+    return outcome
+
+def get_parse_stats():
+    """Per-model parse outcome counts for this process, with the share of responses not parsed cleanly."""
+    with _parse_stats_lock:
+        stats = {model: dict(counts) for model, counts in _parse_stats.items()}
+    for counts in stats.values():
+        total = counts["ok"] + counts["salvaged"] + counts["failed"]
+        counts["total"] = total
+        counts["failure_rate"] = (counts["salvaged"] + counts["failed"]) / total if total else 0.0
+    return stats
@@ -1,33 +1,45 @@
 import re
+import os
 import json
-import google.generativeai as genai
+import hashlib
+import threading
+import time
+import contextvars
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import streamlit as st
-from utils.db import AppDatabase
+from utils.db import AppDatabase, text_sha256
+from utils import llm_cache, llm_tracing, context_cache
+from utils.context_cache import join_prompt
+from utils.text_normalize import normalize_document, normalize_question, normalize_questions, estimate_tokens
+from utils.near_duplicates import get_near_duplicate_threshold, find_near_duplicate
+from utils.semantic_index import find_semantic_duplicate
+from utils.qa_parsing import (QA_RESPONSE_SCHEMA, PACKED_QA_RESPONSE_SCHEMA, QAParseError, IncrementalQAParser,
+                              is_valid_qa, parse_qa_response, record_parse_result)
+from utils.llm_resilience import (RATE_LIMIT, classify_error, should_retry, backoff_delay, get_shared_breaker,
+                                  record_dead_letter)
 
-def preprocess_text(text):
-    """Preprocess text to standardize formatting and remove inconsistencies."""
-    text = text.lower()
-    text = re.sub(r'\n{2,}', '\n', text)
-    text = re.sub(r'[^\w\s\.,;:?!\'"-]', ' ', text)
-    text = re.sub(r'\s{2,}', ' ', text)
-    lines = text.split('\n')
-    formatted_lines = []
-    for line in lines:
-        line = line.strip()
-        if re.match(r'^[a-z0-9\s]+:$', line):
-            formatted_lines.append(f"## {line}")
-        elif line.endswith(':') and ':' in line and len(line.split(':')[0].strip().split()) <= 5:
-            formatted_lines.append(f"### {line}")
-        else:
-            formatted_lines.append(line)
-    return '\n'.join(formatted_lines).strip()
+# Bump when a prompt template or the response post-processing changes so cached
+# responses produced by the old version are no longer served
+TRANSCRIPT_PROMPT_VERSION = "transcript-v2"
+MD_SECTION_PROMPT_VERSION = "md-section-v2"
+PACKED_TRANSCRIPT_PROMPT_VERSION = "transcript-packed-v2"
+TRANSCRIPT_WINDOW_PROMPT_VERSION = "transcript-window-v1"
 
-def generate_qa_from_transcript(transcript, call_id, gemini_model):
-    prompt = f"""
-    Below is a transcript from a customer service call about ESA (Emotional Support Animal) letters from Wellness Wag.
-    Generate 5-8 question-answer pairs that simulate a NATURAL conversation between a customer and a Wellness Wag support agent.
+# Stored in call_generation_state; covers every prompt a call can be generated with,
+# so bumping any of these versions marks every call as needing generation again
+CALL_GENERATION_VERSION = (f"{TRANSCRIPT_PROMPT_VERSION}+{PACKED_TRANSCRIPT_PROMPT_VERSION}"
+                           f"+{TRANSCRIPT_WINDOW_PROMPT_VERSION}")
+
+# Prompt version recorded with each kind of document chunk (see plan_document_generation)
+DOCUMENT_PROMPT_VERSIONS = {"chunk": TRANSCRIPT_PROMPT_VERSION, "md_section": MD_SECTION_PROMPT_VERSION}
 
-    WHAT I NEED:
+def preprocess_text(text):
+    """Preprocess text to standardize formatting and remove inconsistencies (see text_normalize)."""
+    return normalize_document(text)
+
+# Instructions shared by the single-transcript and packed prompts
+TRANSCRIPT_INSTRUCTIONS = """    WHAT I NEED:
     - Create question-answer pairs that sound like they come from REAL HUMAN CONVERSATIONS
     - Questions should be in NATURAL, CASUAL language - not perfect or formal
     - Focus on how REAL CUSTOMERS actually speak (with hesitations, simple language, etc.)
@@ -48,24 +60,197 @@ def generate_qa_from_transcript(transcript, call_id, gemini_model):
     4. Include exact prices, timeframes, and processes mentioned in the transcript
     5. Make the answers thorough but still sound like a real person speaking
     6. If a question asks for info not in the conversation, direct them to contact Wellness Wag
+"""
 
-    Transcript:
-    {transcript}
+# Each prompt is a static instruction, identical for every request of its kind, followed by
+# the per-request content. The instruction is sent as a system instruction and, within a
+# prefix_cache_session, from a provider-side cache (see context_cache), so only the
+# content is transferred and billed at the full rate.
+TRANSCRIPT_SYSTEM_INSTRUCTION = f"""
+    You will be given a transcript from a customer service call about ESA (Emotional Support Animal) letters from Wellness Wag.
+    Generate 5-8 question-answer pairs that simulate a NATURAL conversation between a customer and a Wellness Wag support agent.
 
+{TRANSCRIPT_INSTRUCTIONS}
     Format your response as a JSON array of objects, each with 'question' and 'answer' fields.
     If you cannot generate relevant questions from this transcript, return an empty array [].
     """
+
+PACKED_TRANSCRIPT_SYSTEM_INSTRUCTION = f"""
+    You will be given several separate transcripts from customer service calls about ESA (Emotional Support Animal) letters from Wellness Wag, each wrapped in a <transcript call_id="..."> tag.
+    Treat every transcript independently. For EACH transcript, generate 5-8 question-answer pairs that simulate a NATURAL conversation between a customer and a Wellness Wag support agent.
+
+{TRANSCRIPT_INSTRUCTIONS}
+    Format your response as a single JSON array of objects, each with 'call_id', 'question' and 'answer' fields.
+    'call_id' must be copied exactly from the transcript the pair was generated from.
+    If you cannot generate relevant questions from a transcript, leave it out.
+    """
+
+MD_SECTION_SYSTEM_INSTRUCTION = """
+    You will be given content from a titled section of a document about ESA (Emotional Support Animal) letters from Wellness Wag.
+    Generate 5-8 meaningful question-answer pairs that could be used to train a customer support chatbot.
+
+    Focus on:
+    1. Create a separate question for EACH specific piece of information in the content
+    2. If there are multiple states mentioned, create a separate question for EACH state
+    3. If there are specific laws or requirements mentioned, create questions about those specific details
+    4. Use simple, direct language that customers would actually use
+    5. Make sure answers are comprehensive and include all relevant details
+
+    Important guidelines:
+    - Include specific information like prices, timeframes, and requirements when mentioned
+    - Include Wellness Wag's contact info (email: hello@wellnesswag.com, phone: (415) 570-7864) when relevant
+    - Make the questions sound like real customer inquiries
+    - Ensure answers are accurate based on the provided content
+
+    Format your response as a JSON array of objects, each with 'question' and 'answer' fields.
+    """
+
+def build_transcript_content(transcript):
+    return f"""
+    Transcript:
+    {transcript}
+    """
+
+def build_transcript_window_content(window, index, count):
+    return f"""
+    Transcript (part {index + 1} of {count} of one long call; the start of this part may repeat the end of the previous one):
+    {window}
+    """
+
+def build_packed_transcript_content(calls):
+    transcripts = "\n\n".join(
+        f'    <transcript call_id="{call_id}">\n    {transcript}\n    </transcript>' for call_id, transcript in calls
+    )
+    return f"""
+    Transcripts ({len(calls)}):
+{transcripts}
+    """
+
+def build_md_section_content(section):
+    return f"""
+    Section title: "{section['title']}"
+
+    Section Content:
+    {section['content']}
+    """
+
+def build_transcript_prompt(transcript):
+    """Instruction and content as one text, as sent to models without system instruction support."""
+    return join_prompt(TRANSCRIPT_SYSTEM_INSTRUCTION, build_transcript_content(transcript))
+
+def build_transcript_window_prompt(window, index, count):
+    return join_prompt(TRANSCRIPT_SYSTEM_INSTRUCTION, build_transcript_window_content(window, index, count))
+
+def build_packed_transcript_prompt(calls):
+    """One prompt for several (call_id, transcript) pairs; answers come back tagged with their call_id."""
+    return join_prompt(PACKED_TRANSCRIPT_SYSTEM_INSTRUCTION, build_packed_transcript_content(calls))
+
+def build_md_section_prompt(section):
+    return join_prompt(MD_SECTION_SYSTEM_INSTRUCTION, build_md_section_content(section))
+
+def _request_qa_pairs(instruction, content, gemini_model, response_schema=QA_RESPONSE_SCHEMA, kind="transcript"):
+    """Send a generation prompt and return (qa_pairs, complete).
+
+    The request asks for schema-constrained JSON. Output that still fails to parse
+    cleanly keeps every complete pair (complete=False); only a response with no
+    usable pair at all raises. Every request is traced (see llm_tracing).
+    """
+    model_name = llm_cache.get_model_name(gemini_model)
+    span = llm_tracing.start_request_span(kind, model_name, join_prompt(instruction, content))
+    response = None
+    sink = _partial_sink.get()
+    stream = sink is not None and context_cache.supports_streaming(gemini_model)
     try:
-        response = gemini_model.generate_content(prompt)
-        response_text = response.text.replace('```json', '').replace('```', '').strip()
-        qa_pairs = json.loads(response_text)
-        for qa in qa_pairs:
-            if not qa['question'].endswith('?'):
-                qa['question'] += '?'
-            if qa['answer'] and not qa['answer'].endswith(('.', '!', '?')):
-                qa['answer'] += '.'
-            qa['call_id'] = call_id
-        return qa_pairs
+        # A plain dict is accepted by Gemini and keeps google.generativeai out of the import path
+        generation_config = {"response_mime_type": "application/json", "response_schema": response_schema}
+        response = context_cache.generate_content(gemini_model, instruction, content, generation_config, stream=stream)
+        if stream:
+            # Pass pairs on as they complete; the final result below still comes from the whole text
+            parser = IncrementalQAParser()
+            for chunk in response:
+                for qa in parser.feed(chunk.text):
+                    if is_valid_qa(qa):
+                        sink(_finish_qa(qa))
+        qa_pairs, complete = parse_qa_response(response.text)
+        outcome = record_parse_result(model_name, qa_pairs, complete)
+        if outcome == "failed":
+            raise QAParseError(f"Could not parse any QA pairs from the model response: {response.text[:200]!r}")
+    except Exception as e:
+        if stream and response is not None:
+            response.close()
+        span.finish(response, error=e)
+        raise
+    span.finish(response, pairs=len(qa_pairs))
+    return [_finish_qa(qa) for qa in qa_pairs], complete
+
+def _finish_qa(qa):
+    if not qa['question'].endswith('?'):
+        qa['question'] += '?'
+    if qa['answer'] and not qa['answer'].endswith(('.', '!', '?')):
+        qa['answer'] += '.'
+    return qa
+
+def request_qa_from_transcript(transcript, call_id, gemini_model):
+    """Like generate_qa_from_transcript, but raises instead of reporting to the page (safe in worker threads)."""
+    qa_pairs = llm_cache.cached_generation(
+        TRANSCRIPT_PROMPT_VERSION, gemini_model, build_transcript_prompt(transcript),
+        lambda: _request_qa_pairs(TRANSCRIPT_SYSTEM_INSTRUCTION, build_transcript_content(transcript), gemini_model))
+    for qa in qa_pairs:
+        qa['call_id'] = call_id
+    return qa_pairs
+
+def request_qa_from_transcript_window(window, index, count, gemini_model):
+    """QA pairs for one window of a long transcript (see split_transcript_windows); raises on failure."""
+    return llm_cache.cached_generation(
+        TRANSCRIPT_WINDOW_PROMPT_VERSION, gemini_model, build_transcript_window_prompt(window, index, count),
+        lambda: _request_qa_pairs(TRANSCRIPT_SYSTEM_INSTRUCTION, build_transcript_window_content(window, index, count),
+                                  gemini_model, kind="transcript_window"))
+
+def request_qa_for_packed_calls(calls, gemini_model):
+    """Send one packed prompt for several (call_id, transcript) pairs and split the answer per call.
+
+    Returns {call_id: qa_pairs} holding only the calls the response fully covered;
+    pairs tagged with an unknown call_id are dropped. Each covered call is cached on
+    its own, so later runs can reuse it whatever it gets packed with.
+    """
+    by_call = {str(call_id): call_id for call_id, _ in calls}
+    results = {}
+    qa_pairs, complete = _request_qa_pairs(PACKED_TRANSCRIPT_SYSTEM_INSTRUCTION, build_packed_transcript_content(calls),
+                                           gemini_model, PACKED_QA_RESPONSE_SCHEMA, kind="packed_transcripts")
+    for qa in qa_pairs:
+        call_id = by_call.get(str(qa.get('call_id', '')).strip())
+        if call_id is None:
+            continue
+        results.setdefault(call_id, []).append({'question': qa['question'], 'answer': qa['answer']})
+    if not complete and qa_pairs:
+        # The answer was cut off, so the last call it reached may be missing pairs; regenerate it
+        results.pop(by_call.get(str(qa_pairs[-1].get('call_id', '')).strip()), None)
+    model_name = llm_cache.get_model_name(gemini_model)
+    for call_id, transcript in calls:
+        if call_id in results:
+            llm_cache.store_cached_response(PACKED_TRANSCRIPT_PROMPT_VERSION, model_name, transcript, results[call_id])
+            for qa in results[call_id]:
+                qa['call_id'] = call_id
+    return results
+
+def request_qa_from_md_section(section, gemini_model):
+    """Like generate_qa_from_md_section, but raises instead of reporting to the page (safe in worker threads)."""
+    qa_pairs = llm_cache.cached_generation(
+        MD_SECTION_PROMPT_VERSION, gemini_model, build_md_section_prompt(section),
+        lambda: _request_qa_pairs(MD_SECTION_SYSTEM_INSTRUCTION, build_md_section_content(section), gemini_model,
+                                  kind="md_section"))
+    for qa in qa_pairs:
+        qa['section'] = section['title']
+    return qa_pairs
+
+def generate_qa_from_transcript(transcript, call_id, gemini_model, window_tokens=None):
+    """QA pairs for one call; transcripts longer than window_tokens are generated window by window in parallel."""
+    try:
+        for _, qa_pairs, error in generate_qa_for_calls([(call_id, transcript)], gemini_model,
+                                                        window_tokens=window_tokens):
+            if error:
+                raise error
+            return qa_pairs
     except Exception as e:
         st.error(f"Error generating QA from transcript: {str(e)}")
         return []
@@ -88,50 +273,550 @@ def extract_md_sections(content):
     return sections
 
 def generate_qa_from_md_section(section, gemini_model):
-    prompt = f"""
-    Below is content from a section titled "{section['title']}" about ESA (Emotional Support Animal) letters from Wellness Wag.
-    Generate 5-8 meaningful question-answer pairs that could be used to train a customer support chatbot.
-
-    Focus on:
-    1. Create a separate question for EACH specific piece of information in the content
-    2. If there are multiple states mentioned, create a separate question for EACH state
-    3. If there are specific laws or requirements mentioned, create questions about those specific details
-    4. Use simple, direct language that customers would actually use
-    5. Make sure answers are comprehensive and include all relevant details
-
-    Important guidelines:
-    - Include specific information like prices, timeframes, and requirements when mentioned
-    - Include Wellness Wag's contact info (email: hello@wellnesswag.com, phone: (415) 570-7864) when relevant
-    - Make the questions sound like real customer inquiries
-    - Ensure answers are accurate based on the provided content
-
-    Section Content:
-    {section['content']}
-
-    Format your response as a JSON array of objects, each with 'question' and 'answer' fields.
-    """
     try:
-        response = gemini_model.generate_content(prompt)
-        response_text = response.text.replace('```json', '').replace('```', '').strip()
-        qa_pairs = json.loads(response_text)
-        for qa in qa_pairs:
-            if not qa['question'].endswith('?'):
-                qa['question'] += '?'
-            if qa['answer'] and not qa['answer'].endswith(('.', '!', '?')):
-                qa['answer'] += '.'
-            qa['section'] = section['title']
-        return qa_pairs
+        return request_qa_from_md_section(section, gemini_model)
     except Exception as e:
         st.error(f"Error generating QA from section '{section['title']}': {str(e)}")
         return []
 
 def check_duplicate_qa(project_id, question, existing_qa_pairs=None):
+    """Return the project's QA pair asking the same question (after normalize_question), or None."""
     if existing_qa_pairs is None:
         existing_qa_pairs = AppDatabase.get_project_qa_pairs(project_id)
-    def normalize_text(text):
-        return re.sub(r'[^\w\s]', '', text.lower().strip())
-    normalized_question = normalize_text(question)
-    for qa in existing_qa_pairs:
-        if normalize_text(qa['question']) == normalized_question:
+    normalized_question = normalize_question(question)
+    for qa, normalized in zip(existing_qa_pairs, normalize_questions(qa['question'] for qa in existing_qa_pairs)):
+        if normalized == normalized_question:
             return qa
-    return None
\ No newline at end of file
+    return None
+
+def find_similar_qa(project_id, question, near_threshold=None):
+    """Return the project's QA pair whose question resembles question, or None.
+
+    The near-duplicate index is asked for a paraphrase whose word set overlaps
+    at least near_threshold (QA_NEAR_DUPLICATE_THRESHOLD by default, 0 to
+    skip it), then the semantic index for a question with cosine similarity
+    of at least QA_SEMANTIC_DUPLICATE_THRESHOLD. The match is a dict that also
+    has "similarity". Resembling questions can still differ (another state,
+    another pet), so matches are only flagged for the user to confirm and
+    never skipped or overridden like check_duplicate_qa's.
+    """
+    near_threshold = get_near_duplicate_threshold() if near_threshold is None else near_threshold
+    if near_threshold > 0:
+        similar = find_near_duplicate(project_id, question, near_threshold)
+        if similar:
+            return similar
+    return find_semantic_duplicate(project_id, question)
+
+# --- Concurrent generation engine ---
+
+# Defaults for the generation engine; override them with GEMINI_MAX_WORKERS, GEMINI_RPM
+# and GEMINI_TPM to match the Gemini quota of the API key
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 1000000
+
+# Rough allowance for the response when charging a request against the token bucket
+EXPECTED_OUTPUT_TOKENS = 600
+
+# Transcripts longer than this many tokens are split into windows generated in parallel
+# (override with TRANSCRIPT_WINDOW_TOKENS); consecutive windows share about
+# WINDOW_OVERLAP_TOKENS of utterances so an exchange cut at a boundary keeps its context
+DEFAULT_WINDOW_TOKENS = 4000
+WINDOW_OVERLAP_TOKENS = 300
+
+# Pairs from different windows whose questions share at least this share of words are duplicates
+WINDOW_MERGE_SIMILARITY = 0.8
+
+# How often the engine hands streamed partial pairs to on_partial while requests run
+PARTIAL_POLL_SECONDS = 0.2
+
+# Set per task by run_generation_tasks when the caller wants partial results;
+# _request_qa_pairs then streams the response and passes each pair here
+_partial_sink = contextvars.ContextVar("qa_partial_sink", default=None)
+
+def get_generation_settings():
+    """Engine settings from the environment, read at call time so .env values loaded by the page apply."""
+    return {
+        "max_workers": int(os.getenv("GEMINI_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+        "requests_per_minute": int(os.getenv("GEMINI_RPM", DEFAULT_REQUESTS_PER_MINUTE)),
+        "tokens_per_minute": int(os.getenv("GEMINI_TPM", DEFAULT_TOKENS_PER_MINUTE)),
+        "window_tokens": int(os.getenv("TRANSCRIPT_WINDOW_TOKENS", DEFAULT_WINDOW_TOKENS)),
+    }
+
+class TokenBucketLimiter:
+    """Thread-safe limiter enforcing requests/min and tokens/min with adaptive backoff.
+
+    Both budgets refill continuously. A 429 halves the effective rate and pauses
+    all workers for an exponentially growing cooldown; each success recovers a
+    little of the rate until the configured quota is reached again.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 burst_seconds=10):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_capacity = max(1.0, requests_per_minute * burst_seconds / 60)
+        self._token_capacity = max(1.0, tokens_per_minute * burst_seconds / 60)
+        self._requests = self._request_capacity
+        self._tokens = self._token_capacity
+        self._rate_scale = 1.0
+        self._cooldown_until = 0.0
+        self._consecutive_throttles = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self._request_capacity,
+                             self._requests + elapsed * self.requests_per_minute * self._rate_scale / 60)
+        self._tokens = min(self._token_capacity,
+                           self._tokens + elapsed * self.tokens_per_minute * self._rate_scale / 60)
+
+    def acquire(self, tokens=1):
+        """Block until one request costing `tokens` fits in both budgets."""
+        tokens = min(tokens, self._token_capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._cooldown_until:
+                    wait = self._cooldown_until - now
+                elif self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                else:
+                    request_rate = self.requests_per_minute * self._rate_scale / 60
+                    token_rate = self.tokens_per_minute * self._rate_scale / 60
+                    wait = max((1 - self._requests) / request_rate if self._requests < 1 else 0,
+                               (tokens - self._tokens) / token_rate if self._tokens < tokens else 0)
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+    def penalize(self):
+        """Record a 429: slow down and pause all workers before the next request."""
+        with self._lock:
+            self._consecutive_throttles += 1
+            self._rate_scale = max(0.05, self._rate_scale * 0.5)
+            backoff = min(60.0, 2.0 ** self._consecutive_throttles)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + backoff)
+            print(f"Rate limited by the model API; backing off {backoff:.0f}s at {self._rate_scale:.0%} of quota")
+
+    def reward(self):
+        """Record a success: recover toward the configured rate."""
+        with self._lock:
+            self._consecutive_throttles = 0
+            self._rate_scale = min(1.0, self._rate_scale + 0.05)
+
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+def get_shared_limiter(requests_per_minute=None, tokens_per_minute=None):
+    """Process-wide limiter per quota, so concurrent page runs share one API budget."""
+    settings = get_generation_settings()
+    requests_per_minute = requests_per_minute or settings["requests_per_minute"]
+    tokens_per_minute = tokens_per_minute or settings["tokens_per_minute"]
+    key = (requests_per_minute, tokens_per_minute)
+    with _shared_limiters_lock:
+        if key not in _shared_limiters:
+            _shared_limiters[key] = TokenBucketLimiter(requests_per_minute, tokens_per_minute)
+        return _shared_limiters[key]
+
+def run_generation_tasks(items, request_fn, prompt_fn, max_workers=None, limiter=None, breaker=None,
+                         responses_fn=None, ordered=True, on_partial=None):
+    """Run request_fn(item) for every item concurrently and yield (item, qa_pairs, error).
+
+    Results come in input order, or as soon as each finishes with ordered=False.
+    prompt_fn(item) returns the prompt text, used to charge the token budget, and
+    responses_fn(item) how many responses the prompt asks for (1 by default).
+    Failures are classified (see llm_resilience): rate limits back off through the
+    limiter, transient errors are retried with jittered exponential backoff, and
+    every non-rate-limit failure feeds the circuit breaker that pauses all workers
+    when errors spike. Items that still fail are returned with an empty result and
+    the last error, so one bad item does not stop the batch.
+
+    With on_partial, responses are streamed and on_partial(item, qa) is called
+    from the consuming thread for each pair as it is generated, before the item's
+    result is yielded. Pairs from an attempt that later fails are passed on too;
+    the yielded result is authoritative.
+    """
+    limiter = limiter or get_shared_limiter()
+    breaker = breaker or get_shared_breaker()
+    max_workers = max_workers or get_generation_settings()["max_workers"]
+
+    partials = queue.Queue() if on_partial else None
+
+    def run_one(item):
+        if partials is not None:
+            _partial_sink.set(lambda qa: partials.put((item, qa)))
+        cost = estimate_tokens(prompt_fn(item)) + EXPECTED_OUTPUT_TOKENS * (responses_fn(item) if responses_fn else 1)
+        attempts = {}
+        while True:
+            breaker.wait()
+            limiter.acquire(cost)
+            llm_tracing.set_attempt(sum(attempts.values()))
+            try:
+                result = request_fn(item)
+                limiter.reward()
+                breaker.record(True)
+                return item, result, None
+            except Exception as e:
+                kind = classify_error(e)
+                attempt = attempts.get(kind, 0)
+                if kind == RATE_LIMIT:
+                    limiter.penalize()
+                else:
+                    breaker.record(False)
+                if not should_retry(kind, attempt):
+                    return item, [], e
+                attempts[kind] = attempt + 1
+                if kind != RATE_LIMIT:
+                    time.sleep(backoff_delay(attempt))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        # Each request runs in a copy of the caller's context so the traced project reaches the workers
+        futures = [executor.submit(contextvars.copy_context().run, run_one, item) for item in items]
+        positions = {future: i for i, future in enumerate(futures)}
+        pending, finished, next_position = set(futures), {}, 0
+        while pending:
+            done, pending = wait(pending, timeout=PARTIAL_POLL_SECONDS if partials is not None else None,
+                                 return_when=FIRST_COMPLETED)
+            while partials is not None and not partials.empty():
+                on_partial(*partials.get())
+            for future in done:
+                if ordered:
+                    finished[positions[future]] = future.result()
+                else:
+                    yield future.result()
+            while next_position in finished:
+                yield finished.pop(next_position)
+                next_position += 1
+    finally:
+        # If the consumer stops early (e.g. a Streamlit rerun), drop the queued requests
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Packing defaults: transcript tokens per packed prompt, and a cap on calls per prompt
+# so the combined answer (5-8 pairs per call) stays well inside the output token limit
+DEFAULT_PACK_TOKEN_BUDGET = 6000
+MAX_CALLS_PER_PACK = 8
+
+def pack_calls(calls, token_budget=DEFAULT_PACK_TOKEN_BUDGET, max_calls=MAX_CALLS_PER_PACK):
+    """Greedily group (call_id, transcript) pairs into packs whose transcripts fit the token budget.
+
+    A transcript larger than the budget ends up alone in its pack.
+    """
+    packs, current, current_tokens = [], [], 0
+    for call in calls:
+        tokens = estimate_tokens(call[1])
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_calls):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(call)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+def split_transcript_windows(transcript, window_tokens=DEFAULT_WINDOW_TOKENS, overlap_tokens=WINDOW_OVERLAP_TOKENS):
+    """Split a transcript on utterance (line) boundaries into windows of about window_tokens.
+
+    Each window after the first starts with the last utterances of the previous
+    one, up to overlap_tokens. A single utterance longer than a window is cut at
+    whitespace.
+    """
+    max_chars = window_tokens * 4
+    utterances = []
+    for line in transcript.splitlines():
+        line = line.strip()
+        while len(line) > max_chars:
+            cut = line.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            utterances.append(line[:cut])
+            line = line[cut:].strip()
+        if line:
+            utterances.append(line)
+
+    windows, current, current_tokens = [], [], 0
+    for utterance in utterances:
+        tokens = estimate_tokens(utterance)
+        if current and current_tokens + tokens > window_tokens:
+            windows.append("\n".join(current))
+            overlap, overlap_used = [], 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if overlap_used + previous_tokens > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_used += previous_tokens
+            current, current_tokens = overlap, overlap_used
+        current.append(utterance)
+        current_tokens += tokens
+    if current:
+        windows.append("\n".join(current))
+    return windows
+
+def _question_words(question):
+    return set(re.sub(r'[^\w\s]', '', question.lower()).split())
+
+def merge_qa_sets(qa_sets, similarity=WINDOW_MERGE_SIMILARITY):
+    """Concatenate per-window QA lists, dropping pairs whose question repeats one already kept.
+
+    Questions count as repeats when their word sets overlap by at least
+    `similarity` (Jaccard), which catches the rewordings overlapping windows
+    tend to produce as well as exact repeats.
+    """
+    merged, kept_words = [], []
+    for qa_pairs in qa_sets:
+        for qa in qa_pairs:
+            words = _question_words(qa['question'])
+            if any(len(words & other) / max(1, len(words | other)) >= similarity for other in kept_words):
+                continue
+            kept_words.append(words)
+            merged.append(qa)
+    return merged
+
+def _track_dead_letters(results, project_id, item_type, key_fn, payload_fn):
+    """Pass (item, qa_pairs, error) results through, dead-lettering failures and clearing recovered items."""
+    for item, qa_pairs, error in results:
+        if project_id is not None:
+            if error:
+                record_dead_letter(project_id, item_type, key_fn(item), payload_fn(item), error)
+            else:
+                AppDatabase.resolve_dead_letter(project_id, item_type, key_fn(item))
+        yield item, qa_pairs, error
+
+def _content_key(*parts):
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+def generate_qa_for_calls(calls, gemini_model, max_workers=None, limiter=None, pack_token_budget=None,
+                          dead_letter_project_id=None, ordered=True, window_tokens=None):
+    """Generate QA for (call_id, transcript) pairs concurrently; yields (call_id, qa_pairs, error).
+
+    Without pack_token_budget each call is its own request and results arrive in
+    input order (or as they finish with ordered=False). With it, short transcripts
+    are packed into shared requests (see pack_calls) and results arrive per
+    finished pack; calls a packed response failed to cover are retried with their
+    own request. Transcripts longer than window_tokens are mapped to overlapping
+    windows that run in parallel with everything else and reduced with
+    merge_qa_sets, so a long call takes about as long as one window. With
+    dead_letter_project_id, calls that still fail are kept in that project's
+    dead-letter list.
+    """
+    window_tokens = window_tokens or get_generation_settings()["window_tokens"]
+    results = _generate_qa_for_calls(calls, gemini_model, max_workers, limiter, pack_token_budget, ordered,
+                                     window_tokens)
+    return _track_dead_letters(results, dead_letter_project_id, "call", lambda call_id: call_id,
+                               lambda call_id: {"call_id": call_id})
+
+def _generate_qa_for_calls(calls, gemini_model, max_workers, limiter, pack_token_budget, ordered, window_tokens):
+    if not pack_token_budget:
+        yield from _generate_qa_for_call_windows(calls, gemini_model, max_workers, limiter, ordered, window_tokens)
+        return
+
+    model_name = llm_cache.get_model_name(gemini_model)
+    pending = []
+    for call_id, transcript in calls:
+        cached = llm_cache.get_cached_response(PACKED_TRANSCRIPT_PROMPT_VERSION, model_name, transcript)
+        if cached is None:
+            cached = llm_cache.get_cached_response(TRANSCRIPT_PROMPT_VERSION, model_name,
+                                                   build_transcript_prompt(transcript))
+        if cached is None:
+            pending.append((call_id, transcript))
+            continue
+        for qa in cached:
+            qa['call_id'] = call_id
+        yield call_id, cached, None
+
+    # Long calls are not packed; they are generated window by window with the other leftovers
+    fallback = [call for call in pending if estimate_tokens(call[1]) > window_tokens]
+    packs = pack_calls([call for call in pending if estimate_tokens(call[1]) <= window_tokens], pack_token_budget)
+    fallback += [pack[0] for pack in packs if len(pack) == 1]
+    results = run_generation_tasks(
+        [pack for pack in packs if len(pack) > 1],
+        lambda pack: request_qa_for_packed_calls(pack, gemini_model),
+        build_packed_transcript_prompt,
+        max_workers=max_workers, limiter=limiter, responses_fn=len, ordered=ordered,
+    )
+    for pack, covered, error in results:
+        if error:
+            print(f"Packed request for {len(pack)} calls failed, retrying them one by one: {error}")
+        for call_id, transcript in pack:
+            if covered and call_id in covered:
+                yield call_id, covered[call_id], None
+            else:
+                fallback.append((call_id, transcript))
+
+    if fallback:
+        yield from _generate_qa_for_call_windows(fallback, gemini_model, max_workers, limiter, ordered, window_tokens)
+
+def _generate_qa_for_call_windows(calls, gemini_model, max_workers, limiter, ordered, window_tokens):
+    """One request per call, or per window for long calls; window results are merged per call.
+
+    A call with any failed window is reported as failed with no pairs; its
+    successful windows are cached, so a retry only repeats the failed ones.
+    """
+    tasks = []
+    for call_id, transcript in calls:
+        if estimate_tokens(transcript) <= window_tokens:
+            tasks.append((call_id, transcript, None, 1))
+            continue
+        windows = split_transcript_windows(transcript, window_tokens)
+        tasks.extend((call_id, window, index, len(windows)) for index, window in enumerate(windows))
+
+    def request(task):
+        call_id, text, index, count = task
+        if index is None:
+            return request_qa_from_transcript(text, call_id, gemini_model)
+        return request_qa_from_transcript_window(text, index, count, gemini_model)
+
+    def prompt(task):
+        call_id, text, index, count = task
+        return build_transcript_prompt(text) if index is None else build_transcript_window_prompt(text, index, count)
+
+    window_results = {}
+    for (call_id, _, index, count), qa_pairs, error in run_generation_tasks(
+            tasks, request, prompt, max_workers=max_workers, limiter=limiter, ordered=ordered):
+        if index is None:
+            yield call_id, qa_pairs, error
+            continue
+        window_results.setdefault(call_id, {})[index] = (qa_pairs, error)
+        if len(window_results[call_id]) < count:
+            continue
+        done = window_results.pop(call_id)
+        parts = [done[i] for i in range(count)]
+        errors = [error for _, error in parts if error]
+        if errors:
+            yield call_id, [], errors[0]
+            continue
+        qa_pairs = merge_qa_sets([pairs for pairs, _ in parts])
+        for qa in qa_pairs:
+            qa['call_id'] = call_id
+        yield call_id, qa_pairs, None
+
+def generate_qa_for_chunks(chunks, gemini_model, max_workers=None, limiter=None, dead_letter_project_id=None,
+                           ordered=True, on_partial=None):
+    """Generate QA for plain-text document chunks concurrently; yields (chunk, qa_pairs, error).
+
+    ordered and on_partial are passed to run_generation_tasks.
+    """
+    results = run_generation_tasks(
+        chunks,
+        lambda chunk: request_qa_from_transcript(chunk, None, gemini_model),
+        build_transcript_prompt,
+        max_workers=max_workers, limiter=limiter, ordered=ordered, on_partial=on_partial,
+    )
+    return _track_dead_letters(results, dead_letter_project_id, "chunk", _content_key,
+                               lambda chunk: {"text": chunk})
+
+def generate_qa_for_md_sections(sections, gemini_model, max_workers=None, limiter=None, dead_letter_project_id=None,
+                                ordered=True, on_partial=None):
+    """Generate QA for markdown sections concurrently; yields (section, qa_pairs, error).
+
+    ordered and on_partial are passed to run_generation_tasks.
+    """
+    results = run_generation_tasks(
+        sections,
+        lambda section: request_qa_from_md_section(section, gemini_model),
+        build_md_section_prompt,
+        max_workers=max_workers, limiter=limiter, ordered=ordered, on_partial=on_partial,
+    )
+    return _track_dead_letters(results, dead_letter_project_id, "md_section",
+                               lambda section: _content_key(section['title'], section['content']),
+                               lambda section: {"title": section['title'], "content": section['content']})
+
+def document_chunk_hash(item):
+    """Fingerprint of a plain-text chunk, or of a markdown section's title and content, as sent for generation."""
+    if isinstance(item, dict):
+        return text_sha256(f"{item['title']}\x00{item['content']}")
+    return text_sha256(item)
+
+def plan_document_generation(project_id, file_name, items, kind, model_name, regenerate=False):
+    """Split a re-uploaded document's chunks ("chunk") or sections ("md_section") by what changed.
+
+    Returns (pending, unchanged, removed_hashes): the items to generate (new,
+    changed, failed last time, or generated with another prompt version or
+    model; all of them with regenerate=True), how many were skipped as already
+    generated, and the hashes of chunks in the document's lineage that this
+    upload no longer contains. A chunk repeated in the document is generated once.
+    """
+    states = AppDatabase.get_document_chunk_states(project_id, file_name)
+    prompt_version = DOCUMENT_PROMPT_VERSIONS[kind]
+    pending, seen, unchanged = [], set(), 0
+    for item in items:
+        chunk_hash = document_chunk_hash(item)
+        if chunk_hash in seen:
+            continue
+        seen.add(chunk_hash)
+        state = states.get(chunk_hash)
+        if (not regenerate and state is not None and state["status"] == "done"
+                and state["prompt_version"] == prompt_version and state["model_name"] == model_name):
+            unchanged += 1
+        else:
+            pending.append(item)
+    removed = [chunk_hash for chunk_hash, state in states.items()
+               if chunk_hash not in seen and state["status"] != "removed"]
+    return pending, unchanged, removed
+
+def record_document_generation(project_id, file_name, document_id, kind, results, model_name, removed_hashes):
+    """Store the (item, qa_pairs, error) results for plan_document_generation's pending items.
+
+    Only failed items and items that produced no pairs are recorded here;
+    the others are marked done by record_saved_document_pairs once some of
+    their pairs are saved, so pairs that are deselected or never saved are
+    generated again on the next upload. Chunks in removed_hashes are marked removed.
+    """
+    return AppDatabase.record_document_chunks(
+        project_id, file_name, document_id,
+        [(document_chunk_hash(item), item['title'] if isinstance(item, dict) else None, 0,
+          str(error) if error else None) for item, qa_pairs, error in results if error or not qa_pairs],
+        DOCUMENT_PROMPT_VERSIONS[kind], model_name, removed_hashes)
+
+def record_saved_document_pairs(project_id, file_name, document_id, kind, model_name, chunk_titles, chunk_links):
+    """Mark the chunks that saved QA pairs came from as done and link the pairs to them.
+
+    chunk_links are (chunk_hash, qa_id) of the stored pairs and chunk_titles
+    maps chunk hashes to their titles (None for plain-text chunks).
+    """
+    pair_counts = {}
+    for chunk_hash, _ in chunk_links:
+        pair_counts[chunk_hash] = pair_counts.get(chunk_hash, 0) + 1
+    AppDatabase.record_document_chunks(
+        project_id, file_name, document_id,
+        [(chunk_hash, chunk_titles.get(chunk_hash), count, None) for chunk_hash, count in pair_counts.items()],
+        DOCUMENT_PROMPT_VERSIONS[kind], model_name)
+    return AppDatabase.link_document_chunk_qa_pairs(project_id, file_name, chunk_links)
+
+def retry_dead_letters(project_id, gemini_model, max_workers=None, pack_token_budget=None, window_tokens=None):
+    """Retry every item in the project's dead-letter list; yields (dead_letter, qa_pairs, error).
+
+    Items that succeed are removed from the list, items that fail again stay with
+    a bumped attempt count. Calls that no longer exist are dropped.
+    """
+    letters = {(letter["item_type"], letter["item_key"]): letter for letter in AppDatabase.get_dead_letters(project_id)}
+    calls, chunks, sections = [], [], []
+    for (item_type, item_key), letter in letters.items():
+        payload = json.loads(letter["payload"])
+        if item_type == "call":
+            call = AppDatabase.get_call(project_id, item_key)
+            if call and call["transcript"]:
+                calls.append((item_key, call["transcript"]))
+            else:
+                AppDatabase.remove_dead_letters(project_id, [letter["id"]])
+        elif item_type == "chunk":
+            chunks.append(payload["text"])
+        elif item_type == "md_section":
+            sections.append(payload)
+
+    for call_id, qa_pairs, error in generate_qa_for_calls(calls, gemini_model, max_workers=max_workers,
+                                                          pack_token_budget=pack_token_budget,
+                                                          dead_letter_project_id=project_id,
+                                                          window_tokens=window_tokens):
+        yield letters[("call", call_id)], qa_pairs, error
+    for chunk, qa_pairs, error in generate_qa_for_chunks(chunks, gemini_model, max_workers=max_workers,
+                                                         dead_letter_project_id=project_id):
+        yield letters[("chunk", _content_key(chunk))], qa_pairs, error
+    for section, qa_pairs, error in generate_qa_for_md_sections(sections, gemini_model, max_workers=max_workers,
+                                                                dead_letter_project_id=project_id):
+        yield letters[("md_section", _content_key(section['title'], section['content']))], qa_pairs, error
@@ -0,0 +1,286 @@
+import importlib
+import json
+import os
+import threading
+import numpy as np
+from utils.db import AppDatabase
+from utils.text_normalize import normalize_questions
+
+INDEX_DIR = os.path.join("cache", "semantic_index")
+
+# Width of the built-in hashed TF-IDF vectors; override with SEMANTIC_INDEX_DIMENSIONS
+DEFAULT_DIMENSIONS = 256
+
+# Character n-gram sizes of the built-in vectors, taken over the normalized question
+NGRAM_SIZES = (3, 4, 5)
+
+# Hash buckets for the n-gram document frequencies behind the IDF weights
+DF_BUCKETS = 1 << 20
+
+# Questions at or above this cosine similarity count as duplicates when saving;
+# override with QA_SEMANTIC_DUPLICATE_THRESHOLD, or set it to 0 to turn the check off
+DEFAULT_SEMANTIC_DUPLICATE_THRESHOLD = 0.9
+
+# Number of questions listed under "Similar questions"
+DEFAULT_SIMILAR_QUESTIONS = 5
+
+# Rows are added this many at a time, and the matrix grows at least this much
+EMBED_BATCH_SIZE = 5000
+
+# Once this share of the rows belong to deleted pairs the index is rebuilt from the database
+MAX_DELETED_SHARE = 0.25
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_semantic_duplicate_threshold():
+    return float(os.getenv("QA_SEMANTIC_DUPLICATE_THRESHOLD", DEFAULT_SEMANTIC_DUPLICATE_THRESHOLD))
+
+def _ngram_hashes(texts):
+    """(text index, uint32 hash) of every character n-gram of the normalized texts, for the whole batch at once."""
+    encoded = [f" {text} ".encode("utf-8") for text in normalize_questions(texts)]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint32)
+    text_of = np.repeat(np.arange(len(encoded)), lengths)
+    ends = np.cumsum(lengths)[text_of]
+    texts_out, hashes_out = [], []
+    for size in NGRAM_SIZES:
+        count = len(data) - size + 1
+        if count <= 0:
+            continue
+        # FNV-1a over the n-gram's bytes, computed for every start position in one pass per byte
+        hashes = np.full(count, 2166136261 ^ size, dtype=np.uint32)
+        for k in range(size):
+            hashes = (hashes ^ data[k:k + count]) * np.uint32(16777619)
+        hashes ^= hashes >> 15
+        hashes *= np.uint32(0x2C1B3C6D)
+        hashes ^= hashes >> 12
+        inside = np.arange(count) + size <= ends[:count]
+        texts_out.append(text_of[:count][inside])
+        hashes_out.append(hashes[inside])
+    if not hashes_out:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32)
+    return np.concatenate(texts_out), np.concatenate(hashes_out)
+
+def tfidf_vectors(ngrams, text_count, dimensions, df, documents):
+    """Signed, hashed TF-IDF vectors of text_count texts from their _ngram_hashes, as float32 rows.
+
+    df holds n-gram document frequencies per hash bucket and documents the
+    number of texts counted into it; the IDF weights are taken from them as
+    they are when a text is embedded.
+    """
+    text_of, hashes = ngrams
+    buckets = (hashes % DF_BUCKETS).astype(np.int64)
+    idf = np.log((1 + documents) / (1 + df[buckets])) + 1
+    signs = np.where(hashes & np.uint32(0x80000000), -1.0, 1.0)
+    cells = text_of * dimensions + (hashes >> 20) % dimensions
+    vectors = np.bincount(cells, weights=signs * idf, minlength=text_count * dimensions)
+    return vectors.reshape(text_count, dimensions).astype(np.float32)
+
+def count_document_frequencies(ngrams, df):
+    """Add n-grams from _ngram_hashes to df, each counted once per text."""
+    text_of, hashes = ngrams
+    keys = np.sort(text_of * DF_BUCKETS + (hashes % DF_BUCKETS))
+    present = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    df += np.bincount(present % DF_BUCKETS, minlength=DF_BUCKETS).astype(df.dtype)
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _load_embedder(spec):
+    """The function named by SEMANTIC_EMBEDDER ("package.module:function"); it maps a list of texts to rows."""
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+class SemanticIndex:
+    """Question vectors of one project in memory-mapped files under cache/semantic_index/<project_id>/.
+
+    vectors.f32 holds one L2-normalized row per QA pair and ids.i64 the
+    matching QA id (-1 once the pair is deleted), so a query is a single
+    matrix-vector product over the mapped rows. The index follows the database
+    incrementally: pairs with ids above the highest indexed one are embedded
+    and appended, deleted ones are blanked, and it is rebuilt when too many
+    rows are blank or the embedder changed. By default the rows are hashed
+    TF-IDF vectors of character n-grams; SEMANTIC_EMBEDDER can name a local
+    embedding function to use instead.
+    """
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.directory = os.path.join(INDEX_DIR, str(project_id))
+        self.embedder = os.getenv("SEMANTIC_EMBEDDER") or "tfidf"
+        self._embed = None if self.embedder == "tfidf" else _load_embedder(self.embedder)
+        self.dimensions = int(os.getenv("SEMANTIC_INDEX_DIMENSIONS", DEFAULT_DIMENSIONS))
+        self.meta = None
+        self.vectors = self.ids = self.df = None
+        self.rows = {}
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _empty_meta(self):
+        return {"embedder": self.embedder, "dimensions": self.dimensions, "count": 0, "capacity": 0,
+                "max_id": 0, "documents": 0, "data_version": None}
+
+    def _load(self):
+        meta_path = self._path("meta.json")
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("embedder") != self.embedder or (self._embed is None and
+                                                          meta.get("dimensions") != self.dimensions):
+                meta = None
+        if meta is None:
+            self._reset()
+            return
+        self.meta = meta
+        self.dimensions = meta["dimensions"]
+        self._map_files()
+        self.rows = {int(qa_id): row for row, qa_id in enumerate(self.ids[:meta["count"]]) if qa_id >= 0}
+
+    def _reset(self):
+        # Unmap before truncating: touching a mapped page past the end of its file is fatal
+        self.vectors = self.ids = self.df = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.meta = self._empty_meta()
+        for name in ("vectors.f32", "ids.i64"):
+            open(self._path(name), "wb").close()
+        if self._embed is None:
+            np.zeros(DF_BUCKETS, dtype=np.int32).tofile(self._path("df.i32"))
+        self.rows = {}
+        self._map_files()
+        self._save_meta()
+
+    def _map_files(self):
+        capacity = self.meta["capacity"]
+        if capacity:
+            self.vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+",
+                                     shape=(capacity, self.meta["dimensions"]))
+            self.ids = np.memmap(self._path("ids.i64"), dtype=np.int64, mode="r+", shape=(capacity,))
+        else:
+            self.vectors = np.zeros((0, self.meta["dimensions"]), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+        if self._embed is None:
+            self.df = np.memmap(self._path("df.i32"), dtype=np.int32, mode="r+", shape=(DF_BUCKETS,))
+
+    def _save_meta(self):
+        for array in (self.vectors, self.ids, self.df):
+            if isinstance(array, np.memmap):
+                array.flush()
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * self.meta["capacity"], EMBED_BATCH_SIZE)
+        self.vectors = self.ids = None
+        # Extending the files zero-fills the new rows; the mapped rows keep their contents
+        for name, row_bytes in (("vectors.f32", 4 * self.meta["dimensions"]), ("ids.i64", 8)):
+            with open(self._path(name), "r+b") as f:
+                f.truncate(capacity * row_bytes)
+        self.meta["capacity"] = capacity
+        self._map_files()
+
+    def embed(self, texts, ngrams=None):
+        if self._embed is None:
+            ngrams = _ngram_hashes(texts) if ngrams is None else ngrams
+            return _normalize_rows(tfidf_vectors(ngrams, len(texts), self.meta["dimensions"], self.df,
+                                                 self.meta["documents"]))
+        return _normalize_rows(np.asarray(self._embed(list(texts)), dtype=np.float32))
+
+    def _add(self, qa_ids, questions):
+        ngrams = None
+        if self._embed is None:
+            ngrams = _ngram_hashes(questions)
+            count_document_frequencies(ngrams, self.df)
+            self.meta["documents"] += len(questions)
+        vectors = self.embed(questions, ngrams)
+        start = self.meta["count"]
+        if self.meta["capacity"] == 0:
+            # A plugged-in embedder decides the width of the rows
+            self.meta["dimensions"] = vectors.shape[1]
+        if start + len(qa_ids) > self.meta["capacity"]:
+            self._grow(start + len(qa_ids))
+        self.vectors[start:start + len(qa_ids)] = vectors
+        self.ids[start:start + len(qa_ids)] = qa_ids
+        self.rows.update((qa_id, start + offset) for offset, qa_id in enumerate(qa_ids))
+        self.meta["count"] = start + len(qa_ids)
+        self.meta["max_id"] = max(self.meta["max_id"], max(qa_ids))
+
+    def _remove(self, qa_ids):
+        for qa_id in qa_ids:
+            row = self.rows.pop(qa_id, None)
+            if row is not None:
+                self.ids[row] = -1
+                self.vectors[row] = 0
+
+    def refresh(self):
+        """Bring the index up to date with the project's QA pairs; a no-op while the data version is unchanged."""
+        data_version = AppDatabase.get_data_version(self.project_id)
+        if self.meta["data_version"] == data_version:
+            return
+        pair_count, last_id = AppDatabase.get_qa_pair_stats(self.project_id)
+        if last_id < self.meta["max_id"]:
+            # Ids went backwards, so the database was recreated
+            self._reset()
+        for rows in AppDatabase.iter_qa_questions(self.project_id, self.meta["max_id"], EMBED_BATCH_SIZE):
+            self._add([row["id"] for row in rows], [row["question"] for row in rows])
+        if len(self.rows) > pair_count:
+            self._remove(set(self.rows) - AppDatabase.get_qa_pair_ids(self.project_id))
+        if self.meta["count"] and 1 - len(self.rows) / self.meta["count"] > MAX_DELETED_SHARE:
+            self._reset()
+            for rows in AppDatabase.iter_qa_questions(self.project_id, 0, EMBED_BATCH_SIZE):
+                self._add([row["id"] for row in rows], [row["question"] for row in rows])
+        self.meta["data_version"] = data_version
+        self._save_meta()
+
+    def search(self, texts, k=DEFAULT_SIMILAR_QUESTIONS, exclude_ids=()):
+        """Top-k (qa_id, cosine similarity) lists for each text, best first."""
+        count = self.meta["count"]
+        if not count or not len(texts):
+            return [[] for _ in texts]
+        queries = self.embed(texts)
+        scores = queries @ np.asarray(self.vectors[:count]).T
+        ids = np.asarray(self.ids[:count])
+        scores[:, ids < 0] = -np.inf
+        for qa_id in exclude_ids:
+            row = self.rows.get(qa_id)
+            if row is not None:
+                scores[:, row] = -np.inf
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-query_scores[candidates])]
+            results.append([(int(ids[row]), float(query_scores[row])) for row in ranked
+                            if np.isfinite(query_scores[row])])
+        return results
+
+def get_semantic_index(project_id):
+    """The project's SemanticIndex for this process, refreshed from the database."""
+    index = _indexes.get(project_id)
+    if index is None:
+        index = _indexes[project_id] = SemanticIndex(project_id)
+    index.refresh()
+    return index
+
+def find_similar_questions(project_id, question, k=DEFAULT_SIMILAR_QUESTIONS, exclude_ids=()):
+    """The project's k QA pairs whose questions are closest to question, as rows plus "similarity"."""
+    with _indexes_lock:
+        matches = get_semantic_index(project_id).search([question], k, exclude_ids)[0]
+    pairs = AppDatabase.get_qa_pairs_by_ids(project_id, [qa_id for qa_id, _ in matches])
+    return [dict(pairs[qa_id], similarity=similarity) for qa_id, similarity in matches if qa_id in pairs]
+
+def find_semantic_duplicate(project_id, question, threshold=None):
+    """The project's QA pair most similar to question if its cosine similarity reaches threshold, else None."""
+    threshold = get_semantic_duplicate_threshold() if threshold is None else threshold
+    if threshold <= 0:
+        return None
+    matches = find_similar_questions(project_id, question, k=1)
+    if matches and matches[0]["similarity"] >= threshold:
+        return matches[0]
+    return None
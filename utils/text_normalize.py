@@ -0,0 +1,71 @@
+import re
+
+# Characters kept by document normalization besides word characters and whitespace
+_KEPT_PUNCTUATION = r'\.,;:?!\'"-'
+
+_SPECIAL_CHARS = re.compile(rf'[^\w\s{_KEPT_PUNCTUATION}]')
+# The same replacement for ASCII text, done by str.translate instead of a regex scan
+_ASCII_SPECIAL_TABLE = str.maketrans({chr(c): ' ' for c in range(128) if _SPECIAL_CHARS.match(chr(c))})
+_WHITESPACE_RUNS = re.compile(r'\s{2,}')
+_LINE_END_COLON = re.compile(r':$', re.MULTILINE)
+_SECTION_HEADER = re.compile(r'[a-z0-9\s]+:')
+_QUESTION_PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Lines ending in ':' whose text before the first ':' has at most this many words are sub-headers
+MAX_SUB_HEADER_WORDS = 5
+
+def _collapse_whitespace(match):
+    run = match.group(0)
+    # Blank lines collapse to one newline; any other run becomes a space
+    return '\n' if run.count('\n') == len(run) else ' '
+
+def _header_prefix(line):
+    if _SECTION_HEADER.fullmatch(line):
+        return "## "
+    if len(line.split(':')[0].split()) <= MAX_SUB_HEADER_WORDS:
+        return "### "
+    return ""
+
+def _mark_headers(text):
+    parts, last = [], 0
+    for match in _LINE_END_COLON.finditer(text):
+        start = text.rfind('\n', 0, match.start()) + 1
+        prefix = _header_prefix(text[start:match.end()])
+        if prefix:
+            parts.extend((text[last:start], prefix))
+            last = start
+    if not parts:
+        return text
+    parts.append(text[last:])
+    return ''.join(parts)
+
+def normalize_document(text):
+    """Lowercase a document, drop special characters, collapse whitespace and mark header lines.
+
+    Gives exactly the result of the original step-by-step preprocessing (four
+    substitutions, then a Python pass over every line) with one scan for
+    special characters (a translate for ASCII text), one for whitespace runs
+    and one for lines ending in ':'. Lines need no stripping of their own:
+    after the runs are collapsed no newline has whitespace next to it.
+    """
+    text = text.lower()
+    text = text.translate(_ASCII_SPECIAL_TABLE) if text.isascii() else _SPECIAL_CHARS.sub(' ', text)
+    text = _WHITESPACE_RUNS.sub(_collapse_whitespace, text).strip()
+    return _mark_headers(text)
+
+def normalize_documents(texts):
+    """normalize_document for many transcripts or documents."""
+    return [normalize_document(text) for text in texts]
+
+def normalize_question(text):
+    """Key used to match duplicate questions: lowercase with punctuation removed."""
+    return _QUESTION_PUNCTUATION.sub('', text.lower().strip())
+
+def normalize_questions(texts):
+    """normalize_question for many questions, e.g. a project's existing pairs."""
+    sub = _QUESTION_PUNCTUATION.sub
+    return [sub('', text.lower().strip()) for text in texts]
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for rate limiting and budgeting."""
+    return max(1, len(text) // 4)